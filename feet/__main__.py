@@ -21,6 +21,11 @@ from feet.commands.run import RunCommand
 from feet.commands.load import LoadCommand
 from feet.commands.drop import DropCommand
 from feet.commands.extract import ExtractCommand
+from feet.commands.migrate import MigrateCommand
+from feet.commands.export import ExportCommand
+from feet.commands.importer import ImportCommand
+from feet.commands.sync import SyncCommand
+from feet.commands.compact import CompactCommand
 log = logging.getLogger(__name__)
 
 DESCRIPTION = "Management and administration commands for Feet"
@@ -29,7 +34,12 @@ COMMANDS = (
     RunCommand,
     LoadCommand,
     DropCommand,
-    ExtractCommand
+    ExtractCommand,
+    MigrateCommand,
+    ExportCommand,
+    ImportCommand,
+    SyncCommand,
+    CompactCommand
 )
 
 
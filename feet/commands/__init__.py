@@ -6,3 +6,8 @@ from .run import RunCommand
 from .load import LoadCommand
 from .extract import ExtractCommand
 from .drop import DropCommand
+from .migrate import MigrateCommand
+from .export import ExportCommand
+from .importer import ImportCommand
+from .sync import SyncCommand
+from .compact import CompactCommand
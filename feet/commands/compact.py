@@ -0,0 +1,85 @@
+# -*- coding: utf8 -*-
+# Compact the languages of entity dictionaries
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+from commis import Command
+from commis import color
+from feet.config import settings
+from feet.entities.registry import Registry
+
+
+class CompactCommand(Command):
+
+    name = 'compact'
+    help = 'build again the Bloom filters and trigram indexes of entity ' \
+           'dictionaries'
+    args = {
+        '--registry': {
+            'metavar': 'REGISTRY',
+            'default': 'feet',
+            'required': False,
+            'help': 'registry of entities'
+        },
+        '--entity': {
+            'metavar': 'ENTITY',
+            'required': False,
+            'help': 'entity dictionary, all dictionaries if omitted'
+        },
+        '--lang': {
+            'metavar': 'LANG',
+            'required': False,
+            'help': 'language of entities, all languages if omitted'
+        },
+        '--prefix': {
+            'metavar': 'PREFIX',
+            'default': 'feet',
+            'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms read per pipeline'
+        },
+        '--trigrams': {
+            'action': 'store_true',
+            'help': 'build again the trigram indexes of typo tolerant '
+                    'lookups, always done with the fuzzy index setting'
+        }
+    }
+
+    def handle(self, args):
+        """
+        CLI to compact the languages of entity dictionaries.
+        """
+        registry = Registry.find_or_create(args.registry,
+                                           key_prefix=args.prefix)
+        trigrams = args.trigrams or settings.fuzzy.index
+        if args.entity is not None:
+            names = [args.entity]
+        else:
+            names = sorted(registry.dictionaries())
+        for name in names:
+            dictionary = registry.get_dict(name)
+            if args.lang is not None:
+                languages = [args.lang]
+            else:
+                languages = sorted(dictionary.languages())
+            for lang in languages:
+                count = dictionary.compact(lang, args.batch_size,
+                                           trigrams)
+                if trigrams:
+                    print('+ %s %s: trigram index built' % (name, lang))
+                if not settings.bloom.enabled:
+                    continue
+                if count is None:
+                    print('* %s %s: Bloom filter kept' % (
+                        color.format(name, color.YELLOW), lang))
+                else:
+                    print('+ %s %s: Bloom filter of %d tokens' % (
+                        name, lang, count))
+        return '* %d dictionaries compacted' % len(names)
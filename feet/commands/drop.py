@@ -10,12 +10,13 @@ from commis import Command
 from commis import color
 
 from feet.entities.registry import Registry
+from feet.entities.dictionary import CSVDictionary
 
 
 class DropCommand(Command):
 
     name = 'drop'
-    help = 'Drop an entity dictionary'
+    help = 'Drop an entity dictionary or the terms listed in a file'
     args = {
         '--registry': {
             'metavar': 'REGISTRY',
@@ -28,10 +29,31 @@ class DropCommand(Command):
             'required': True,
             'help': 'entity dictionary'
         },
+        '--txt': {
+            'metavar': 'PLAIN_FILE',
+            'required': False,
+            'help': 'path to a plain text file of terms to delete'
+        },
+        '--csv': {
+            'metavar': 'CSV_FILE',
+            'required': False,
+            'help': 'path to a csv file of terms to delete'
+        },
+        '--lang': {
+            'metavar': 'LANG',
+            'default': 'en',
+            'help': 'language of terms to delete'
+        },
         '--prefix': {
             'metavar': 'PREFIX',
             'default': 'feet',
             'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms deleted per pipeline'
         }
     }
 
@@ -39,6 +61,8 @@ class DropCommand(Command):
         """
         CLI to drop an entity dictionary.
         """
+        if args.txt is not None or args.csv is not None:
+            return self.drop_terms(args)
         registry = Registry.find_or_create(args.registry,
                                            key_prefix=args.prefix)
         if registry.del_dict(args.entity):
@@ -47,3 +71,27 @@ class DropCommand(Command):
         else:
             return '* %s unknown dictionary' % (color.format(args.entity,
                                                              color.RED))
+
+    def drop_terms(self, args):
+        """
+        Deletes the terms listed in a file from an entity dictionary.
+        """
+        if args.csv is not None:
+            registry = Registry.find_or_create(args.registry,
+                                               dict_class=CSVDictionary,
+                                               key_prefix=args.prefix)
+            file_path = args.csv
+        else:
+            registry = Registry.find_or_create(args.registry,
+                                               key_prefix=args.prefix)
+            file_path = args.txt
+        if args.entity not in registry.dictionaries():
+            return '* %s unknown dictionary' % (color.format(args.entity,
+                                                             color.RED))
+        dictionary = registry.get_dict(args.entity)
+        statuses = dictionary.delete_terms(dictionary.parse_file(file_path),
+                                           args.lang, args.batch_size)
+        print('+ %d entities deleted, %d not found' % (
+            sum(statuses), len(statuses) - sum(statuses)))
+        return '* %s dictionary pruned' % (color.format(args.entity,
+                                                        color.GREEN))
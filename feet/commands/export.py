@@ -0,0 +1,64 @@
+# -*- coding: utf8 -*-
+# Export an entity dictionary to a snapshot file
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+from commis import Command
+from commis import color
+from feet.entities.registry import Registry
+
+
+class ExportCommand(Command):
+
+    name = 'export'
+    help = 'export an entity dictionary to a binary snapshot'
+    args = {
+        '--registry': {
+            'metavar': 'REGISTRY',
+            'default': 'feet',
+            'required': False,
+            'help': 'registry of entities'
+        },
+        '--entity': {
+            'metavar': 'ENTITY',
+            'required': True,
+            'help': 'entity dictionary'
+        },
+        '--lang': {
+            'metavar': 'LANG',
+            'default': 'en',
+            'help': 'language of entities'
+        },
+        '--output': {
+            'metavar': 'SNAPSHOT_FILE',
+            'required': True,
+            'help': 'path to the snapshot file that will be written'
+        },
+        '--prefix': {
+            'metavar': 'PREFIX',
+            'default': 'feet',
+            'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms read per pipeline'
+        }
+    }
+
+    def handle(self, args):
+        """
+        CLI to export an entity dictionary.
+        """
+        registry = Registry.find_or_create(args.registry,
+                                           key_prefix=args.prefix)
+        dictionary = registry.get_dict(args.entity)
+        count = dictionary.export_snapshot(args.output, args.lang,
+                                           args.batch_size)
+        print('+ %d entities exported' % count)
+        return '* %s dictionary exported to %s' % (
+            color.format(args.entity, color.GREEN), args.output)
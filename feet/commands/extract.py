@@ -9,8 +9,13 @@
 from commis import Command
 from commis import color
 
-from feet.entities.extractor import Extractor
+from feet.config import settings
+from feet.entities.dictionary import batches
+from feet.entities.executor import ExtractionPool
+from feet.entities.extractor import Extractor, MODES
 from feet.entities.registry import Registry
+from feet.exceptions import ExtractionError
+from feet.utils.timez import Timer
 
 
 class ExtractCommand(Command):
@@ -39,11 +44,40 @@ class ExtractCommand(Command):
             'required': False,
             'help': 'grammar that defines entities in a sentence'
         },
+        '--mode': {
+            'metavar': 'MODE',
+            'default': 'grammar',
+            'choices': MODES,
+            'help': 'grammar chunks lookup or gazetteer matching'
+        },
         '--path': {
             'metavar': 'PATH',
             'required': False,
             'help': 'path to the file that will be processed'
         },
+        '--batch': {
+            'metavar': 'PATH',
+            'required': False,
+            'help': 'path to a file of texts to process, one per line'
+        },
+        '--workers': {
+            'metavar': 'WORKERS',
+            'type': int,
+            'default': settings.extraction.workers,
+            'help': 'number of processes extracting the texts of a batch'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'default': settings.extraction.batch_size,
+            'help': 'number of texts sent to a process at once'
+        },
+        '--timeout': {
+            'metavar': 'SECONDS',
+            'type': int,
+            'default': settings.timeout,
+            'help': 'seconds a batch may wait for a process or run in it'
+        },
         '--lang': {
             'metavar': 'LANG',
             'default': 'en',
@@ -53,6 +87,14 @@ class ExtractCommand(Command):
             'metavar': 'PREFIX',
             'default': 'feet',
             'help': 'prefix used for all keys of entity'
+        },
+        '--fuzzy': {
+            'action': 'store_true',
+            'help': 'look up misspelled tokens in the trigram index'
+        },
+        '--stats': {
+            'action': 'store_true',
+            'help': 'print the storage commands issued by the extraction'
         }
     }
 
@@ -60,12 +102,14 @@ class ExtractCommand(Command):
         """
         CLI to extract entities from text.
         """
-        if args.text is None and args.path is None:
+        if args.text is None and args.path is None and args.batch is None:
             return color.format('* no text source specified', color.RED)
         registry = Registry.find_or_create(args.registry,
                                            key_prefix=args.prefix)
         entity = registry.get_dict(args.entity)
-        engine = Extractor(entity, args.grammar)
+        if args.batch is not None:
+            return self.handle_batch(args, entity)
+        engine = Extractor(entity, args.grammar, args.mode, args.fuzzy)
         if args.path is not None:
             text = open(args.path).read()
         else:
@@ -82,6 +126,62 @@ class ExtractCommand(Command):
             print('\n'.join(entities))
         else:
             print(color.format('no entities detected', color.RED))
-        # print(color.format('%d' % results[1].elapsed, color.LIGHT_MAGENTA))
+        if args.stats:
+            timer = results[1]
+            print(color.format('%.3fs, %d round trips' % (
+                timer.elapsed, timer.commands.round_trips()),
+                color.LIGHT_MAGENTA))
+            for caller, commands in sorted(timer.commands.snapshot().items()):
+                for command, stats in sorted(commands.items()):
+                    print('%s %s: %d calls, %d round trips, %d bytes, '
+                          '%.3fs' % (caller or '-', command, stats['calls'],
+                                     stats['round_trips'], stats['bytes'],
+                                     stats['seconds']))
         return '* text processed according to %s entity' %\
             (color.format(args.entity, color.GREEN))
+
+    def handle_batch(self, args, entity):
+        """
+        Extracts entities from each line of a file, in worker processes
+        with --workers.
+        """
+        with open(args.batch) as handle:
+            texts = [line.rstrip('\n') for line in handle]
+        stats = None
+        with Timer() as timer:
+            if args.workers > 0:
+                try:
+                    with ExtractionPool(args.workers,
+                                        timeout=args.timeout) as pool:
+                        outputs = list(pool.extract(
+                            entity, batches(texts, args.batch_size),
+                            args.lang, args.grammar, args.mode, args.fuzzy))
+                        stats = pool.stats()
+                except ExtractionError as error:
+                    return color.format('* batch extraction failed: %s' %
+                                        error, color.RED)
+            else:
+                engine = Extractor(entity, args.grammar, args.mode,
+                                   args.fuzzy)
+                outputs = [output for batch in batches(texts, args.batch_size)
+                           for output in engine.extract_many(batch,
+                                                             args.lang)[0]]
+        detected = 0
+        for idx, output in enumerate(outputs):
+            entities = sorted(set(candidate for element in output
+                                  if element['entity_found'] == 1
+                                  for candidate in
+                                  element['entity_candidates']))
+            if len(entities) > 0:
+                detected += 1
+                print('%d\t%s' % (idx + 1, ', '.join(entities)))
+        print(color.format('entities detected in %d of %d texts' % (
+            detected, len(texts)), color.GREEN if detected > 0 else color.RED))
+        if args.stats:
+            print(color.format('%.3fs' % timer.elapsed, color.LIGHT_MAGENTA))
+            if stats is not None:
+                print('%(workers)d workers: %(submitted)d tasks, '
+                      '%(failed)d failed (%(expired)d expired, %(lost)d '
+                      'lost), at most %(max_pending)d pending' % stats)
+        return '* texts processed according to %s entity' %\
+            (color.format(args.entity, color.GREEN))
@@ -0,0 +1,64 @@
+# -*- coding: utf8 -*-
+# Import an entity dictionary from a snapshot file
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+from commis import Command
+from commis import color
+from feet.entities.registry import Registry
+
+
+class ImportCommand(Command):
+
+    name = 'import'
+    help = 'import an entity dictionary from a binary snapshot'
+    args = {
+        '--registry': {
+            'metavar': 'REGISTRY',
+            'default': 'feet',
+            'required': False,
+            'help': 'registry of entities'
+        },
+        '--entity': {
+            'metavar': 'ENTITY',
+            'required': True,
+            'help': 'entity dictionary'
+        },
+        '--input': {
+            'metavar': 'SNAPSHOT_FILE',
+            'required': True,
+            'help': 'path to a snapshot file written by export'
+        },
+        '--lang': {
+            'metavar': 'LANG',
+            'required': False,
+            'help': 'language of entities, the snapshot language if omitted'
+        },
+        '--prefix': {
+            'metavar': 'PREFIX',
+            'default': 'feet',
+            'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms written per pipeline'
+        }
+    }
+
+    def handle(self, args):
+        """
+        CLI to import an entity dictionary.
+        """
+        registry = Registry.find_or_create(args.registry,
+                                           key_prefix=args.prefix)
+        dictionary = registry.get_dict(args.entity)
+        count = dictionary.import_snapshot(args.input, args.lang,
+                                           args.batch_size)
+        print('+ %d entities imported' % count)
+        return '* %s dictionary imported' % (color.format(args.entity,
+                                                          color.GREEN))
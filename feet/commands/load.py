@@ -6,6 +6,9 @@
 # Copyright (C) 2016 Romary Dupuis
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
+import os
+import sys
+import time
 from commis import Command
 from commis import color
 from feet.entities.registry import Registry
@@ -47,6 +50,34 @@ class LoadCommand(Command):
             'metavar': 'PREFIX',
             'default': 'feet',
             'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms written per pipeline'
+        },
+        '--workers': {
+            'metavar': 'N',
+            'type': int,
+            'required': False,
+            'help': 'number of processes tokenizing terms'
+        },
+        '--resume': {
+            'action': 'store_true',
+            'help': 'continue a load of the same file where it stopped'
+        },
+        '--rebuild': {
+            'action': 'store_true',
+            'help': 'replace the terms of the language by the file without '
+                    'downtime, terms cannot be added or deleted meanwhile'
+        },
+        '--min-ratio': {
+            'metavar': 'RATIO',
+            'type': float,
+            'required': False,
+            'help': 'minimum size of the rebuilt language relative to the '
+                    'live one'
         }
     }
 
@@ -65,7 +96,27 @@ class LoadCommand(Command):
                                                key_prefix=args.prefix)
             file_path = args.txt
         dictionary = registry.get_dict(args.entity)
-        count = dictionary.load_file(file_path, args.lang)
-        print('+ %d entities processed' % count)
+        size = os.path.getsize(file_path)
+        started = time.time()
+
+        def progress(total, offset):
+            elapsed = time.time() - started
+            sys.stdout.write('\r+ %d terms read, %.1f%% (%.1f terms/sec)' % (
+                total, 100.0 * offset / size if size > 0 else 100.0,
+                total / elapsed if elapsed > 0 else 0.0))
+            sys.stdout.flush()
+
+        if args.rebuild:
+            count = dictionary.rebuild_file(file_path, args.lang,
+                                            args.batch_size, args.workers,
+                                            args.min_ratio, progress)
+            print('\n+ %d entities processed' % count)
+            print('+ %d keys of the previous generation deleted' %
+                  dictionary.collect_garbage(wait=True))
+            return '* %s dictionary rebuilt' % (color.format(args.entity,
+                                                             color.GREEN))
+        count = dictionary.load_file(file_path, args.lang, args.batch_size,
+                                     args.workers, args.resume, progress)
+        print('\n+ %d entities processed' % count)
         return '* %s dictionary loaded' % (color.format(args.entity,
                                                         color.GREEN))
@@ -0,0 +1,72 @@
+# -*- coding: utf8 -*-
+# Migrate entity dictionaries to the latest storage schema
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+from commis import Command
+from commis import color
+from feet.entities.registry import Registry
+from feet.entities.dictionary import LATEST_SCHEMA
+
+
+class MigrateCommand(Command):
+
+    name = 'migrate'
+    help = 'migrate entity dictionaries to the latest storage schema'
+    args = {
+        '--registry': {
+            'metavar': 'REGISTRY',
+            'default': 'feet',
+            'required': False,
+            'help': 'registry of entities'
+        },
+        '--entity': {
+            'metavar': 'ENTITY',
+            'required': False,
+            'help': 'entity dictionary, all dictionaries if omitted'
+        },
+        '--prefix': {
+            'metavar': 'PREFIX',
+            'default': 'feet',
+            'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms copied per pipeline'
+        }
+    }
+
+    def handle(self, args):
+        """
+        CLI to migrate entity dictionaries and report the memory saved.
+        """
+        registry = Registry.find_or_create(args.registry,
+                                           key_prefix=args.prefix)
+        if args.entity is not None:
+            names = [args.entity]
+        else:
+            names = sorted(registry.dictionaries())
+        for name in names:
+            dictionary = registry.get_dict(name)
+            if dictionary.schema >= LATEST_SCHEMA and \
+                    not dictionary.storage.exists(dictionary.migration_key()):
+                print('* %s already uses schema %d' % (
+                    color.format(name, color.YELLOW), dictionary.schema))
+                continue
+            keys_before, bytes_before = dictionary.memory_usage()
+            # Waits until running processes use the new schema
+            count = dictionary.migrate(args.batch_size, wait=True)
+            keys_after, bytes_after = dictionary.memory_usage()
+            saved = bytes_before - bytes_after
+            print('+ %s: %d terms migrated' % (name, count))
+            print('+ %s: %d keys, %d bytes -> %d keys, %d bytes '
+                  '(%d bytes saved, %.1f%%)' % (
+                      name, keys_before, bytes_before, keys_after,
+                      bytes_after, saved,
+                      100.0 * saved / bytes_before if bytes_before else 0))
+        return '* %d dictionaries checked' % len(names)
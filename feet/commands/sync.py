@@ -0,0 +1,83 @@
+# -*- coding: utf8 -*-
+# Synchronize an entity dictionary with a file
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+from commis import Command
+from commis import color
+from feet.entities.registry import Registry
+from feet.entities.dictionary import CSVDictionary
+
+
+class SyncCommand(Command):
+
+    name = 'sync'
+    help = 'add and delete terms so a dictionary matches a file'
+    args = {
+        '--registry': {
+            'metavar': 'REGISTRY',
+            'default': 'feet',
+            'required': False,
+            'help': 'registry of entities'
+        },
+        '--entity': {
+            'metavar': 'ENTITY',
+            'required': True,
+            'help': 'entity dictionary'
+        },
+        '--txt': {
+            'metavar': 'PLAIN_FILE',
+            'required': False,
+            'help': 'path to a plain text file listing all terms'
+        },
+        '--csv': {
+            'metavar': 'CSV_FILE',
+            'required': False,
+            'help': 'path to a csv file listing all terms'
+        },
+        '--lang': {
+            'metavar': 'LANG',
+            'default': 'en',
+            'help': 'language of entities'
+        },
+        '--prefix': {
+            'metavar': 'PREFIX',
+            'default': 'feet',
+            'help': 'prefix used for all keys of dictionary'
+        },
+        '--batch-size': {
+            'metavar': 'SIZE',
+            'type': int,
+            'required': False,
+            'help': 'number of terms read or written per pipeline'
+        },
+        '--workers': {
+            'metavar': 'N',
+            'type': int,
+            'required': False,
+            'help': 'number of processes tokenizing new terms'
+        }
+    }
+
+    def handle(self, args):
+        """
+        CLI to synchronize an entity dictionary.
+        """
+        if args.csv is not None:
+            registry = Registry.find_or_create(args.registry,
+                                               dict_class=CSVDictionary,
+                                               key_prefix=args.prefix)
+            file_path = args.csv
+        else:
+            registry = Registry.find_or_create(args.registry,
+                                               key_prefix=args.prefix)
+            file_path = args.txt
+        dictionary = registry.get_dict(args.entity)
+        added, deleted = dictionary.sync_file(file_path, args.lang,
+                                              args.batch_size, args.workers)
+        print('+ %d entities added, %d deleted' % (added, deleted))
+        return '* %s dictionary synchronized' % (color.format(args.entity,
+                                                              color.GREEN))
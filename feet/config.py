@@ -22,9 +22,89 @@ class RedisConfiguration(Configuration):
     """
     Configuration for the Redis database
     """
+    backend = environ_setting('STORAGE_BACKEND', 'redis', required=False)
     host = environ_setting('REDIS_HOST', 'localhost', required=False)
     port = int(environ_setting('REDIS_PORT', 6379, required=False))
     prefix = environ_setting('REDIS_PREFIX', 'feet', required=False)
+    schema = int(environ_setting('REDIS_SCHEMA', 3, required=False))
+    batch_size = int(environ_setting('REDIS_BATCH_SIZE', 1000,
+                                     required=False))
+    scan_count = int(environ_setting('REDIS_SCAN_COUNT', 1000,
+                                     required=False))
+    pool_size = int(environ_setting('REDIS_POOL_SIZE', 50, required=False))
+    async_workers = int(environ_setting('REDIS_ASYNC_WORKERS', 16,
+                                        required=False))
+    pool_timeout = int(environ_setting('REDIS_POOL_TIMEOUT', 20,
+                                       required=False))
+    socket_timeout = float(environ_setting('REDIS_SOCKET_TIMEOUT', 10,
+                                           required=False))
+    socket_connect_timeout = float(environ_setting(
+        'REDIS_SOCKET_CONNECT_TIMEOUT', 5, required=False))
+    socket_keepalive = environ_setting(
+        'REDIS_SOCKET_KEEPALIVE', 'true', required=False).lower() == 'true'
+    metrics = environ_setting('REDIS_METRICS', 'true',
+                              required=False).lower() == 'true'
+    replicas = environ_setting('REDIS_REPLICAS', '', required=False)
+    max_staleness = float(environ_setting('REDIS_MAX_STALENESS', 1,
+                                          required=False))
+    rebuild_min_ratio = float(environ_setting('REDIS_REBUILD_MIN_RATIO', 0.5,
+                                              required=False))
+    rebuild_lease = float(environ_setting('REDIS_REBUILD_LEASE', 60,
+                                          required=False))
+    sqlite_path = environ_setting('SQLITE_PATH', 'feet.sqlite',
+                                  required=False)
+    mmap_size = int(environ_setting('SQLITE_MMAP_SIZE', 1024 * 1024 * 1024,
+                                    required=False))
+
+
+class CacheConfiguration(Configuration):
+    """
+    Configuration for the in-process cache of dictionary lookups
+    """
+    enabled = environ_setting('CACHE_ENABLED', 'false',
+                              required=False).lower() == 'true'
+    max_bytes = int(environ_setting('CACHE_MAX_BYTES', 64 * 1024 * 1024,
+                                    required=False))
+    ttl = int(environ_setting('CACHE_TTL', 300, required=False))
+    version_interval = float(environ_setting('CACHE_VERSION_INTERVAL', 1,
+                                             required=False))
+
+
+class FuzzyConfiguration(Configuration):
+    """
+    Configuration for the trigram index of typo tolerant lookups
+    """
+    index = environ_setting('FUZZY_INDEX', 'false',
+                            required=False).lower() == 'true'
+    max_distance = int(environ_setting('FUZZY_MAX_DISTANCE', 2,
+                                       required=False))
+    max_candidates = int(environ_setting('FUZZY_MAX_CANDIDATES', 5,
+                                         required=False))
+    min_similarity = float(environ_setting('FUZZY_MIN_SIMILARITY', 0.3,
+                                           required=False))
+
+
+class BloomConfiguration(Configuration):
+    """
+    Configuration for the Bloom filters of dictionary tokens
+    """
+    enabled = environ_setting('BLOOM_ENABLED', 'false',
+                              required=False).lower() == 'true'
+    capacity = int(environ_setting('BLOOM_CAPACITY', 100000,
+                                   required=False))
+    error_rate = float(environ_setting('BLOOM_ERROR_RATE', 0.01,
+                                       required=False))
+
+
+class ExtractionConfiguration(Configuration):
+    """
+    Configuration for the pool of extracting processes
+    """
+    workers = int(environ_setting('EXTRACTION_WORKERS', 0, required=False))
+    max_tasks_per_child = int(environ_setting(
+        'EXTRACTION_MAX_TASKS_PER_CHILD', 1000, required=False))
+    batch_size = int(environ_setting('EXTRACTION_BATCH_SIZE', 100,
+                                     required=False))
 
 
 class ServerConfiguration(Configuration):
@@ -57,6 +137,10 @@ class FeetConfiguration(Configuration):
 
     debug = True
     database = RedisConfiguration()
+    cache = CacheConfiguration()
+    fuzzy = FuzzyConfiguration()
+    bloom = BloomConfiguration()
+    extraction = ExtractionConfiguration()
     server = ServerConfiguration()
     mecab = MecabConfiguration()
     logfile = environ_setting('LOG_FILE', 'feet.log', required=False)
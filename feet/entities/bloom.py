@@ -0,0 +1,114 @@
+# -*- coding: utf8 -*-
+# bloom.py
+# Bloom filters of dictionary tokens
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Bloom filter of the tokens of a dictionary language, so lookups of tokens
+that are in no term are answered without any round trip.
+
+The bits are a storage string where bit i is bit 7 - i % 8 of byte i / 8,
+the order of SETBIT and BITFIELD, next to a string holding the number of
+bits and of hashes. Bits of new tokens are set before their terms are
+written, and a filter is only built from all stored terms, so it never
+misses a stored token. Tokens of deleted terms stay in the filter until it
+is built again.
+
+Loaded filters are kept per dictionary language and loaded again when the
+version counter of the language changes, see feet.entities.cache.
+"""
+
+import math
+import hashlib
+import threading
+from feet.entities.cache import lookup_cache
+
+
+class BloomFilter(object):
+    def __init__(self, bits, hashes, data=''):
+        self.bits = bits
+        self.hashes = hashes
+        self._data = bytearray(data)
+        self._data.extend('\x00' * ((bits + 7) // 8 - len(self._data)))
+
+    @classmethod
+    def for_capacity(klass, capacity, error_rate):
+        """
+        Sizes a filter for capacity items with a false positive rate of
+        error_rate.
+        """
+        bits = int(math.ceil(-capacity * math.log(error_rate) /
+                             math.log(2) ** 2))
+        hashes = max(1, int(round(float(bits) / capacity * math.log(2))))
+        return klass(bits, hashes)
+
+    @classmethod
+    def loads(klass, params, data):
+        bits, hashes = params.split(':')
+        return klass(int(bits), int(hashes), data or '')
+
+    def params(self):
+        return '{}:{}'.format(self.bits, self.hashes)
+
+    def dumps(self):
+        return str(self._data)
+
+    def positions(self, item):
+        """
+        Bits of an item, by double hashing.
+        """
+        if isinstance(item, unicode):
+            item = item.encode('utf8')
+        digest = hashlib.md5(item).hexdigest()
+        first, second = int(digest[:16], 16), int(digest[16:], 16) | 1
+        return [(first + idx * second) % self.bits
+                for idx in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self._data[position // 8] |= 0x80 >> (position % 8)
+
+    def __contains__(self, item):
+        return all(self._data[position // 8] & (0x80 >> (position % 8))
+                   for position in self.positions(item))
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def loaded(dictionary, lang):
+    """
+    Gets the filter of a dictionary language, None without filter. It is
+    loaded again when the language changed.
+    """
+    namespace = (dictionary.key, lang)
+    version = lookup_cache.version(namespace,
+                                   lambda: dictionary.version(lang))
+    with _loaded_lock:
+        record = _loaded.get(namespace)
+    if record is not None and record[0] == version:
+        return record[1]
+    bloom = dictionary.bloom_filter(lang)
+    with _loaded_lock:
+        _loaded[namespace] = (version, bloom)
+    return bloom
+
+
+def discard(key):
+    """
+    Drops the filters of a dictionary.
+    """
+    with _loaded_lock:
+        for namespace in [namespace for namespace in _loaded
+                          if namespace[0] == key]:
+            del _loaded[namespace]
+
+
+def clear():
+    with _loaded_lock:
+        _loaded.clear()
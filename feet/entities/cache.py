@@ -0,0 +1,160 @@
+# -*- coding: utf8 -*-
+# cache.py
+# In-process cache of dictionary lookups
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+LRU/TTL cache with a memory budget in front of Dictionary reads.
+
+Entries are tagged with the version counter of their dictionary/language.
+Writes bump the counter in the storage, and the cache re-reads the counter
+at most every version_interval seconds, so hot lookups are served without
+any round trip while stale entries are dropped soon after a change.
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+from feet.config import settings
+
+
+def sizeof(value):
+    """
+    Approximates the memory used by a cached value.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (set, frozenset, list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class LookupCache(object):
+    def __init__(self,
+                 max_bytes=settings.cache.max_bytes,
+                 ttl=settings.cache.ttl,
+                 version_interval=settings.cache.version_interval,
+                 enabled=settings.cache.enabled):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Drops all entries and counters.
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+            self._versions = {}
+            self._bytes = 0
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def cached_version(self, namespace, now):
+        """
+        Gets the local copy of the version of a namespace, None when it is
+        older than version_interval.
+        """
+        with self._lock:
+            record = self._versions.get(namespace)
+        if record is not None and now - record[1] < self.version_interval:
+            return record[0]
+        return None
+
+    def set_version(self, namespace, version, now):
+        with self._lock:
+            self._versions[namespace] = (version, now)
+
+    def version(self, namespace, fetch_version, now=None):
+        """
+        Gets the version of a namespace, re-read from the storage when the
+        local copy is older than version_interval.
+        """
+        if now is None:
+            now = time.time()
+        version = self.cached_version(namespace, now)
+        if version is None:
+            version = fetch_version()
+            self.set_version(namespace, version, now)
+        return version
+
+    def get(self, entry_key, version, now):
+        """
+        Returns (True, value) when a valid entry exists, (False, None)
+        otherwise. Outdated entries are dropped.
+        """
+        with self._lock:
+            entry = self._entries.pop(entry_key, None)
+            if entry is not None:
+                if entry[0] == version and entry[1] > now:
+                    self._entries[entry_key] = entry
+                    self.hits += 1
+                    return True, entry[2]
+                self._bytes -= entry[3]
+            self.misses += 1
+        return False, None
+
+    def lookup(self, namespace, key, fetch_version, fetch):
+        """
+        Gets a value from the cache or fetches and stores it. namespace
+        identifies the dictionary and language the value belongs to.
+        """
+        if not self.enabled:
+            return fetch()
+        now = time.time()
+        version = self.version(namespace, fetch_version, now)
+        entry_key = (namespace, key)
+        found, value = self.get(entry_key, version, now)
+        if found:
+            return value
+        value = fetch()
+        self.store(entry_key, version, value, now)
+        return value
+
+    def store(self, entry_key, version, value, now):
+        size = sizeof(entry_key) + sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(entry_key, None)
+            if previous is not None:
+                self._bytes -= previous[3]
+            self._entries[entry_key] = (version, now + self.ttl, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self._bytes -= entry[3]
+                self.evictions += 1
+
+    def invalidate(self, namespace, purge=False):
+        """
+        Forces the version of a namespace to be re-read on next lookup.
+        With purge, also drops its entries, e.g. when the version counter
+        itself is deleted.
+        """
+        with self._lock:
+            self._versions.pop(namespace, None)
+            if purge:
+                for entry_key in list(self._entries):
+                    if entry_key[0][:len(namespace)] == namespace:
+                        self._bytes -= self._entries.pop(entry_key)[3]
+                for version_key in list(self._versions):
+                    if version_key[:len(namespace)] == namespace:
+                        del self._versions[version_key]
+
+
+lookup_cache = LookupCache()
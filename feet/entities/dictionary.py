@@ -7,12 +7,262 @@
 # Copyright (C) 2016 Romary Dupuis
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
+import os
 import csv
+import time
+from collections import OrderedDict, defaultdict, deque
+from tornado import gen
 from feet.config import settings
+from feet.exceptions import RebuildError
 from feet.utils.logger import LoggingMixin
 from feet.utils.decorators import memoized
+from feet.utils.timez import Timer
 from feet.entities.nlp import Parser
+from feet.entities.cache import lookup_cache
+from feet.entities import bloom, fuzzy, gazetteer
+from feet.entities.bloom import BloomFilter
+from feet.entities.snapshot import SnapshotReader, SnapshotWriter
+from feet.entities.workers import TokenizerPool
 from feet.storage import StorageMixin
+from feet.storage.asynchronous import run_in_executor
+from feet.storage.metrics import traced
+
+SEPARATOR = '\x1f'
+
+# Terms are written by batches, each batch by one script. The script first
+# checks the state its keys were built for: it refuses the batch while the
+# language is being rebuilt, see Dictionary.lease, and hands back the
+# version, generation and Bloom filter parameters when the generation or
+# the filter changed, see Dictionary._run_write_script.
+# KEYS: generation, rebuild, version, bloom params, bloom
+# ARGV: time, generation, bloom params
+WRITE_CHECK = """
+local lease = redis.call('GET', KEYS[2])
+if lease and tonumber(lease) > tonumber(ARGV[1]) then
+    return {-1}
+end
+local generation = redis.call('GET', KEYS[1]) or '0'
+local params = redis.call('GET', KEYS[4]) or ''
+if generation ~= ARGV[2] or params ~= ARGV[3] then
+    return {-2, redis.call('GET', KEYS[3]) or '0', generation, params}
+end
+"""
+
+# Bits of the tokens of a batch in the Bloom filter, tokens in the trigram
+# index, before the terms are written: the filter never misses a token.
+# KEYS: ..., trigram sets from k
+# ARGV: ..., language, number of terms, of bits, of trigrams, bits, number
+#       of tokens and tokens of each trigram
+INDEX_TOKENS = """
+local a = 8
+for idx = 1, tonumber(ARGV[6]) do
+    redis.call('SETBIT', KEYS[5], ARGV[a], 1)
+    a = a + 1
+end
+for idx = 1, tonumber(ARGV[7]) do
+    for token = 1, tonumber(ARGV[a]) do
+        redis.call('SADD', KEYS[k], ARGV[a + token])
+    end
+    k, a = k + 1, a + tonumber(ARGV[a]) + 1
+end
+"""
+
+# Reply of a written batch: status, version, generation, bloom params and
+# the result of each term, see Dictionary._run_write_script.
+WRITTEN = """
+local reply = {0, redis.call('GET', KEYS[3]) or '0', ARGV[2], ARGV[3]}
+for idx = 1, #results do
+    reply[#reply + 1] = results[idx]
+end
+return reply
+"""
+
+# Schema v1: a set of tokens per term, token sets of lowercased terms
+# KEYS: check, languages, terms list, cardinality, trigram sets, then the
+#       term and its token sets for each term
+# ARGV: check, index, then the term, the lowercased term, the number of
+#       tokens and the tokens of each term
+ADD_TERMS_SCRIPT = WRITE_CHECK + "local k = 9\n" + INDEX_TOKENS + """
+redis.call('SADD', KEYS[6], ARGV[4])
+local results, added = {}, 0
+for idx = 1, tonumber(ARGV[5]) do
+    local count = tonumber(ARGV[a + 2])
+    results[idx] = 0
+    if redis.call('EXISTS', KEYS[k]) == 0 then
+        for token = 1, count do
+            redis.call('SADD', KEYS[k], ARGV[a + 2 + token])
+            redis.call('SADD', KEYS[k + token], ARGV[a + 1])
+        end
+        redis.call('RPUSH', KEYS[7], ARGV[a])
+        results[idx], added = 1, added + 1
+    end
+    k, a = k + count + 1, a + count + 3
+end
+if added > 0 then
+    redis.call('INCRBY', KEYS[8], added)
+    redis.call('INCR', KEYS[3])
+end
+""" + WRITTEN
+
+# KEYS: check, languages, terms list, cardinality, then the term and its
+#       token sets for each term
+# ARGV: check, language, number of terms, then the term, the lowercased
+#       term, an unused value and the number of tokens of each term
+DELETE_TERMS_SCRIPT = WRITE_CHECK + """
+local results, deleted = {}, 0
+if redis.call('SISMEMBER', KEYS[6], ARGV[4]) == 0 then
+    return {0, redis.call('GET', KEYS[3]) or '0', ARGV[2], ARGV[3]}
+end
+local k, a = 9, 6
+for idx = 1, tonumber(ARGV[5]) do
+    local count = tonumber(ARGV[a + 3])
+    results[idx] = 0
+    if redis.call('DEL', KEYS[k]) == 1 then
+        for token = 1, count do
+            redis.call('SREM', KEYS[k + token], ARGV[a + 1])
+        end
+        redis.call('LREM', KEYS[7], 0, ARGV[a])
+        results[idx], deleted = 1, deleted + 1
+    end
+    k, a = k + count + 1, a + 4
+end
+if deleted > 0 then
+    redis.call('DECRBY', KEYS[8], deleted)
+    redis.call('INCR', KEYS[3])
+end
+""" + WRITTEN
+
+# Schema v2: terms are interned as integer ids so token sets are intsets.
+# A hash maps lowercased terms to their id and tokens, another one maps ids
+# back to lowercased terms.
+# KEYS: check, languages, schema, ids, names, next id, terms list,
+#       cardinality, trigram sets, then the token sets of each term
+# ARGV: check, index, then the term, the lowercased term, the number of
+#       tokens and the tokens of each term
+ADD_TERMS_SCRIPT_V2 = WRITE_CHECK + "local k = 13\n" + INDEX_TOKENS + """
+redis.call('SADD', KEYS[6], ARGV[4])
+redis.call('SETNX', KEYS[7], 2)
+local results, added = {}, 0
+for idx = 1, tonumber(ARGV[5]) do
+    local count = tonumber(ARGV[a + 2])
+    results[idx] = 0
+    if redis.call('HEXISTS', KEYS[8], ARGV[a + 1]) == 0 then
+        local id = redis.call('INCR', KEYS[10])
+        local value = {id}
+        for token = 1, count do
+            value[#value + 1] = ARGV[a + 2 + token]
+            redis.call('SADD', KEYS[k + token - 1], id)
+        end
+        redis.call('HSET', KEYS[8], ARGV[a + 1], table.concat(value, '\\31'))
+        redis.call('HSET', KEYS[9], id, ARGV[a + 1])
+        redis.call('RPUSH', KEYS[11], ARGV[a])
+        results[idx], added = 1, added + 1
+    end
+    k, a = k + count, a + count + 3
+end
+if added > 0 then
+    redis.call('INCRBY', KEYS[12], added)
+    redis.call('INCR', KEYS[3])
+end
+""" + WRITTEN
+
+# KEYS: check, languages, schema, ids, names, next id, terms list,
+#       cardinality, then the token sets of each term
+# ARGV: check, language, number of terms, then the term, the lowercased
+#       term, its stored value and the number of tokens of each term. The
+#       token sets are those of the stored value, the batch is handed back
+#       when a term changed meanwhile.
+DELETE_TERMS_SCRIPT_V2 = WRITE_CHECK + """
+local results, deleted = {}, 0
+if redis.call('SISMEMBER', KEYS[6], ARGV[4]) == 0 then
+    return {0, redis.call('GET', KEYS[3]) or '0', ARGV[2], ARGV[3]}
+end
+local a = 6
+for idx = 1, tonumber(ARGV[5]) do
+    local value = redis.call('HGET', KEYS[8], ARGV[a + 1])
+    if value and value ~= ARGV[a + 2] then
+        return {-2, redis.call('GET', KEYS[3]) or '0', ARGV[2], ARGV[3]}
+    end
+    a = a + 4
+end
+local k = 13
+a = 6
+for idx = 1, tonumber(ARGV[5]) do
+    local count = tonumber(ARGV[a + 3])
+    local value = redis.call('HGET', KEYS[8], ARGV[a + 1])
+    results[idx] = 0
+    if value then
+        local id = string.match(value, '^[^\\31]*')
+        redis.call('HDEL', KEYS[8], ARGV[a + 1])
+        redis.call('HDEL', KEYS[9], id)
+        for token = 1, count do
+            redis.call('SREM', KEYS[k + token - 1], id)
+        end
+        redis.call('LREM', KEYS[11], 0, ARGV[a])
+        results[idx], deleted = 1, deleted + 1
+    end
+    k, a = k + count, a + 4
+end
+if deleted > 0 then
+    redis.call('DECRBY', KEYS[12], deleted)
+    redis.call('INCR', KEYS[3])
+end
+""" + WRITTEN
+
+# Schema v3: v2 with terms indexed in a lexicographic sorted set instead of
+# a list, so they are removed in O(log N) and paged with a cursor.
+ADD_TERMS_SCRIPT_V3 = ADD_TERMS_SCRIPT_V2.replace(
+    "redis.call('SETNX', KEYS[7], 2)",
+    "redis.call('SETNX', KEYS[7], 3)").replace(
+    "redis.call('RPUSH', KEYS[11], ARGV[a])",
+    "redis.call('ZADD', KEYS[11], 0, ARGV[a])")
+
+DELETE_TERMS_SCRIPT_V3 = DELETE_TERMS_SCRIPT_V2.replace(
+    "redis.call('LREM', KEYS[11], 0, ARGV[a])",
+    "redis.call('ZREM', KEYS[11], ARGV[a])")
+
+# Swaps in a Bloom filter built from the stored terms of a language, unless
+# the language changed since they were read. With merge, a filter of the
+# same size is merged with the live one instead, which keeps the bits set
+# meanwhile.
+# KEYS: version, bloom params, bloom, merged bloom
+# ARGV: version before the build, bloom params, bloom, merge
+SWAP_BLOOM_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    if ARGV[4] == '0' or redis.call('GET', KEYS[2]) ~= ARGV[2] then
+        return 0
+    end
+    redis.call('SET', KEYS[4], ARGV[3])
+    redis.call('BITOP', 'OR', KEYS[3], KEYS[3], KEYS[4])
+    redis.call('DEL', KEYS[4])
+else
+    redis.call('SET', KEYS[3], ARGV[3])
+    redis.call('SET', KEYS[2], ARGV[2])
+end
+redis.call('INCR', KEYS[1])
+return 1
+"""
+
+# Attempts of a batch whose generation or Bloom filter keeps changing, and
+# of a Bloom filter build whose language keeps changing
+WRITE_ATTEMPTS = 3
+
+# Schema that migrate converts dictionaries to
+LATEST_SCHEMA = 3
+
+
+def unique(tokens):
+    """
+    Removes duplicated tokens, keeps their order.
+    """
+    return list(OrderedDict.fromkeys(tokens))
+
+
+def batches(items, size):
+    """
+    Splits a list into lists of at most size items.
+    """
+    return [items[idx:idx + size] for idx in range(0, len(items), size)]
 
 
 class Dictionary(StorageMixin, LoggingMixin):
@@ -25,41 +275,197 @@ class Dictionary(StorageMixin, LoggingMixin):
                  key_prefix=settings.database.prefix,
                  redis_host=settings.database.host,
                  redis_port=settings.database.port,
-                 redis_db=0):
+                 redis_db=0,
+                 schema=None):
         self._name = name
         self._key_prefix = key_prefix
         self._redis_host = redis_host
         self._redis_port = redis_port
         self._redis_db = redis_db
+        self._fixed_schema = schema
+        self._schema = None
+        # Bloom filter parameters of the generation of each language that
+        # batches are written for, see _run_write_script
+        self._write_params = {}
+
+    def __reduce__(self):
+        # Pickled by name, so worker processes open their own storage
+        return (self.__class__, (self._name, self._key_prefix,
+                                 self._redis_host, self._redis_port,
+                                 self._redis_db, self._fixed_schema))
 
     @memoized
     def parser(self):
         return Parser()
 
+    @memoized
+    def scripts(self):
+        """
+        Add and delete terms scripts of each schema.
+        """
+        register = self.storage.register_script
+        return {1: (register(ADD_TERMS_SCRIPT),
+                    register(DELETE_TERMS_SCRIPT)),
+                2: (register(ADD_TERMS_SCRIPT_V2),
+                    register(DELETE_TERMS_SCRIPT_V2)),
+                3: (register(ADD_TERMS_SCRIPT_V3),
+                    register(DELETE_TERMS_SCRIPT_V3))}
+
+    @memoized
+    def swap_bloom_script(self):
+        return self.storage.register_script(SWAP_BLOOM_SCRIPT)
+
+    @property
+    def add_terms_script(self):
+        return self.scripts[self.schema][0]
+
+    @property
+    def delete_terms_script(self):
+        return self.scripts[self.schema][1]
+
     @memoized
     def key(self):
         return '{}:entity:{}'.format(self._key_prefix, self._name)
 
+    def schema_key(self):
+        return '{}:schema'.format(
+            self.key)
+
+    @property
+    def schema(self):
+        """
+        Version of the key layout. It is re-read every
+        cache.version_interval, so running processes follow a migration.
+        Dictionaries without a schema key but with languages predate v2.
+        """
+        if self._fixed_schema is not None:
+            return self._fixed_schema
+        now = time.time()
+        if self._schema is None or \
+                now - self._schema[1] >= settings.cache.version_interval:
+            schema = self.storage.get(self.schema_key())
+            if schema is None:
+                if self.storage.exists(self.languages_key()):
+                    schema = 1
+                else:
+                    schema = settings.database.schema
+            self._schema = (int(schema), now)
+        return self._schema[0]
+
+    @gen.coroutine
+    def schema_async(self):
+        if self._fixed_schema is not None:
+            raise gen.Return(self._fixed_schema)
+        now = time.time()
+        if self._schema is None or \
+                now - self._schema[1] >= settings.cache.version_interval:
+            schema = yield self.async_storage.get(self.schema_key())
+            if schema is None:
+                exists = yield self.async_storage.exists(
+                    self.languages_key())
+                if exists:
+                    schema = 1
+                else:
+                    schema = settings.database.schema
+            self._schema = (int(schema), now)
+        raise gen.Return(self._schema[0])
+
+    def with_schema(self, schema):
+        """
+        Same dictionary with a fixed key layout, see migrate.
+        """
+        return self.__class__(self._name,
+                              key_prefix=self._key_prefix,
+                              redis_host=self._redis_host,
+                              redis_port=self._redis_port,
+                              redis_db=self._redis_db,
+                              schema=schema)
+
+    def lang_key(self, lang):
+        if self.schema == 1:
+            return '{}:lang:{}'.format(self.key, lang)
+        return self.generation_lang_key(lang, self.generation(lang))
+
+    def generation_lang_key(self, lang, generation):
+        """
+        Namespace of a generation of a language from schema v2. Generation
+        n > 0 is the namespace of the staged dictionary n, see stage.
+        """
+        if generation == 0:
+            return '{}:l:{}'.format(self.key, lang)
+        return '{}@{}:l:{}'.format(self.key, generation, lang)
+
     def terms_list_key(self, lang):
-        return '{}:lang:{}:terms'.format(
-            self.key,
-            self._name,
-            lang)
+        if self.schema == 1:
+            # Schema v1 shares one list between all languages
+            return '{}:lang:{}:terms'.format(
+                self.key,
+                self._name)
+        return '{}:t'.format(self.lang_key(lang))
+
+    def terms_index_key(self, lang):
+        """
+        Sorted set of the terms of a language from schema v3, see
+        terms_list_key for previous schemas.
+        """
+        return '{}:o'.format(self.lang_key(lang))
+
+    def terms_key(self, lang):
+        if self.schema >= 3:
+            return self.terms_index_key(lang)
+        return self.terms_list_key(lang)
 
     def term_key(self, lang, term):
-        return '{}:lang:{}:term:{}'.format(
-            self.key,
-            lang,
+        return '{}:term:{}'.format(
+            self.lang_key(lang),
             term.lower())
 
+    def ids_key(self, lang):
+        return '{}:i'.format(self.lang_key(lang))
+
+    def names_key(self, lang):
+        return '{}:s'.format(self.lang_key(lang))
+
+    def next_id_key(self, lang):
+        return '{}:n'.format(self.lang_key(lang))
+
     def token_key(self, lang, token):
-        return '{}:lang:{}:dictionary:{}'.format(
-            self.key,
-            lang,
+        if self.schema == 1:
+            return '{}:dictionary:{}'.format(
+                self.lang_key(lang),
+                token.lower())
+        return '{}:d:{}'.format(
+            self.lang_key(lang),
             token.lower())
 
+    def trigram_key(self, lang, gram):
+        """
+        Set of the lowercased tokens having a trigram, see
+        feet.entities.fuzzy.
+        """
+        return '{}:g:{}'.format(self.lang_key(lang), gram)
+
+    def bloom_key(self, lang):
+        """
+        Bits of the Bloom filter of the tokens of a language, see
+        feet.entities.bloom.
+        """
+        return '{}:b'.format(self.lang_key(lang))
+
+    def bloom_params_key(self, lang):
+        return '{}:bp'.format(self.lang_key(lang))
+
     def cardinality_key(self, lang):
-        return '{}:lang:{}:cardinality'.format(
+        if self.schema == 1:
+            return '{}:cardinality'.format(self.lang_key(lang))
+        return '{}:c'.format(self.lang_key(lang))
+
+    def version_key(self, lang):
+        """
+        Counter bumped by every change of a language, it lives outside of
+        the language namespace so it survives delete_language.
+        """
+        return '{}:version:{}'.format(
             self.key,
             lang)
 
@@ -67,153 +473,1685 @@ class Dictionary(StorageMixin, LoggingMixin):
         return '{}:languages'.format(
             self.key)
 
+    def generation_key(self, lang):
+        """
+        Generation of a language that readers use, see rebuild_file. Like
+        the version counter, it lives outside of the language namespace.
+        """
+        return '{}:generation:{}'.format(self.key, lang)
+
+    def generations_key(self, lang):
+        """
+        Counter of the generations staged for a language.
+        """
+        return '{}:generations:{}'.format(self.key, lang)
+
+    def rebuild_key(self, lang):
+        """
+        Time until which writes to a language are refused because it is
+        being rebuilt, see lease.
+        """
+        return '{}:rebuild:{}'.format(self.key, lang)
+
+    def write_keys(self, lang):
+        """
+        Keys watched by the transactions that write terms, see begin_write.
+        """
+        return [self.generation_key(lang), self.rebuild_key(lang)]
+
+    def garbage_key(self):
+        """
+        Hash of the namespaces of replaced generations and the time they
+        can be deleted at, see collect_garbage.
+        """
+        return '{}:garbage'.format(self.key)
+
+    def migration_key(self):
+        """
+        Hash of the previous schema of a migration and the time its keys
+        can be dropped at, see migrate.
+        """
+        return '{}:migration'.format(self.key)
+
+    @traced
     def languages(self):
         try:
             return list(self.storage.smembers(self.languages_key()))
         except:
             return []
 
+    @gen.coroutine
+    def languages_async(self):
+        languages = yield self.async_storage.smembers(self.languages_key())
+        raise gen.Return(list(languages))
+
+    @traced
     def add_language(self, lang):
+        self.storage.setnx(self.schema_key(), self.schema)
         if lang not in self.languages():
             if self.storage.sadd(self.languages_key(), lang) == 1:
                 return True
         return False
 
+    @traced
     def change_language(self, lang, new_lang):
         self.add_language(new_lang)
 
+    @traced
     def cardinality(self, lang):
         try:
             return int(self.storage.get(self.cardinality_key(lang)))
         except:
             return 0
 
-    def load_file(self, file_name, lang):
-        self.logger.info("Loading entity file ... %s" % file_name)
-        count = 0
-        for term in self.parse_file(file_name):
-            if self.add_term(term, lang):
-                count += 1
+    @gen.coroutine
+    def cardinality_async(self, lang):
+        yield [self.schema_async(), self.generation_async(lang)]
+        cardinality = yield self.async_storage.get(self.cardinality_key(lang))
+        raise gen.Return(int(cardinality or 0))
+
+    def checkpoint_key(self, lang):
+        """
+        Hash of the file being loaded in a language and the byte offset
+        after the last batch written.
+        """
+        return '{}:load'.format(self.lang_key(lang))
+
+    def checkpoint(self, file_name, lang):
+        """
+        Returns the offset where a load of file_name stopped, 0 when there
+        is no checkpoint for this file.
+        """
+        loaded_file, offset = self.storage.hmget(self.checkpoint_key(lang),
+                                                 ['file', 'offset'])
+        if loaded_file != os.path.abspath(file_name) or offset is None:
+            return 0
+        return int(offset)
+
+    @traced
+    def load_file(self, file_name, lang, batch_size=None, workers=None,
+                  resume=False, progress=None):
+        """
+        Streams a file into the dictionary. The offset in the file after
+        each batch written is saved, so a load that stopped is continued
+        from there with resume. Terms of the batch in progress when it
+        stopped are loaded again, which is harmless since adding a term
+        is idempotent. progress is called with the number of terms
+        processed and the offset in the file after each batch.
+        """
+        file_name = os.path.abspath(file_name)
+        offset = self.checkpoint(file_name, lang) if resume else 0
+        if offset > 0:
+            self.logger.info("Resuming entity file ... %s at byte %d" % (
+                file_name, offset))
+        else:
+            self.logger.info("Loading entity file ... %s" % file_name)
+        key = self.checkpoint_key(lang)
+
+        def checkpoint(offset):
+            pipe = self.storage.pipeline(transaction=False)
+            pipe.hset(key, 'file', file_name)
+            pipe.hset(key, 'offset', offset)
+            pipe.execute()
+
+        count = self._load(self.read_file(file_name, offset), lang,
+                           batch_size, workers, progress, checkpoint)
+        self.storage.delete(key)
         return count
 
+    def read_file(self, file_name, offset=0):
+        """
+        Yields each term of a file from a byte offset, with the offset
+        after the term.
+        """
+        with open(file_name, 'rb') as handle:
+            handle.seek(offset)
+            while True:
+                term = handle.readline()
+                if term == '':
+                    return
+                yield term, handle.tell()
+
     def parse_file(self, entities_file):
-        handle = open(entities_file, "r")
-        for term in handle.readlines():
+        for term, _ in self.read_file(entities_file):
             yield term
 
-    def load_list(self, entities_list, lang):
-        count = 0
-        for term in entities_list:
-            if self.add_term(term, lang):
-                count += 1
+    def load_list(self, entities_list, lang, batch_size=None, workers=None):
+        return self.load_terms(entities_list, lang, batch_size, workers)
+
+    @traced
+    def load_terms(self, terms, lang, batch_size=None, workers=None,
+                   progress=None):
+        """
+        Bulk loads terms: terms are grouped into batches and each batch is
+        written in a single pipeline. Produces the same keys as add_term.
+        With more than one worker, batches are tokenized by a pool of
+        processes (see feet.entities.workers) while this process writes
+        them in their original order. The Bloom filter of the language is
+        built again at the end when terms were added.
+        """
+        return self._load(((term, None) for term in terms), lang,
+                          batch_size, workers, progress)
+
+    def _load(self, entries, lang, batch_size, workers, progress,
+              checkpoint=None):
+        """
+        Loads (term, offset) entries, see load_terms and load_file.
+        """
+        if batch_size is None:
+            batch_size = settings.database.batch_size
+        self.add_language(lang)
+        # Size and last offset of the batches read but not written yet
+        pending = deque()
+
+        def batches():
+            batch, offset = [], None
+            for term, offset in entries:
+                batch.append(term)
+                if len(batch) >= batch_size:
+                    pending.append((len(batch), offset))
+                    yield self.unique_terms(batch)
+                    batch = []
+            if len(batch) > 0:
+                pending.append((len(batch), offset))
+                yield self.unique_terms(batch)
+
+        count, total = 0, 0
+        with Timer() as timer:
+            if workers is not None and workers > 1:
+                pool = TokenizerPool(workers)
+                tokenized = pool.tokenize(batches(), lang)
+            else:
+                pool = None
+                tokenized = (self.tokenize_terms(batch, lang)
+                             for batch in batches())
+            completed = False
+            try:
+                for batch in tokenized:
+                    size, offset = pending.popleft()
+                    total += size
+                    if len(batch) > 0:
+                        count += self.add_tokenized_terms(batch, lang)
+                    if checkpoint is not None:
+                        checkpoint(offset)
+                    if progress is not None:
+                        progress(total, offset)
+                completed = True
+            finally:
+                if pool is not None:
+                    if completed:
+                        pool.close()
+                    else:
+                        pool.terminate()
+        if timer.elapsed > 0:
+            rate = total / timer.elapsed
+        else:
+            rate = float(total)
+        self.logger.info('{} terms processed, {} added in {:.2f}s '
+                         '({:.1f} terms/sec)'.format(total, count,
+                                                     timer.elapsed, rate))
+        if count > 0 and settings.bloom.enabled:
+            self.build_bloom_filter(lang, batch_size)
+        return count
+
+    def unique_terms(self, terms):
+        """
+        Returns the stripped terms of a batch, without empty terms and
+        without case insensitive duplicates.
+        """
+        batch = OrderedDict()
+        for term in terms:
+            if isinstance(term, unicode):
+                term = term.encode('utf8')
+            term = term.strip()
+            if term != '' and term.lower() not in batch:
+                batch[term.lower()] = term
+        return batch.values()
+
+    def tokenize_terms(self, terms, lang):
+        return [(term, self.parser.word_tokenize(term, lang))
+                for term in terms]
+
+    @traced
+    def add_terms(self, terms, lang):
+        """
+        Adds a batch of terms in one pipeline. The language is expected to
+        be registered already (see load_terms). Returns the number of terms
+        actually added.
+        """
+        batch = self.unique_terms(terms)
+        if len(batch) == 0:
+            return 0
+        return self.add_tokenized_terms(self.tokenize_terms(batch, lang),
+                                        lang)
+
+    @traced
+    def add_tokenized_terms(self, terms, lang):
+        """
+        Adds a batch of (term, tokens) pairs in one transaction, see
+        add_terms and begin_write.
+        """
+        if settings.bloom.enabled:
+            self.create_bloom_filter(lang)
+        return self._add_tokenized_terms(terms, lang)[0]
+
+    def _add_tokenized_terms(self, terms, lang):
+        """
+        Returns the number of terms added and whether the language has a
+        Bloom filter.
+        """
+        if self.storage.scripting:
+            def add_script_params(params):
+                keys, args = self._index_params(terms, lang, params)
+                for term, tokens in terms:
+                    tokens = unique(tokens)
+                    if self.schema == 1:
+                        keys.append(self.term_key(lang, term))
+                    keys += [self.token_key(lang, token) for token in tokens]
+                    args += [term, term.lower(), len(tokens)] + tokens
+                return keys, args
+
+            results, params = self._run_write_script(
+                self.add_terms_script, lang, add_script_params)
+            return sum(results), params is not None
+        schema = self.schema
+        if schema == 1:
+            watchs = [self.term_key(lang, term) for term, _ in terms]
+        else:
+            watchs = [self.ids_key(lang)]
+        # Whether the generation written has a Bloom filter
+        filtered = []
+
+        def add_terms_transaction(pipe):
+            params = self.begin_write(pipe, lang)
+            filtered[:] = [params is not None]
+            lookup = self.storage.pipeline(transaction=False)
+            for term, _ in terms:
+                if schema == 1:
+                    lookup.exists(self.term_key(lang, term))
+                else:
+                    lookup.hexists(self.ids_key(lang), term.lower())
+            new_terms = [(term, tokens) for (term, tokens), exists
+                         in zip(terms, lookup.execute()) if not exists]
+            term_ids = [None] * len(new_terms)
+            if schema > 1 and len(new_terms) > 0:
+                last_id = pipe.incrby(self.next_id_key(lang), len(new_terms))
+                term_ids = range(last_id - len(new_terms) + 1, last_id + 1)
+            pipe.multi()
+            # Before the terms, in the generation they are written to: the
+            # filter never misses a stored token
+            if params is not None:
+                pipe.setbits(self.bloom_key(lang),
+                             self._bloom_offsets(terms, params))
+            if settings.fuzzy.index:
+                for gram, tokens in self._trigram_postings(terms).items():
+                    pipe.sadd(self.trigram_key(lang, gram), *tokens)
+            for (term, tokens), term_id in zip(new_terms, term_ids):
+                self._add_term_commands(pipe, term, tokens, lang, term_id)
+            return len(new_terms)
+
+        added = self.storage.transaction(add_terms_transaction,
+                                         *(watchs + self.write_keys(lang)),
+                                         value_from_callable=True)
+        self.invalidate(lang)
+        return added, filtered[0]
+
+    def _run_write_script(self, script, lang, script_params):
+        """
+        Writes a batch of terms of a language in one EVALSHA, without
+        WATCH. script_params(params) returns the keys and arguments of the
+        batch for the Bloom filter parameters of the generation the keys
+        are built for, see WRITE_CHECK. The script refuses the batch while
+        the language is being rebuilt, which raises RebuildError, and hands
+        it back when the generation or the filter changed, the batch is
+        then built again for the new ones. Returns the results of the terms
+        and the parameters of the filter, None when it has none.
+        """
+        for _ in range(WRITE_ATTEMPTS):
+            generation = self.generation(lang) if self.schema > 1 else 0
+            params = self._write_params.get(lang, (None, None))
+            if params[0] != generation:
+                params = (generation,
+                          self.storage.get(self.bloom_params_key(lang)))
+            keys, args = script_params(params[1])
+            reply = script(keys=[self.generation_key(lang),
+                                 self.rebuild_key(lang),
+                                 self.version_key(lang),
+                                 self.bloom_params_key(lang),
+                                 self.bloom_key(lang)] + keys,
+                           args=[repr(time.time()), generation,
+                                 params[1] or ''] + args)
+            if reply[0] == -1:
+                raise RebuildError('{} {} is being rebuilt, its terms cannot '
+                                   'change until it is swapped in'.format(
+                                       self._name, lang))
+            counter, generation = int(reply[1]), int(reply[2])
+            self._write_params[lang] = (generation, reply[3] or None)
+            lookup_cache.set_version((self.key, lang), (counter, generation),
+                                     time.time())
+            if reply[0] == 0:
+                return reply[4:], reply[3] or None
+        raise RebuildError('{} {} kept changing while a batch was '
+                           'written'.format(self._name, lang))
+
+    def _index_params(self, terms, lang, params):
+        """
+        Keys and arguments of a batch of (term, tokens) pairs to add, for
+        the language and the Bloom filter and trigram index of its tokens,
+        see INDEX_TOKENS.
+        """
+        offsets = []
+        if params is not None:
+            offsets = self._bloom_offsets(terms, params)
+        postings = {}
+        if settings.fuzzy.index:
+            postings = self._trigram_postings(terms)
+        keys = self._batch_keys(lang)
+        args = [lang, len(terms), len(offsets), len(postings)] + offsets
+        for gram, tokens in postings.items():
+            keys.append(self.trigram_key(lang, gram))
+            args += [len(tokens)] + sorted(tokens)
+        return keys, args
+
+    def _batch_keys(self, lang):
+        """
+        Keys of a language written by every batch, after the keys of
+        WRITE_CHECK.
+        """
+        if self.schema == 1:
+            return [self.languages_key(),
+                    self.terms_list_key(lang),
+                    self.cardinality_key(lang)]
+        return [self.languages_key(),
+                self.schema_key(),
+                self.ids_key(lang),
+                self.names_key(lang),
+                self.next_id_key(lang),
+                self.terms_key(lang),
+                self.cardinality_key(lang)]
+
+    def begin_write(self, pipe, lang):
+        """
+        Starts a transaction that writes terms of a language, pipe watches
+        write_keys. The live generation is read again, so terms are never
+        written to a generation replaced by swap, whatever the cached
+        generation of the process. Raises RebuildError while the language
+        is being rebuilt, rebuild_file would not keep the writes. Returns
+        the parameters of the Bloom filter of the language, None when it
+        has none. Storages running scripts check the same in WRITE_CHECK.
+        """
+        params_key = self.bloom_params_key(lang)
+        if self.schema == 1:
+            return pipe.get(params_key)
+        counter, generation, lease, params = pipe.mget(
+            self.version_key(lang), self.generation_key(lang),
+            self.rebuild_key(lang), params_key)
+        if lease is not None and float(lease) > time.time():
+            raise RebuildError('{} {} is being rebuilt, its terms cannot '
+                               'change until it is swapped in'.format(
+                                   self._name, lang))
+        lookup_cache.set_version((self.key, lang),
+                                 (int(counter or 0), int(generation or 0)),
+                                 time.time())
+        if self.bloom_params_key(lang) != params_key:
+            params = pipe.get(self.bloom_params_key(lang))
+        return params
+
+    def _bloom_offsets(self, terms, params):
+        """
+        Bits of the tokens of a batch of (term, tokens) pairs in a Bloom
+        filter of parameters params.
+        """
+        bloom_filter = BloomFilter.loads(params, '')
+        offsets = set()
+        for _, tokens in terms:
+            for token in tokens:
+                offsets.update(bloom_filter.positions(token.lower()))
+        return sorted(offsets)
+
+    def create_bloom_filter(self, lang):
+        """
+        Creates an empty Bloom filter sized for settings.bloom.capacity
+        tokens for a language without terms, so the terms added then set
+        their bits and the filter never has to be built for them. A
+        language that has terms but no filter keeps none until
+        build_bloom_filter. It is checked once per generation of the
+        language in a process. Returns whether the language has a filter.
+        """
+        generation = self.generation(lang) if self.schema > 1 else 0
+        params = self._write_params.get(lang)
+        if params is not None and params[0] == generation:
+            return params[1] is not None
+        params_key = self.bloom_params_key(lang)
+        cardinality_key = self.cardinality_key(lang)
+        bloom_filter = BloomFilter.for_capacity(settings.bloom.capacity,
+                                                settings.bloom.error_rate)
+
+        def create(pipe):
+            params, count = pipe.mget(params_key, cardinality_key)
+            if params is not None or int(count or 0) > 0:
+                return params
+            pipe.multi()
+            pipe.set(params_key, bloom_filter.params())
+            pipe.incr(self.version_key(lang))
+            return bloom_filter.params()
+
+        params = self.storage.transaction(create, params_key,
+                                          cardinality_key,
+                                          value_from_callable=True)
+        self._write_params[lang] = (generation, params)
+        return params is not None
+
+    @traced
+    def build_bloom_filter(self, lang, batch_size=None):
+        """
+        Builds the Bloom filter of a language from its stored terms. It is
+        sized for twice its tokens, so tokens added until it is built again
+        keep the false positive rate of settings.bloom, and for at least
+        settings.bloom.capacity tokens. It is built again at the end of
+        bulk loads and by compact, which also clears the bits of deleted
+        terms. The terms are read while writers go on, and the filter is
+        swapped in only if the language did not change meanwhile. The build
+        is tried WRITE_ATTEMPTS times, the last one merges the bits set
+        meanwhile when the filter keeps its size. Returns the number of
+        tokens, None when the live filter was kept.
+        """
+        if not self.storage.scripting:
+            # Local storages hold their lock for the whole build
+            def build(pipe):
+                self.begin_write(pipe, lang)
+                bloom_filter, count = self._read_bloom_filter(lang,
+                                                              batch_size)
+                pipe.multi()
+                pipe.set(self.bloom_key(lang), bloom_filter.dumps())
+                pipe.set(self.bloom_params_key(lang), bloom_filter.params())
+                pipe.incr(self.version_key(lang))
+                return count
+
+            count = self.storage.transaction(build, self.version_key(lang),
+                                             *self.write_keys(lang),
+                                             value_from_callable=True)
+            self.invalidate(lang)
+            return count
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            counter, generation = self.version(lang)
+            lookup_cache.set_version((self.key, lang), (counter, generation),
+                                     time.time())
+            bloom_filter, count = self._read_bloom_filter(lang, batch_size)
+            swapped = self.swap_bloom_script(
+                keys=[self.version_key(lang), self.bloom_params_key(lang),
+                      self.bloom_key(lang),
+                      '{}:m'.format(self.bloom_key(lang))],
+                args=[counter, bloom_filter.params(), bloom_filter.dumps(),
+                      int(attempt == WRITE_ATTEMPTS)])
+            self.invalidate(lang)
+            if swapped == 1:
+                return count
+        self.logger.warning('{} {} kept changing, its Bloom filter was not '
+                            'built'.format(self._name, lang))
+        return None
+
+    def _read_bloom_filter(self, lang, batch_size=None):
+        """
+        Bloom filter of the stored tokens of a language, see
+        build_bloom_filter, with the number of tokens.
+        """
+        tokens = set()
+        for _, term_tokens in self.stored_terms(lang, batch_size):
+            tokens.update(token.lower() for token in term_tokens)
+        bloom_filter = BloomFilter.for_capacity(
+            max(settings.bloom.capacity, 2 * len(tokens)),
+            settings.bloom.error_rate)
+        for token in tokens:
+            bloom_filter.add(token)
+        return bloom_filter, len(tokens)
+
+    @traced
+    def compact(self, lang, batch_size=None, trigrams=None):
+        """
+        Maintenance of a language after terms were added or deleted one by
+        one: its Bloom filter is built again, sized for its tokens and
+        without the bits of deleted terms. With trigrams, settings.fuzzy.index
+        by default, its trigram index is built again first, without the
+        tokens of deleted terms. Returns the number of tokens of the filter,
+        None without settings.bloom or when the live filter was kept.
+        """
+        if trigrams is None:
+            trigrams = settings.fuzzy.index
+        if trigrams:
+            self.build_trigram_index(lang, batch_size)
+        if not settings.bloom.enabled:
+            return None
+        return self.build_bloom_filter(lang, batch_size)
+
+    def bloom_filter(self, lang):
+        """
+        Reads the Bloom filter of a language, None if it has none.
+        """
+        pipe = self.storage.pipeline(transaction=False)
+        pipe.get(self.bloom_params_key(lang))
+        pipe.get(self.bloom_key(lang))
+        params, data = pipe.execute()
+        if params is None:
+            return None
+        return BloomFilter.loads(params, data)
+
+    def _trigram_postings(self, terms):
+        """
+        Lowercased tokens of a batch of (term, tokens) pairs by trigram.
+        """
+        postings = defaultdict(set)
+        for _, tokens in terms:
+            for token in tokens:
+                for gram in fuzzy.trigrams(token):
+                    postings[gram].add(token.lower())
+        return postings
+
+    def _index_trigrams(self, terms, lang):
+        """
+        Adds the tokens of a batch of (term, tokens) pairs to the trigram
+        index, one SADD per trigram.
+        """
+        pipe = self.storage.pipeline(transaction=False)
+        for gram, tokens in self._trigram_postings(terms).items():
+            pipe.sadd(self.trigram_key(lang, gram), *tokens)
+        pipe.execute()
+
+    @traced
+    def build_trigram_index(self, lang, batch_size=None):
+        """
+        Indexes again the tokens of all terms of a language, for
+        dictionaries loaded without settings.fuzzy.index. Tokens of deleted
+        terms are left in the index until it is built again.
+        """
+        self.storage.delete_pattern('{}:*'.format(
+            self.trigram_key(lang, '')))
+        count, batch = 0, []
+        for term, tokens in self.stored_terms(lang, batch_size):
+            batch.append((term, tokens))
+            if len(batch) >= (batch_size or settings.database.batch_size):
+                self._index_trigrams(batch, lang)
+                count += len(batch)
+                batch = []
+        if len(batch) > 0:
+            self._index_trigrams(batch, lang)
+            count += len(batch)
         return count
 
+    def _add_term_commands(self, pipe, term, tokens, lang, term_id=None):
+        """
+        Issues the commands that index a new term, term_id is only used
+        from schema v2.
+        """
+        tokens = unique(tokens)
+        if self.schema == 1:
+            member = term.lower()
+            for token in tokens:
+                pipe.sadd(self.term_key(lang, term), token)
+        else:
+            member = term_id
+            pipe.hset(self.ids_key(lang), term.lower(),
+                      SEPARATOR.join([str(term_id)] + tokens))
+            pipe.hset(self.names_key(lang), term_id, term.lower())
+        if self.schema >= 3:
+            pipe.zadd(self.terms_index_key(lang), 0, term)
+        else:
+            pipe.rpush(self.terms_list_key(lang), term)
+        pipe.incr(self.cardinality_key(lang))
+        pipe.incr(self.version_key(lang))
+        for token in tokens:
+            pipe.sadd(self.token_key(lang, token), member)
+
+    @traced
     def add_term(self, term, lang):
         if isinstance(term, unicode):
             term = term.encode('utf8')
         self.logger.debug('Add term {}'.format(term))
         term = term.strip()
-        self.add_language(lang)
+        if not self.storage.scripting:
+            self.add_language(lang)
+        tokens = self.parser.word_tokenize(term, lang)
+        return self.add_tokenized_terms([(term, tokens)], lang) == 1
+
+    @traced
+    def delete_term(self, term, lang):
+        return self.delete_terms([term], lang)[0]
+
+    @traced
+    def delete_terms(self, terms, lang, batch_size=None):
+        """
+        Deletes terms by batches, each batch reads the stored tokens of its
+        terms in one pipeline and deletes them in another one, so nothing
+        is tokenized. Tokens of deleted terms stay in the Bloom filter of
+        the language, see build_bloom_filter. Returns the status of each
+        term.
+        """
+        if batch_size is None:
+            batch_size = settings.database.batch_size
+        batch, statuses = [], []
+        for term in terms:
+            if isinstance(term, unicode):
+                term = term.encode('utf8')
+            batch.append(term.strip())
+            if len(batch) >= batch_size:
+                statuses += self.delete_stored_terms(batch, lang)
+                batch = []
+        if len(batch) > 0:
+            statuses += self.delete_stored_terms(batch, lang)
+        self.logger.debug('{} of {} terms deleted'.format(sum(statuses),
+                                                          len(statuses)))
+        return statuses
+
+    def sync_file(self, file_name, lang, batch_size=None, workers=None):
+        self.logger.info("Synchronizing entity file ... %s" % file_name)
+        return self.sync_terms(self.parse_file(file_name), lang, batch_size,
+                               workers)
+
+    @traced
+    def sync_terms(self, terms, lang, batch_size=None, workers=None):
+        """
+        Makes terms the terms of a language: stored terms are read by
+        batches and compared with terms case insensitively, then only the
+        stored terms missing from terms are deleted and only the new terms
+        are tokenized and added. Returns the number of terms added and
+        deleted.
+        """
+        if batch_size is None:
+            batch_size = settings.database.batch_size
+        missing = OrderedDict((term.lower(), term)
+                              for term in self.unique_terms(terms))
+        stale = []
+        for stored in self._term_batches(lang, batch_size):
+            for term in stored:
+                if missing.pop(term.lower(), None) is None:
+                    stale.append(term)
+        deleted = sum(self.delete_terms(stale, lang, batch_size))
+        added = self.load_terms(missing.values(), lang, batch_size, workers)
+        if added == 0 and deleted > 0 and settings.bloom.enabled:
+            # Clears the bits of the deleted terms, see _load
+            self.build_bloom_filter(lang, batch_size)
+        self.logger.info('{} terms added, {} deleted'.format(added, deleted))
+        return added, deleted
+
+    def staged(self, generation):
+        """
+        Dictionary whose namespace of a language is the namespace of a
+        generation of this dictionary, see generation_lang_key.
+        """
+        return self.__class__('{}@{}'.format(self._name, generation),
+                              key_prefix=self._key_prefix,
+                              redis_host=self._redis_host,
+                              redis_port=self._redis_port,
+                              redis_db=self._redis_db,
+                              schema=self.schema)
+
+    def stage(self, lang):
+        """
+        Allocates a new generation of a language and returns its number.
+        Writes to the live generation are refused from now on, see lease.
+        """
+        if self.schema == 1:
+            raise RebuildError('schema 1 dictionaries have no generations, '
+                               'migrate {} first'.format(self._name))
+        generation = self.storage.incr(self.generations_key(lang))
+        self.lease(lang)
+        return generation
 
-        def add_term_transaction(pipe):
-            if pipe.exists(self.term_key(lang, term)) == 0:
-                pipe.rpush(self.terms_list_key(lang), term)
-                tokens = self.parser.word_tokenize(term, lang)
-                pipe.incr(self.cardinality_key(lang))
+    def lease(self, lang):
+        """
+        Refuses writes to a language for settings.database.rebuild_lease
+        seconds, so they are not lost when a staged generation replaces
+        it. Writers check it in begin_write. The lease is renewed while a
+        generation is loaded and ends with swap or release, or on its own
+        if the rebuilding process dies.
+        """
+        self.storage.set(self.rebuild_key(lang),
+                         repr(time.time() + settings.database.rebuild_lease))
+
+    def release(self, lang):
+        """
+        Accepts writes to a language again, see lease.
+        """
+        self.storage.delete(self.rebuild_key(lang))
+
+    @traced
+    def rebuild_file(self, file_name, lang, batch_size=None, workers=None,
+                     min_ratio=None, progress=None):
+        """
+        Reloads a language from a file without downtime. The file is loaded
+        into a new generation while readers keep using the live one, then
+        the new generation is swapped in at once, so readers never see a
+        partial dictionary. The new generation is deleted if the load fails
+        or if it is refused by swap. Terms of the language cannot be added
+        or deleted meanwhile: writes raise RebuildError until the swap, see
+        lease. Returns the number of terms loaded.
+        """
+        self.collect_garbage()
+        generation = self.stage(lang)
+        staged = self.staged(generation)
+
+        def renew(*args):
+            self.lease(lang)
+            if progress is not None:
+                progress(*args)
+
+        swapped = False
+        try:
+            count = staged.load_file(file_name, lang, batch_size, workers,
+                                     progress=renew)
+            self.swap(lang, generation, min_ratio)
+            swapped = True
+        finally:
+            if not swapped:
+                # Unlike delete, also drops the version counter: nothing
+                # caches lookups of a staged generation
+                self.storage.delete_pattern('{}:*'.format(staged.key))
+                self.release(lang)
+        return count
+
+    @traced
+    def swap(self, lang, generation, min_ratio=None):
+        """
+        Makes a staged generation the live generation of a language in one
+        transaction. It is refused when it is empty or holds less than
+        min_ratio times the terms of the live generation. Readers move to
+        the new generation within cache.version_interval, the replaced one
+        is deleted after that by collect_garbage. Writers move to the new
+        generation at once, see begin_write, and the lease of the language
+        ends. Returns the replaced generation.
+        """
+        if min_ratio is None:
+            min_ratio = settings.database.rebuild_min_ratio
+        staged = self.staged(generation)
+        key = self.generation_key(lang)
+        # Cardinality key of the staged generation, read on the primary as
+        # replicas may lag behind the rebuild
+        count_key = '{}:c'.format(self.generation_lang_key(lang, generation))
+
+        def swap_transaction(pipe):
+            live = int(pipe.get(key) or 0)
+            count = int(pipe.get(count_key) or 0)
+            if generation <= live:
+                raise RebuildError('generation {} of {} {} is not newer than '
+                                   'generation {}'.format(generation,
+                                                          self._name, lang,
+                                                          live))
+            namespace = self.generation_lang_key(lang, live)
+            # Cardinality key of the live generation, see cardinality_key
+            live_count = int(pipe.get('{}:c'.format(namespace)) or 0)
+            if count == 0 or count < min_ratio * live_count:
+                raise RebuildError('generation {} of {} {} has {} terms, the '
+                                   'live one {}'.format(generation,
+                                                        self._name, lang,
+                                                        count, live_count))
+            pipe.multi()
+            pipe.set(key, generation)
+            pipe.delete(self.rebuild_key(lang))
+            pipe.sadd(self.languages_key(), lang)
+            pipe.incr(self.version_key(lang))
+            pipe.hset(self.garbage_key(), namespace,
+                      time.time() + settings.cache.version_interval)
+            # Keys of the staged dictionary outside of the namespace
+            pipe.delete(staged.schema_key())
+            pipe.delete(staged.languages_key())
+            pipe.delete(staged.version_key(lang))
+            return live, count
+
+        live, count = self.storage.transaction(swap_transaction, key,
+                                               count_key,
+                                               value_from_callable=True)
+        self.invalidate(lang)
+        self.logger.info('generation {} of {} {} swapped in with {} '
+                         'terms'.format(generation, self._name, lang, count))
+        return live
+
+    @traced
+    def collect_garbage(self, wait=False):
+        """
+        Deletes the replaced generations that readers may no longer use.
+        With wait, waits until all replaced generations can be deleted.
+        Keys are unlinked by batches, see StorageAbstract.delete_pattern.
+        Returns the number of keys deleted.
+        """
+        deleted = 0
+        garbage = self.storage.hgetall(self.garbage_key())
+        for namespace, deadline in sorted(garbage.items(),
+                                          key=lambda item: float(item[1])):
+            delay = float(deadline) - time.time()
+            if delay > 0:
+                if not wait:
+                    continue
+                time.sleep(delay)
+            deleted += self.storage.delete_pattern('{}:*'.format(namespace))
+            self.storage.hdel(self.garbage_key(), namespace)
+        return deleted
+
+    @traced
+    def delete_stored_terms(self, terms, lang):
+        """
+        Deletes a batch of terms with the tokens stored for them, see
+        delete_terms.
+        """
+        if self.storage.scripting:
+            def delete_script_params(params):
+                schema = self.schema
+                pipe = self.storage.pipeline(transaction=False)
+                for term in terms:
+                    if schema == 1:
+                        pipe.smembers(self.term_key(lang, term))
+                    else:
+                        pipe.hget(self.ids_key(lang), term.lower())
+                keys = self._batch_keys(lang)
+                args = [lang, len(terms)]
+                for term, value in zip(terms, pipe.execute()):
+                    if schema == 1:
+                        keys.append(self.term_key(lang, term))
+                        tokens, value = sorted(value), ''
+                    else:
+                        tokens = self._split_tokens(value)
+                    keys += [self.token_key(lang, token) for token in tokens]
+                    args += [term, term.lower(), value or '', len(tokens)]
+                return keys, args
+
+            results, _ = self._run_write_script(self.delete_terms_script,
+                                                lang, delete_script_params)
+            results += [0] * (len(terms) - len(results))
+            return [result == 1 for result in results]
+        schema = self.schema
+        if schema == 1:
+            watchs = [self.term_key(lang, term) for term in terms]
+        else:
+            watchs = [self.ids_key(lang)]
+
+        def delete_terms_transaction(pipe):
+            self.begin_write(pipe, lang)
+            lookup = self.storage.pipeline(transaction=False)
+            for term in terms:
+                if schema == 1:
+                    lookup.smembers(self.term_key(lang, term))
+                else:
+                    lookup.hget(self.ids_key(lang), term.lower())
+            statuses, deleted, seen = [], [], set()
+            for term, value in zip(terms, lookup.execute()):
+                statuses.append(bool(value) and term.lower() not in seen)
+                if statuses[-1]:
+                    deleted.append((term, value))
+                    seen.add(term.lower())
+            if len(deleted) == 0:
+                return statuses
+            pipe.multi()
+            for term, value in deleted:
+                if schema == 1:
+                    member, tokens = term.lower(), value
+                    pipe.delete(self.term_key(lang, term))
+                else:
+                    member = value.split(SEPARATOR)[0]
+                    tokens = self._split_tokens(value)
+                    pipe.hdel(self.ids_key(lang), term.lower())
+                    pipe.hdel(self.names_key(lang), member)
                 for token in tokens:
-                    pipe.sadd(self.term_key(lang, term), token)
-                    pipe.sadd(self.token_key(lang, token),
-                              term.lower())
-                return True
-            else:
-                return False
+                    pipe.srem(self.token_key(lang, token), member)
+                if schema >= 3:
+                    pipe.zrem(self.terms_index_key(lang), term)
+                else:
+                    pipe.lrem(self.terms_list_key(lang), 0, term)
+            pipe.incrby(self.cardinality_key(lang), -len(deleted))
+            pipe.incr(self.version_key(lang))
+            return statuses
 
-        return self.storage.transaction(add_term_transaction,
-                                        self.term_key(lang, term),
-                                        value_from_callable=True)
+        statuses = self.storage.transaction(delete_terms_transaction,
+                                            *(watchs + self.write_keys(lang)),
+                                            value_from_callable=True)
+        self.invalidate(lang)
+        return statuses
 
-    def delete_term(self, term, lang):
-        if isinstance(term, unicode):
-            term = term.encode('utf8')
-        self.logger.debug('Delete term {}'.format(term))
-        term = term.strip()
-        if lang not in self.languages():
-            return False
-        if self.storage.exists(self.term_key(lang, term)) == 0:
-            return False
-
-        def delete_term_transaction(pipe):
-            if pipe.delete(self.term_key(lang, term)) != 1:
-                return False
-            tokens = self.parser.word_tokenize(term, lang)
-            for token in tokens:
-                if pipe.srem(self.token_key(lang, token),
-                             term.lower()) != 1:
-                    return False
-            pipe.lrem(self.terms_list_key(lang), 0, term)
-            pipe.decr(self.cardinality_key(lang))
-            return True
+    def version(self, lang):
+        """
+        Returns the change counter and the generation of a language, read
+        in one round trip. Cached lookups are tagged with both, so a swap
+        of generation drops them like any change.
+        """
+        counter, generation = self.storage.mget(self.version_key(lang),
+                                                self.generation_key(lang))
+        return int(counter or 0), int(generation or 0)
+
+    @gen.coroutine
+    def version_async(self, lang):
+        """
+        Same as version, from the local copy when it is recent enough.
+        """
+        namespace, now = (self.key, lang), time.time()
+        version = lookup_cache.cached_version(namespace, now)
+        if version is None:
+            counter, generation = yield self.async_storage.mget(
+                self.version_key(lang), self.generation_key(lang))
+            version = (int(counter or 0), int(generation or 0))
+            lookup_cache.set_version(namespace, version, now)
+        raise gen.Return(version)
 
-        return self.storage.transaction(delete_term_transaction,
-                                        self.term_key(lang, term),
-                                        value_from_callable=True)
+    def generation(self, lang):
+        """
+        Generation of a language that keys are built for, re-read with the
+        version every cache.version_interval.
+        """
+        return lookup_cache.version((self.key, lang),
+                                    lambda: self.version(lang))[1]
+
+    @gen.coroutine
+    def generation_async(self, lang):
+        version = yield self.version_async(lang)
+        raise gen.Return(version[1])
+
+    def cached(self, lang, key, fetch):
+        """
+        Serves a read from the local lookup cache, see feet.entities.cache.
+        """
+        return lookup_cache.lookup((self.key, lang), key,
+                                   lambda: self.version(lang), fetch)
+
+    def cached_many(self, lang, keys, fetch):
+        """
+        Same as cached for many keys, fetch gets the keys missing from the
+        cache and returns their values in the same order.
+        """
+        if not lookup_cache.enabled:
+            return fetch(keys)
+        namespace, now = (self.key, lang), time.time()
+        version = lookup_cache.version(namespace, lambda: self.version(lang),
+                                       now)
+        values, missing = {}, []
+        for key in keys:
+            found, value = lookup_cache.get((namespace, key), version, now)
+            if found:
+                values[key] = value
+            elif key not in values:
+                values[key] = None
+                missing.append(key)
+        if len(missing) > 0:
+            for key, value in zip(missing, fetch(missing)):
+                lookup_cache.store((namespace, key), version, value, now)
+                values[key] = value
+        return [values[key] for key in keys]
+
+    @gen.coroutine
+    def cached_async(self, lang, key, fetch):
+        """
+        Same as cached, fetch returns a future.
+        """
+        if not lookup_cache.enabled:
+            value = yield fetch()
+            raise gen.Return(value)
+        version = yield self.version_async(lang)
+        namespace, now = (self.key, lang), time.time()
+        found, value = lookup_cache.get((namespace, key), version, now)
+        if not found:
+            value = yield fetch()
+            lookup_cache.store((namespace, key), version, value, now)
+        raise gen.Return(value)
 
+    def invalidate(self, lang=None):
+        """
+        Drops the cached version of a language, or all cached lookups of the
+        dictionary.
+        """
+        if lang is None:
+            lookup_cache.invalidate((self.key,), purge=True)
+            gazetteer.discard(self.key)
+            bloom.discard(self.key)
+        else:
+            lookup_cache.invalidate((self.key, lang))
+
+    @traced
     def exact_match(self, candidate, lang):
-        return len(self.storage.smembers(
-            self.term_key(lang, candidate))) > 0
+        return len(self.tokens(candidate, lang)) > 0
 
+    @traced
     def candidates(self, token, lang):
-        return self.storage.smembers(self.token_key(lang, token))
+        return set(self.cached(
+            lang, ('candidates', token.lower()),
+            lambda: self._fetch_candidates(token, lang)))
 
+    @traced
     def tokens(self, candidate, lang):
-        return list(self.storage.smembers(
-            self.term_key(lang, candidate)))
+        return list(self.cached(
+            lang, ('tokens', candidate.lower()),
+            lambda: self._fetch_tokens(candidate, lang)))
+
+    def _fetch_candidates(self, token, lang):
+        if settings.bloom.enabled:
+            bloom_filter = bloom.loaded(self, lang)
+            if bloom_filter is not None and \
+                    token.lower() not in bloom_filter:
+                return set()
+        members = self.storage.smembers(self.token_key(lang, token))
+        if self.schema == 1 or len(members) == 0:
+            return members
+        return set(name for name in
+                   self.storage.hmget(self.names_key(lang), list(members))
+                   if name is not None)
+
+    def queue_tokens(self, pipe, candidate, lang):
+        """
+        Queues the read of the tokens of a candidate in a pipeline, see
+        parse_tokens.
+        """
+        if self.schema == 1:
+            pipe.smembers(self.term_key(lang, candidate))
+        else:
+            pipe.hget(self.ids_key(lang), candidate.lower())
+
+    def parse_tokens(self, value):
+        if self.schema == 1:
+            return list(value)
+        return self._split_tokens(value)
+
+    def _fetch_tokens(self, candidate, lang):
+        if self.schema == 1:
+            return self.storage.smembers(self.term_key(lang, candidate))
+        return self._split_tokens(
+            self.storage.hget(self.ids_key(lang), candidate.lower()))
+
+    @traced
+    def tokens_many(self, candidates, lang):
+        """
+        Same as tokens for many candidates, they are read by pipelined
+        batches. Returns the tokens of each candidate in order.
+        """
+        return self.lookup_many(candidates, [], lang)[0]
+
+    @traced
+    def candidates_many(self, tokens, lang):
+        """
+        Same as candidates for many tokens. Returns the candidates of each
+        token in order.
+        """
+        return self.lookup_many([], tokens, lang)[1]
+
+    @traced
+    def lookup_many(self, candidates, tokens, lang):
+        """
+        Reads the tokens of many candidates and the candidates of many
+        tokens together, through the lookup cache, see _fetch_many. Returns
+        the tokens of each candidate and the candidates of each token.
+        """
+        keys = [('tokens', candidate.lower()) for candidate in candidates] + \
+            [('candidates', token.lower()) for token in tokens]
+        values = self.cached_many(lang, keys,
+                                  lambda missing: self._fetch_many(missing,
+                                                                   lang))
+        return ([list(value) for value in values[:len(candidates)]],
+                [set(value) for value in values[len(candidates):]])
+
+    def _fetch_many(self, keys, lang):
+        """
+        Reads ('tokens', candidate) and ('candidates', token) lookups with
+        one pipeline per batch of keys. Tokens missing from the Bloom filter
+        are skipped. From schema v2, the names of the term ids of all token
+        sets are then read together.
+        """
+        bloom_filter = None
+        if settings.bloom.enabled:
+            bloom_filter = bloom.loaded(self, lang)
+        values, queued = {}, []
+        for key in keys:
+            kind, value = key
+            if kind == 'candidates' and bloom_filter is not None and \
+                    value not in bloom_filter:
+                values[key] = set()
+            else:
+                queued.append(key)
+        batch_size = settings.database.batch_size
+        for batch in batches(queued, batch_size):
+            pipe = self.storage.pipeline(transaction=False)
+            for kind, value in batch:
+                if kind == 'tokens':
+                    self.queue_tokens(pipe, value, lang)
+                else:
+                    pipe.smembers(self.token_key(lang, value))
+            for key, value in zip(batch, pipe.execute()):
+                if key[0] == 'tokens':
+                    value = self.parse_tokens(value)
+                values[key] = value
+        if self.schema == 1:
+            return [values[key] for key in keys]
+        members = unique(member for key in keys if key[0] == 'candidates'
+                         for member in values[key])
+        names = {}
+        for batch in batches(members, batch_size):
+            names.update(zip(batch, self.storage.hmget(self.names_key(lang),
+                                                       batch)))
+        return [set(names[member] for member in values[key]
+                    if names[member] is not None)
+                if key[0] == 'candidates' else values[key] for key in keys]
+
+    @traced
+    def fuzzy_tokens(self, token, lang, max_distance=None,
+                     max_candidates=None, min_similarity=None):
+        """
+        Returns the stored tokens within max_distance edits of a token, the
+        closest first. Tokens sharing trigrams with the token are
+        ranked by similarity, only the max_candidates most similar ones
+        above min_similarity are checked. Defaults are in settings.fuzzy.
+        """
+        options = self._fuzzy_options(max_distance, max_candidates,
+                                      min_similarity)
+        grams = sorted(fuzzy.trigrams(token))
+
+        def fetch():
+            pipe = self.storage.pipeline(transaction=False)
+            for gram in grams:
+                pipe.smembers(self.trigram_key(lang, gram))
+            return self._rank_fuzzy(token, grams, pipe.execute(), options)
+
+        tokens = self.cached(lang, ('fuzzy', token.lower()) + options, fetch)
+        return [name for name in tokens
+                if len(self.candidates(name, lang)) > 0]
+
+    @traced
+    def fuzzy_tokens_many(self, tokens, lang, max_distance=None,
+                          max_candidates=None, min_similarity=None):
+        """
+        Same as fuzzy_tokens for many tokens, the trigram postings of all
+        tokens are read by pipelined batches and the candidates of all
+        their matches together. Returns the matches of each token in order.
+        """
+        options = self._fuzzy_options(max_distance, max_candidates,
+                                      min_similarity)
+
+        def fetch(keys):
+            grams = [sorted(fuzzy.trigrams(key[1])) for key in keys]
+            queued = [gram for token_grams in grams for gram in token_grams]
+            postings = []
+            for batch in batches(queued, settings.database.batch_size):
+                pipe = self.storage.pipeline(transaction=False)
+                for gram in batch:
+                    pipe.smembers(self.trigram_key(lang, gram))
+                postings.extend(pipe.execute())
+            ranked, offset = [], 0
+            for key, token_grams in zip(keys, grams):
+                ranked.append(self._rank_fuzzy(
+                    key[1], token_grams,
+                    postings[offset:offset + len(token_grams)], options))
+                offset += len(token_grams)
+            return ranked
+
+        matches = self.cached_many(
+            lang, [('fuzzy', token.lower()) + options for token in tokens],
+            fetch)
+        names = unique(name for found in matches for name in found)
+        known = set(name for name, candidates
+                    in zip(names, self.candidates_many(names, lang))
+                    if len(candidates) > 0)
+        return [[name for name in found if name in known]
+                for found in matches]
 
+    @gen.coroutine
+    def fuzzy_tokens_async(self, token, lang, max_distance=None,
+                           max_candidates=None, min_similarity=None):
+        yield [self.schema_async(), self.generation_async(lang)]
+        options = self._fuzzy_options(max_distance, max_candidates,
+                                      min_similarity)
+        grams = sorted(fuzzy.trigrams(token))
+
+        @gen.coroutine
+        def fetch():
+            postings = yield [self.async_storage.smembers(
+                self.trigram_key(lang, gram)) for gram in grams]
+            raise gen.Return(self._rank_fuzzy(token, grams, postings,
+                                              options))
+
+        tokens = yield self.cached_async(
+            lang, ('fuzzy', token.lower()) + options, fetch)
+        candidates = yield [self.candidates_async(name, lang)
+                            for name in tokens]
+        raise gen.Return([name for name, found in zip(tokens, candidates)
+                          if len(found) > 0])
+
+    @staticmethod
+    def _fuzzy_options(max_distance, max_candidates, min_similarity):
+        if max_distance is None:
+            max_distance = settings.fuzzy.max_distance
+        if max_candidates is None:
+            max_candidates = settings.fuzzy.max_candidates
+        if min_similarity is None:
+            min_similarity = settings.fuzzy.min_similarity
+        return max_distance, max_candidates, min_similarity
+
+    @staticmethod
+    def _rank_fuzzy(token, grams, postings, options):
+        """
+        Selects the tokens of the trigram postings of a token, see
+        fuzzy_tokens. Tokens of deleted terms are filtered by the caller.
+        """
+        max_distance, max_candidates, min_similarity = options
+        grams = set(grams)
+        shared = defaultdict(int)
+        for members in postings:
+            for member in members:
+                shared[member] += 1
+        ranked = []
+        for member, count in shared.items():
+            if member == token.lower():
+                continue
+            # Upper bound of the similarity before computing trigrams
+            if float(count) / len(grams) < min_similarity:
+                continue
+            score = fuzzy.similarity(grams, fuzzy.trigrams(member))
+            if score >= min_similarity:
+                ranked.append((-score, member))
+        ranked.sort()
+        checked = sorted((fuzzy.edit_distance(token, member, max_distance),
+                          score, member)
+                         for score, member in ranked[:max_candidates])
+        return [member for distance, _, member in checked
+                if distance <= max_distance]
+
+    @staticmethod
+    def _split_tokens(value):
+        """
+        Tokens of a schema v2 term, stored after its id.
+        """
+        if value is None:
+            return []
+        return value.split(SEPARATOR)[1:]
+
+    @gen.coroutine
+    def exact_match_async(self, candidate, lang):
+        tokens = yield self.tokens_async(candidate, lang)
+        raise gen.Return(len(tokens) > 0)
+
+    @gen.coroutine
+    def candidates_async(self, token, lang):
+        yield [self.schema_async(), self.generation_async(lang)]
+        candidates = yield self.cached_async(
+            lang, ('candidates', token.lower()),
+            lambda: self._fetch_candidates_async(token, lang))
+        raise gen.Return(set(candidates))
+
+    @gen.coroutine
+    def tokens_async(self, candidate, lang):
+        yield [self.schema_async(), self.generation_async(lang)]
+        tokens = yield self.cached_async(
+            lang, ('tokens', candidate.lower()),
+            lambda: self._fetch_tokens_async(candidate, lang))
+        raise gen.Return(list(tokens))
+
+    @gen.coroutine
+    def _fetch_candidates_async(self, token, lang):
+        if settings.bloom.enabled:
+            bloom_filter = yield run_in_executor(bloom.loaded, self, lang)
+            if bloom_filter is not None and \
+                    token.lower() not in bloom_filter:
+                raise gen.Return(set())
+        members = yield self.async_storage.smembers(
+            self.token_key(lang, token))
+        if self.schema == 1 or len(members) == 0:
+            raise gen.Return(members)
+        names = yield self.async_storage.hmget(self.names_key(lang),
+                                               list(members))
+        raise gen.Return(set(name for name in names if name is not None))
+
+    @gen.coroutine
+    def _fetch_tokens_async(self, candidate, lang):
+        if self.schema == 1:
+            tokens = yield self.async_storage.smembers(
+                self.term_key(lang, candidate))
+            raise gen.Return(tokens)
+        value = yield self.async_storage.hget(self.ids_key(lang),
+                                              candidate.lower())
+        raise gen.Return(self._split_tokens(value))
+
+    @traced
     def delete(self):
         """
         Deletes the dictionary.
         """
         self.logger.info("Deleting %s on redis..." % self._name)
-        keys = self.storage.keys('{}:*'.format(self.key))
-        for key in keys:
-            self.storage.delete(key)
+        # Version counters are kept and bumped, so a dictionary created again
+        # with the same name never reuses a version that caches still hold
+        versions = self.version_key('*')
+        self.storage.delete_pattern('{}:*'.format(self.key), keep=versions)
+        pipe = self.storage.pipeline(transaction=False)
+        for key in self.storage.scan_iter(versions):
+            pipe.incr(key)
+        pipe.execute()
+        # Staged generations
+        self.storage.delete_pattern('{}@*'.format(self.key))
+        self._schema = None
+        self.invalidate()
         self.logger.info("DONE")
         return True
 
+    @traced
     def delete_language(self, lang):
         self.logger.info("Deleting dictionary {} {} on redis...".format(
             self._name,
             lang))
+        self.storage.delete_pattern('{}:*'.format(self.lang_key(lang)))
+        if self.schema >= 2:
+            # Every generation, staged ones included, and the lease of a
+            # rebuild in progress, whose swap then fails on an empty
+            # generation
+            live = int(self.storage.get(self.generation_key(lang)) or 0)
+            last = int(self.storage.get(self.generations_key(lang)) or 0)
+            self.storage.delete_pattern('{}:*'.format(
+                self.generation_lang_key(lang, 0)))
+            self.storage.delete_pattern('{}@*:l:{}:*'.format(self.key, lang))
+            keys = [self.generation_key(lang), self.rebuild_key(lang)]
+            for generation in range(live + 1, last + 1):
+                staged = self.staged(generation)
+                keys.append(staged.version_key(lang))
+                self.storage.srem(staged.languages_key(), lang)
+            self.storage.unlink(*keys)
+        self.storage.incr(self.version_key(lang))
+        self.invalidate(lang)
+        if self.storage.srem(self.languages_key(), lang) == 1:
+            self.logger.info("DONE")
+            return True
+        return False
 
-        def delete_language_transaction(pipe):
-            keys = pipe.keys('{}:lang:{}:*'.format(self.key, lang))
-            for key in keys:
-                pipe.delete(key)
-            if pipe.srem(self.languages_key(), lang) == 1:
-                self.logger.info("DONE")
-                return True
-            return False
-
-        return self.storage.transaction(delete_language_transaction,
-                                        self.languages_key(),
-                                        value_from_callable=True)
-
+    @traced
     def terms(self, lang, page=0, count=10):
+        if self.schema >= 3:
+            return self.storage.zrange(self.terms_index_key(lang),
+                                       page * count, (page + 1) * count - 1)
         return self.storage.lrange(self.terms_list_key(lang), page * count,
                                    (page + 1) * count - 1)
 
+    @gen.coroutine
+    def terms_async(self, lang, page=0, count=10):
+        schema, _ = yield [self.schema_async(),
+                           self.generation_async(lang)]
+        if schema >= 3:
+            terms = yield self.async_storage.zrange(
+                self.terms_index_key(lang), page * count,
+                (page + 1) * count - 1)
+        else:
+            terms = yield self.async_storage.lrange(
+                self.terms_list_key(lang), page * count,
+                (page + 1) * count - 1)
+        raise gen.Return(terms)
+
+    @traced
+    def terms_page(self, lang, cursor=None, count=10):
+        """
+        Returns count terms after a cursor and the cursor of the next page,
+        None after the last page. From schema v3 terms are in lexicographic
+        order and the cursor is the last term of the page, so every page is
+        read in O(log N + count). Cursors are offsets in previous schemas.
+        """
+        if isinstance(cursor, unicode):
+            cursor = cursor.encode('utf8')
+        if self.schema >= 3:
+            terms = self.storage.zrangebylex(self.terms_index_key(lang),
+                                             '(' + cursor if cursor else '-',
+                                             '+', 0, count)
+            return terms, terms[-1] if len(terms) == count else None
+        start = int(cursor or 0)
+        terms = self.storage.lrange(self.terms_list_key(lang), start,
+                                    start + count - 1)
+        return terms, str(start + count) if len(terms) == count else None
+
+    @gen.coroutine
+    def terms_page_async(self, lang, cursor=None, count=10):
+        if isinstance(cursor, unicode):
+            cursor = cursor.encode('utf8')
+        schema, _ = yield [self.schema_async(),
+                           self.generation_async(lang)]
+        if schema >= 3:
+            terms = yield self.async_storage.zrangebylex(
+                self.terms_index_key(lang), '(' + cursor if cursor else '-',
+                '+', 0, count)
+            raise gen.Return((terms,
+                              terms[-1] if len(terms) == count else None))
+        start = int(cursor or 0)
+        terms = yield self.async_storage.lrange(self.terms_list_key(lang),
+                                                start, start + count - 1)
+        raise gen.Return((terms, str(start + count)
+                          if len(terms) == count else None))
+
+    def _term_batches(self, lang, batch_size):
+        """
+        Iterates over the terms of a language by batches.
+        """
+        cursor = None
+        while True:
+            terms, cursor = self.terms_page(lang, cursor, batch_size)
+            if len(terms) > 0:
+                yield terms
+            if cursor is None:
+                return
+
+    @traced
+    def memory_usage(self):
+        """
+        Returns the number of keys of the dictionary and the memory they
+        use in bytes.
+        """
+        count, total, batch = 0, 0, []
+        scan_count = settings.database.scan_count
+        for pattern in ('{}:*', '{}@*'):
+            for key in self.storage.scan_iter(pattern.format(self.key),
+                                              scan_count):
+                batch.append(key)
+                if len(batch) >= scan_count:
+                    total += self.storage.memory_usage(batch)
+                    count += len(batch)
+                    batch = []
+        if len(batch) > 0:
+            total += self.storage.memory_usage(batch)
+            count += len(batch)
+        return count, total
+
+    @traced
+    def migrate(self, batch_size=None, wait=False):
+        """
+        Converts a dictionary to the latest schema while it is in use.
+        Terms are copied by batches with their stored tokens, then the
+        schema key is switched and the version counters are bumped, so
+        running processes move to the new layout within
+        cache.version_interval. Once this delay is over, terms added
+        meanwhile are copied again and the previous keys are dropped: by
+        this call with wait, otherwise by the next call of migrate.
+        Returns the number of terms copied.
+        """
+        if batch_size is None:
+            batch_size = settings.database.batch_size
+        pending = self.storage.hgetall(self.migration_key())
+        count = 0
+        if len(pending) == 0:
+            schema = self.schema
+            if schema >= LATEST_SCHEMA:
+                return 0
+            count = self._switch_schema(schema, batch_size)
+            pending = self.storage.hgetall(self.migration_key())
+        delay = float(pending['deadline']) - time.time()
+        if delay > 0:
+            if not wait:
+                return count
+            time.sleep(delay)
+        return count + self._drop_schema(int(pending['schema']), batch_size)
+
+    def _switch_schema(self, schema, batch_size):
+        """
+        Copies the terms of all languages to the latest schema, then
+        switches the schema key, see migrate.
+        """
+        source = self.with_schema(schema)
+        target = self.with_schema(LATEST_SCHEMA)
+        # Pins the schema until the copy is done, scripts set it if unset
+        self.storage.setnx(self.schema_key(), schema)
+        languages = source.languages()
+        count = 0
+        for lang in languages:
+            count += target._copy_terms(source, lang, batch_size)
+        pipe = self.storage.pipeline(transaction=False)
+        pipe.hset(self.migration_key(), 'schema', schema)
+        pipe.hset(self.migration_key(), 'deadline',
+                  repr(time.time() + settings.cache.version_interval))
+        pipe.execute()
+        self.storage.set(self.schema_key(), LATEST_SCHEMA)
+        for lang in languages:
+            self.storage.incr(self.version_key(lang))
+        self._schema = None
+        return count
+
+    def _drop_schema(self, schema, batch_size):
+        """
+        Copies the terms added with a previous schema since the switch,
+        then drops its keys, see migrate.
+        """
+        source = self.with_schema(schema)
+        target = self.with_schema(LATEST_SCHEMA)
+        languages = source.languages()
+        count = 0
+        for lang in languages:
+            count += target._copy_terms(source, lang, batch_size)
+        for lang in languages:
+            if schema == 1:
+                self.storage.delete_pattern('{}:*'.format(
+                    source.lang_key(lang)))
+            else:
+                self.storage.delete(source.terms_list_key(lang))
+                target._prune_terms_index(lang, batch_size)
+            target.invalidate(lang)
+        if schema == 1:
+            self.storage.delete(source.terms_list_key(None))
+        self.storage.delete(self.migration_key())
+        self.logger.info('{} terms of {} migrated to schema {}'.format(
+            count, self._name, LATEST_SCHEMA))
+        return count
+
+    def _copy_terms(self, source, lang, batch_size):
+        """
+        Copies the terms of a language from a dictionary with a previous
+        schema. Schema v1 terms are added with their stored tokens, so
+        nothing is tokenized again. Schema v2 only differs by its terms
+        list, which is copied to the terms index.
+        """
+        count = 0
+        for terms in source._term_batches(lang, batch_size):
+            if source.schema == 1:
+                # The v1 list is shared by languages, other terms have no
+                # tokens
+                batch = [(term, tokens) for term, tokens
+                         in zip(terms, source._stored_tokens(terms, lang))
+                         if len(tokens) > 0]
+                if len(batch) > 0:
+                    count += self.add_tokenized_terms(batch, lang)
+            else:
+                members = []
+                for term in terms:
+                    members += [0, term]
+                count += self.storage.zadd(self.terms_index_key(lang),
+                                           *members)
+        return count
+
+    def _prune_terms_index(self, lang, batch_size):
+        """
+        Removes the terms deleted from a schema v2 list while it was copied
+        to the terms index.
+        """
+        for terms in self._term_batches(lang, batch_size):
+            pipe = self.storage.pipeline(transaction=False)
+            for term in terms:
+                pipe.hexists(self.ids_key(lang), term.lower())
+            deleted = [term for term, exists in zip(terms, pipe.execute())
+                       if not exists]
+            if len(deleted) > 0:
+                self.storage.zrem(self.terms_index_key(lang), *deleted)
+
+    def stored_terms(self, lang, batch_size=None):
+        """
+        Iterates over the (term, tokens) pairs of a language, reading them
+        by batches.
+        """
+        if batch_size is None:
+            batch_size = settings.database.batch_size
+        for terms in self._term_batches(lang, batch_size):
+            # The v1 list is shared by languages, other terms have no tokens
+            for term, tokens in zip(terms, self._stored_tokens(terms, lang)):
+                if len(tokens) > 0:
+                    yield term, tokens
+
+    def _stored_tokens(self, terms, lang):
+        """
+        Reads the tokens stored for a batch of terms in one pipeline.
+        """
+        schema = self.schema
+        pipe = self.storage.pipeline(transaction=False)
+        for term in terms:
+            if schema == 1:
+                pipe.smembers(self.term_key(lang, term))
+            else:
+                pipe.hget(self.ids_key(lang), term.lower())
+        if schema == 1:
+            return [sorted(tokens) for tokens in pipe.execute()]
+        return [self._split_tokens(value) for value in pipe.execute()]
+
+    @traced
+    def export_snapshot(self, file_name, lang, batch_size=None):
+        """
+        Writes the terms of a language with their tokens to a snapshot
+        file, see feet.entities.snapshot. Returns the number of terms.
+        """
+        with SnapshotWriter(file_name, lang) as snapshot:
+            for term, tokens in self.stored_terms(lang, batch_size):
+                snapshot.write(term, tokens)
+        self.logger.info('{} terms of {} exported to {}'.format(
+            snapshot.count, self._name, file_name))
+        return snapshot.count
+
+    @traced
+    def import_snapshot(self, file_name, lang=None, batch_size=None):
+        """
+        Restores a snapshot file by batches of pipelined writes without
+        tokenizing terms again. Terms are restored in the language of the
+        snapshot unless lang is given. Returns the number of terms added.
+        """
+        if batch_size is None:
+            batch_size = settings.database.batch_size
+        count, batch = 0, []
+        with SnapshotReader(file_name) as snapshot:
+            lang = lang or snapshot.lang
+            self.add_language(lang)
+            for term, tokens in snapshot:
+                batch.append((term, tokens))
+                if len(batch) >= batch_size:
+                    count += self.add_tokenized_terms(batch, lang)
+                    batch = []
+            if len(batch) > 0:
+                count += self.add_tokenized_terms(batch, lang)
+        if count > 0 and settings.bloom.enabled:
+            self.build_bloom_filter(lang, batch_size)
+        self.logger.info('{} terms of {} imported from {}'.format(
+            count, self._name, file_name))
+        return count
+
 
 class CSVDictionary(Dictionary):
-    def parse_file(self, file_name):
+    def read_file(self, file_name, offset=0):
         """
-        Easy parsing CSV file
+        Streams the first column of a CSV file, the header is skipped when
+        reading from the start of the file.
         """
-        first_line = True
-        with open(file_name, 'rb') as f:
-            reader = csv.reader(f, delimiter=',')
+        with open(file_name, 'rb') as handle:
+            handle.seek(offset)
+            # Offset after the lines consumed by the reader so far, a quoted
+            # value may span several lines
+            position = [offset]
+
+            def lines():
+                while True:
+                    line = handle.readline()
+                    if line == '':
+                        return
+                    position[0] = handle.tell()
+                    yield line
+
+            reader = csv.reader(lines(), delimiter=',')
+            if offset == 0:
+                next(reader, None)
             for row in reader:
-                if first_line:
-                    first_line = False
-                    continue
-                else:
-                    yield row[0]
+                if len(row) > 0:
+                    yield row[0], position[0]
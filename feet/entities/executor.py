@@ -0,0 +1,297 @@
+# -*- coding: utf8 -*-
+# executor.py
+# Process pool extracting entities
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Extraction spread over worker processes, so NLP runs on several cores
+instead of one under the GIL.
+
+Each worker loads the punkt tokenizer, the perceptron tagger and the MeCab
+tagger when it starts and opens its own storage connections, those of the
+parent are never used after the fork. A worker is replaced after
+max_tasks_per_child tasks, which bounds the memory held by long running
+workers. Dictionaries are sent to workers by name (see Dictionary), with the
+memory backend workers only see the terms loaded before they started.
+
+Tasks return futures that coroutines can yield. The pool counts submitted,
+completed and failed tasks, the tasks in between are waiting in its queue or
+running in a worker. multiprocessing only calls back tasks that succeed: a
+watcher thread fails the futures of tasks that could not be pickled, of
+tasks still queued after the timeout of the pool (expired), and of tasks
+still running after the timeout since a worker picked them up (lost, their
+worker may have died). Expired tasks still run later, their output is
+dropped. A pool that lost tasks is terminated when it is closed, it would
+wait for them forever.
+"""
+
+import time
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.queues import SimpleQueue
+from collections import deque
+from concurrent.futures import Future, wait
+from feet import storage
+from feet.config import settings
+from feet.exceptions import ExtractionError
+from feet.entities.extractor import Extractor
+from feet.entities.nlp import Parser
+from feet.utils.logger import LoggingMixin
+
+# Seconds between two checks of the watcher of a pool
+WATCH_INTERVAL = 0.5
+
+
+_started = None
+
+
+def _init_worker(started):
+    global _started
+    _started = started
+    storage.detach()
+    Parser().warm_up()
+
+
+def _run_task(task, *args):
+    # Tells the pool the task is picked up, see ExtractionPool._watch
+    if _started is not None:
+        _started.put(task)
+    return extract_batch(*args)
+
+
+def extract_batch(dictionary, texts, lang=None, grammar=None, mode=None,
+                  fuzzy=False):
+    """
+    Returns the output of each text of a batch, like Extractor.extract_many.
+    """
+    try:
+        engine = Extractor(dictionary, grammar, mode, fuzzy)
+        return True, engine.extract_many(texts, lang)[0]
+    except Exception:
+        # Exceptions may not be picklable, the traceback always is
+        return False, traceback.format_exc()
+
+
+class ExtractionPool(LoggingMixin):
+    """
+    Pool of extracting processes.
+    """
+    def __init__(self, workers=None, max_tasks_per_child=None, window=None,
+                 timeout=None):
+        self.workers = workers or settings.extraction.workers or \
+            multiprocessing.cpu_count()
+        self.max_tasks_per_child = max_tasks_per_child or \
+            settings.extraction.max_tasks_per_child or None
+        self.window = window or 2 * self.workers
+        self.timeout = timeout or settings.timeout
+        self._lock = threading.Lock()
+        self._submitted, self._completed, self._failed = 0, 0, 0
+        self._max_pending, self._expired, self._lost = 0, 0, 0
+        # Futures, submit and start times, results of tasks by task number
+        self._tasks = {}
+        # Results of the expired tasks, they still run
+        self._orphans = []
+        # Numbers of the tasks picked up by workers
+        self._started = SimpleQueue()
+        self._pool = multiprocessing.Pool(
+            self.workers, initializer=_init_worker,
+            initargs=(self._started,),
+            maxtasksperchild=self.max_tasks_per_child)
+        self._stopped = threading.Event()
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def submit(self, dictionary, texts, lang=None, grammar=None, mode=None,
+               fuzzy=False):
+        """
+        Extracts entities from a batch of texts in a worker. Returns a
+        future of the output of each text, it fails with ExtractionError
+        when the task fails, waits in the queue or runs for more than
+        timeout seconds.
+        """
+        future = Future()
+        with self._lock:
+            self._submitted += 1
+            self._max_pending = max(self._max_pending, self.pending)
+            task = self._submitted
+            self._tasks[task] = [future, time.time(), None, None]
+        try:
+            result = self._pool.apply_async(
+                _run_task, (task, dictionary, texts, lang, grammar, mode,
+                            fuzzy),
+                callback=lambda output: self._done(task, *output))
+        except Exception:
+            self._done(task, False, traceback.format_exc())
+            raise
+        with self._lock:
+            if task in self._tasks:
+                self._tasks[task][3] = result
+        return future
+
+    def _done(self, task, succeeded, value, counter=None):
+        """
+        Resolves the future of a task, once. counter names the counter of
+        failed tasks that are still queued (_expired) or running (_lost).
+        """
+        with self._lock:
+            entry = self._tasks.pop(task, None)
+            if entry is None:
+                return
+            if succeeded:
+                self._completed += 1
+            else:
+                self._failed += 1
+            if counter is not None:
+                setattr(self, counter, getattr(self, counter) + 1)
+        future = entry[0]
+        if succeeded:
+            future.set_result(value)
+        else:
+            self.logger.error(value)
+            future.set_exception(ExtractionError(value))
+
+    def _watch(self):
+        """
+        Fails the tasks that multiprocessing will not call back: tasks that
+        failed outside extract_batch, and tasks past their deadline in the
+        queue or in a worker.
+        """
+        while not self._stopped.wait(WATCH_INTERVAL):
+            now = time.time()
+            with self._lock:
+                while not self._started.empty():
+                    entry = self._tasks.get(self._started.get())
+                    if entry is not None:
+                        entry[2] = now
+                tasks = list(self._tasks.items())
+            for task, (_, submitted, started, result) in tasks:
+                if result is not None and result.ready() and \
+                        not result.successful():
+                    try:
+                        result.get(0)
+                    except Exception as error:
+                        self._done(task, False, 'task {} failed: {!r}'.format(
+                            task, error))
+                elif started is None and now > submitted + self.timeout:
+                    if result is not None:
+                        self._orphans.append(result)
+                    self._done(task, False, 'task {} queued for more than '
+                               '{}s'.format(task, self.timeout), '_expired')
+                elif started is not None and now > started + self.timeout:
+                    self._done(task, False, 'task {} timed out after {}s, '
+                               'its worker may have died'.format(
+                                   task, self.timeout), '_lost')
+
+    def extract(self, dictionary, batches, lang=None, grammar=None,
+                mode=None, fuzzy=False):
+        """
+        Yields the output of each text of each batch, in order. At most
+        window batches are in flight.
+        """
+        pending = deque()
+        for batch in batches:
+            pending.append(self.submit(dictionary, batch, lang, grammar, mode,
+                                       fuzzy))
+            if len(pending) >= self.window:
+                for output in pending.popleft().result():
+                    yield output
+        while len(pending) > 0:
+            for output in pending.popleft().result():
+                yield output
+
+    @property
+    def pending(self):
+        """
+        Number of tasks waiting in the queue or running.
+        """
+        return self._submitted - self._completed - self._failed
+
+    def stats(self):
+        """
+        Counters of the tasks of the pool.
+        """
+        with self._lock:
+            return {'workers': self.workers,
+                    'submitted': self._submitted,
+                    'completed': self._completed,
+                    'failed': self._failed,
+                    'expired': self._expired,
+                    'lost': self._lost,
+                    'pending': self.pending,
+                    'max_pending': self._max_pending}
+
+    def close(self):
+        """
+        Waits for the submitted tasks, then stops the workers.
+        """
+        self._pool.close()
+        with self._lock:
+            futures = [entry[0] for entry in self._tasks.values()]
+        wait(futures)
+        # Expired tasks that do not finish in time were lost too
+        deadline = time.time() + self.timeout
+        for result in self._orphans:
+            result.wait(max(0, deadline - time.time()))
+        if self._lost > 0 or not all(result.ready()
+                                     for result in self._orphans):
+            self.terminate()
+            return
+        self._pool.join()
+        self._stopped.set()
+        self._watcher.join()
+
+    def terminate(self):
+        """
+        Stops the workers at once, the pending tasks fail.
+        """
+        self._pool.terminate()
+        self._pool.join()
+        self._stopped.set()
+        self._watcher.join()
+        with self._lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            self._done(task, False, 'task {} cancelled'.format(task))
+
+
+_shared = None
+
+
+def start(workers=None, max_tasks_per_child=None):
+    """
+    Starts the pool shared by the handlers of the server. It should start
+    before the IOLoop, while the process has no other thread to fork.
+    """
+    global _shared
+    if _shared is None:
+        _shared = ExtractionPool(workers, max_tasks_per_child)
+    return _shared
+
+
+def shared():
+    """
+    Pool shared by the handlers of the server, None when it is not started.
+    """
+    return _shared
+
+
+def stop():
+    global _shared
+    if _shared is not None:
+        _shared.close()
+        _shared = None
@@ -8,77 +8,324 @@
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
 import traceback
+from datetime import timedelta
+from tornado import gen
 from feet.utils.logger import LoggingMixin
 from feet.utils.decorators import timeout, timeit, memoized
+from feet.utils.timez import Timer
 from feet.config import settings
 from feet.entities.nlp import Parser
+from feet.entities import gazetteer
+from feet.entities.dictionary import unique
+from feet.storage import metrics
+from feet.storage.asynchronous import run_in_executor
+
+# grammar: chunks of a POS grammar looked up in the dictionary
+# gazetteer: dictionary terms matched in the text, see feet.entities.gazetteer
+MODES = ('grammar', 'gazetteer')
 
 
 class Extractor(LoggingMixin):
     def __init__(self,
                  ref_dictionary,
-                 grammar=None):
+                 grammar=None,
+                 mode=None,
+                 fuzzy=False):
+        if mode is None:
+            mode = 'grammar'
+        if mode not in MODES:
+            raise ValueError('unknown extraction mode %s' % mode)
+        self._mode = mode
         if grammar is None:
             self._grammar = 'NE : {<NNP|NNPS|NN>*<DT>?<NNP|NNPS|JJ|NNS|NN>+}'
         else:
             self._grammar = grammar
         self._ref_dictionary = ref_dictionary
+        # Second pass of lookups on the trigram index of the dictionary,
+        # see Dictionary.fuzzy_tokens
+        self._fuzzy = fuzzy
+
+    @property
+    def dictionary(self):
+        return self._ref_dictionary
 
     @memoized
     def parser(self):
         return Parser('en')
 
+    def extract(self, text, lang=None):
+        """
+        Extract entities from a text. Returns the output and a timer, the
+        storage commands issued meanwhile are attached to the timer as
+        commands (see feet.storage.metrics).
+        """
+        with metrics.collect() as commands:
+            output, timer = self._extract(text, lang)
+        timer.commands = commands
+        return output, timer
+
     @timeit
     @timeout(settings.timeout)
-    def extract(self, text, lang=None):
+    def _extract(self, text, lang=None):
+        if self._mode == 'gazetteer':
+            return self.match(self.compiled_gazetteer(lang), text)
+        return self.lookup_chunks(self.chunks(text, lang), lang)
+
+    def extract_many(self, texts, lang=None):
         """
-        Extract entities from a text
+        Extract entities from many texts. Returns the output of each text in
+        order and a timer, like extract.
+        """
+        with metrics.collect() as commands:
+            outputs, timer = self._extract_many(texts, lang)
+        timer.commands = commands
+        return outputs, timer
+
+    @timeit
+    @timeout(settings.timeout)
+    def _extract_many(self, texts, lang=None):
+        if self._mode == 'gazetteer':
+            compiled = self.compiled_gazetteer(lang)
+            return [self.match(compiled, text) for text in texts]
+        chunks_list = [chunks for chunks, _ in
+                       self.parser.extract_entities_many(texts, self._grammar,
+                                                         lang)[0]]
+        lookups = self.lookup_many(unique(chunk for chunks in chunks_list
+                                          for chunk in chunks), lang)
+        return [self.output(chunks, lookups) for chunks in chunks_list]
+
+    def chunks(self, text, lang=None):
+        """
+        NLP stage of the extraction: chunks of the grammar in a text.
         """
         res = self.parser.extract_entities(text, self._grammar, lang)
-        chunks = res[0][0]
-        output = []
+        return res[0][0]
+
+    def lookup_chunks(self, chunks, lang, exact_matches=None):
+        """
+        Lookup stage of the extraction: describes the chunks found in the
+        dictionary. Chunks are looked up together, see lookup_many.
+        exact_matches tells which chunks are terms when it is already known,
+        see Registry.extract.
+        """
         self.logger.debug('lang: %s' % lang)
         self.logger.debug('chunks: %s' %
                           ','.join([c.decode('utf8') for c in chunks]))
-        if len(chunks) >= 1:
-            for idx, chunk in enumerate(chunks):
-                entities, not_entity =\
-                    self.lookup(chunk, lang)
-                self.logger.debug('selection: %s' % entities)
-                add_new_variant, entity_found, add_new_entity = 0, 0, 0
-                if len(entities) > 0 and not_entity == []:
-                    entity_found = 1
-                elif len(not_entity) > 0 and len(list(entities)) == 0:
-                    add_new_entity = 1
-                elif len(not_entity) > 0 and len(list(entities)) > 0:
-                    entity_found, add_new_variant = 1, 1
-                if len(not_entity) > 0 or len(list(entities)) > 0:
-                    output.append({"position": idx,
-                                   "chunk": chunk,
-                                   "new_variant": not_entity,
-                                   "add_new_variant": add_new_variant,
-                                   "entity_found": entity_found,
-                                   "entity_candidates": list(entities),
-                                   "add_new_entity": add_new_entity})
-
-            return output
-        else:
-            return []
+        if exact_matches is not None:
+            exact_matches = dict(zip(chunks, exact_matches))
+        return self.output(chunks, self.lookup_many(unique(chunks), lang,
+                                                    exact_matches))
+
+    def output(self, chunks, lookups):
+        """
+        Describes the chunks of a text from the lookups of lookup_many.
+        """
+        output = []
+        for idx, chunk in enumerate(chunks):
+            self.logger.debug('selection: %s' % lookups[chunk][0])
+            entry = self.output_entry(idx, chunk, *lookups[chunk])
+            if entry is not None:
+                output.append(entry)
+        return output
+
+    @gen.coroutine
+    def extract_async(self, text, lang=None):
+        """
+        Extract entities from a text without blocking the IOLoop on storage
+        I/O. Returns the same (output, timer) pair as extract. Commands run
+        on the storage thread pool are only recorded in the registry of
+        feet.storage.metrics, so timer.commands is None.
+        """
+        with Timer() as timer:
+            output = yield gen.with_timeout(
+                timedelta(seconds=settings.timeout),
+                self._extract_async(text, lang))
+        timer.commands = None
+        raise gen.Return((output, timer))
+
+    @gen.coroutine
+    def _extract_async(self, text, lang):
+        if self._mode == 'gazetteer':
+            compiled = yield run_in_executor(self.compiled_gazetteer, lang)
+            raise gen.Return(self.match(compiled, text))
+        output = yield self.lookup_chunks_async(self.chunks(text, lang),
+                                                lang)
+        raise gen.Return(output)
+
+    @gen.coroutine
+    def lookup_chunks_async(self, chunks, lang):
+        """
+        Same as lookup_chunks, the lookups run on the storage thread pool.
+        """
+        lookups = yield run_in_executor(self.lookup_many, unique(chunks),
+                                        lang)
+        raise gen.Return(self.output(chunks, lookups))
+
+    def compiled_gazetteer(self, lang):
+        """
+        Gazetteer of the dictionary in the language of the texts. Gazetteer
+        mode does not tokenize texts, so their language is not detected.
+        """
+        if lang is None:
+            raise ValueError('gazetteer mode needs the language of texts')
+        return gazetteer.compiled(self._ref_dictionary, lang)
+
+    def match(self, compiled, text):
+        """
+        Describes the matches of a compiled gazetteer like looked up chunks.
+        """
+        return [self.output_entry(idx, chunk, terms, [])
+                for idx, (chunk, terms) in enumerate(compiled.matches(text))]
 
-    def lookup(self, chunk, text_lang):
+    def output_entry(self, idx, chunk, entities, not_entity):
+        """
+        Describes the lookup of a chunk, None if nothing was found
+        """
+        add_new_variant, entity_found, add_new_entity = 0, 0, 0
+        if len(entities) > 0 and not_entity == []:
+            entity_found = 1
+        elif len(not_entity) > 0 and len(list(entities)) == 0:
+            add_new_entity = 1
+        elif len(not_entity) > 0 and len(list(entities)) > 0:
+            entity_found, add_new_variant = 1, 1
+        if len(not_entity) > 0 or len(list(entities)) > 0:
+            return {"position": idx,
+                    "chunk": chunk,
+                    "new_variant": not_entity,
+                    "add_new_variant": add_new_variant,
+                    "entity_found": entity_found,
+                    "entity_candidates": list(entities),
+                    "add_new_entity": add_new_entity}
+        return None
+
+    def lookup(self, chunk, text_lang, exact_match=None):
         """
         Look for best candidates of entities in a dictionary
         """
-        tokens, index, entity_options_list, not_an_entity = \
-            [], 0, [], []
+        not_an_entity = []
         self.logger.debug('chunk: %s' % chunk)
         # TODO: make a decision here to enforce or not enforce
         # the language of document compated to the language of
         # chunk
-        if self._ref_dictionary.exact_match(chunk, text_lang):
+        if exact_match is None:
+            exact_match = self._ref_dictionary.exact_match(chunk, text_lang)
+        if exact_match:
             self.logger.debug('\texact match %s' % chunk)
             return set([chunk]), not_an_entity
         tokens = self.parser.word_tokenize(chunk, text_lang)
+        entities, not_an_entity = self.lookup_tokens(tokens, text_lang)
+        if len(entities) == 0 and self._fuzzy:
+            corrected = self.correct(tokens, text_lang)
+            if corrected != tokens:
+                self.logger.debug('\tcorrected tokens:%s',
+                                  ','.join(corrected))
+                entities, not_an_entity = self.lookup_tokens(corrected,
+                                                             text_lang)
+        return entities, not_an_entity
+
+    def lookup_many(self, chunks, text_lang, exact_matches=None):
+        """
+        Same as lookup for distinct chunks, with a constant number of
+        pipelined phases whatever the number of chunks: exact matches of
+        the chunks with the candidates of their tokens, then the tokens of
+        all candidates. In fuzzy mode, the chunks without entities are
+        corrected together, see correct_many. exact_matches maps chunks to
+        their exact match when it is already known. Returns the entities
+        and the tokens that are not an entity of each chunk.
+        """
+        dictionary = self._ref_dictionary
+        if exact_matches is None:
+            exact_matches = {}
+        lookups, pending = {}, []
+        for chunk in chunks:
+            if exact_matches.get(chunk):
+                lookups[chunk] = (set([chunk]), [])
+            else:
+                pending.append((chunk, self.parser.word_tokenize(chunk,
+                                                                 text_lang)))
+        unknown = [chunk for chunk, _ in pending
+                   if chunk not in exact_matches]
+        tokens = unique(token.lower() for _, chunk_tokens in pending
+                        for token in chunk_tokens)
+        chunks_tokens, tokens_candidates = dictionary.lookup_many(
+            unknown, tokens, text_lang)
+        exact = set(chunk for chunk, chunk_tokens
+                    in zip(unknown, chunks_tokens) if len(chunk_tokens) > 0)
+        candidates = dict(zip(tokens, tokens_candidates))
+        names = unique(name for chunk, chunk_tokens in pending
+                       if chunk not in exact
+                       for token in chunk_tokens
+                       for name in candidates[token.lower()])
+        names_tokens = dict(zip(names, dictionary.tokens_many(names,
+                                                              text_lang)))
+        missed = []
+        for chunk, chunk_tokens in pending:
+            if chunk in exact:
+                lookups[chunk] = (set([chunk]), [])
+                continue
+            lookups[chunk] = self.resolve_tokens(chunk_tokens, candidates,
+                                                 names_tokens)
+            if len(lookups[chunk][0]) == 0 and self._fuzzy:
+                missed.append((chunk, chunk_tokens))
+        if len(missed) > 0:
+            lookups.update(self.correct_many(missed, candidates, text_lang))
+        return lookups
+
+    def correct_many(self, chunks, candidates, text_lang):
+        """
+        Same as correct then lookup_tokens for the (chunk, tokens) pairs
+        missed by lookup_many, with the candidates it read for their tokens.
+        The matches of all unknown tokens are read together, then the
+        candidates of the corrected tokens and their tokens. Returns the
+        lookups of the corrected chunks.
+        """
+        dictionary = self._ref_dictionary
+        unknown = unique(token.lower() for _, chunk_tokens in chunks
+                         for token in chunk_tokens
+                         if len(candidates[token.lower()]) == 0)
+        matches = dictionary.fuzzy_tokens_many(unknown, text_lang)
+        replacements = dict((token, found[0]) for token, found
+                            in zip(unknown, matches) if len(found) > 0)
+        corrected = []
+        for chunk, chunk_tokens in chunks:
+            tokens = [replacements.get(token.lower(), token)
+                      for token in chunk_tokens]
+            if tokens != chunk_tokens:
+                corrected.append((chunk, tokens))
+        tokens = unique(token.lower() for _, chunk_tokens in corrected
+                        for token in chunk_tokens)
+        candidates = dict(zip(tokens, dictionary.candidates_many(tokens,
+                                                                 text_lang)))
+        names = unique(name for token in tokens for name in candidates[token])
+        names_tokens = dict(zip(names, dictionary.tokens_many(names,
+                                                              text_lang)))
+        return dict((chunk, self.resolve_tokens(chunk_tokens, candidates,
+                                                names_tokens))
+                    for chunk, chunk_tokens in corrected)
+
+    def resolve_tokens(self, chunk_tokens, candidates, names_tokens):
+        """
+        Same as lookup_tokens with the candidates of the lowercased tokens
+        of a chunk and the tokens of these candidates already read.
+        """
+        entity_options_list, not_an_entity = [], []
+        for token in chunk_tokens:
+            entities = candidates[token.lower()]
+            if len(entities) > 0:
+                entities = [name for name in entities
+                            if self.is_best_choice(chunk_tokens,
+                                                   names_tokens[name])]
+                if len(entities) > 0:
+                    entity_options_list.append(entities)
+                else:
+                    not_an_entity.append(token)
+        return self.intersection(entity_options_list), not_an_entity
+
+    def lookup_tokens(self, tokens, text_lang):
+        """
+        Look for best candidates of entities sharing tokens of a chunk
+        """
+        index, entity_options_list, not_an_entity = 0, [], []
         self.logger.debug('\tchunk tokens:%s', ','.join(tokens))
         while index < len(tokens):
             try:
@@ -105,6 +352,78 @@ class Extractor(LoggingMixin):
                 self.logger.debug('options list: %s' % entity_options_list)
         return self.intersection(entity_options_list), not_an_entity
 
+    def correct(self, tokens, text_lang):
+        """
+        Replaces the tokens unknown to the dictionary by their closest
+        stored token, if any.
+        """
+        corrected = []
+        for token in tokens:
+            if len(self._ref_dictionary.candidates(token, text_lang)) == 0:
+                matches = self._ref_dictionary.fuzzy_tokens(token, text_lang)
+                if len(matches) > 0:
+                    token = matches[0]
+            corrected.append(token)
+        return corrected
+
+    @gen.coroutine
+    def lookup_async(self, chunk, text_lang):
+        """
+        Look for best candidates of entities in a dictionary without
+        blocking: candidates of all tokens are fetched concurrently.
+        """
+        exact_match = yield self._ref_dictionary.exact_match_async(
+            chunk, text_lang)
+        if exact_match:
+            raise gen.Return((set([chunk]), []))
+        tokens = self.parser.word_tokenize(chunk, text_lang)
+        entities, not_an_entity = yield self.lookup_tokens_async(tokens,
+                                                                 text_lang)
+        if len(entities) == 0 and self._fuzzy:
+            corrected = yield self.correct_async(tokens, text_lang)
+            if corrected != tokens:
+                entities, not_an_entity = yield self.lookup_tokens_async(
+                    corrected, text_lang)
+        raise gen.Return((entities, not_an_entity))
+
+    @gen.coroutine
+    def lookup_tokens_async(self, tokens, text_lang):
+        entity_options_list, not_an_entity = [], []
+        candidates = yield [self._ref_dictionary.candidates_async(token,
+                                                                  text_lang)
+                            for token in tokens]
+        for token, entities in zip(tokens, candidates):
+            if entities != set([]):
+                entities = yield self.select_best_choice_async(
+                    tokens,
+                    entities,
+                    text_lang
+                )
+                if len(entities) > 0:
+                    entity_options_list.append(entities)
+                else:
+                    not_an_entity.append(token)
+        raise gen.Return((self.intersection(entity_options_list),
+                          not_an_entity))
+
+    @gen.coroutine
+    def correct_async(self, tokens, text_lang):
+        """
+        Same as correct, tokens are checked concurrently.
+        """
+        candidates = yield [self._ref_dictionary.candidates_async(token,
+                                                                  text_lang)
+                            for token in tokens]
+        unknown = [token for token, entities in zip(tokens, candidates)
+                   if len(entities) == 0]
+        matches = yield [self._ref_dictionary.fuzzy_tokens_async(token,
+                                                                 text_lang)
+                         for token in unknown]
+        replacements = dict((token, found[0]) for token, found
+                            in zip(unknown, matches) if len(found) > 0)
+        raise gen.Return([replacements.get(token, token)
+                          for token in tokens])
+
     def select_best_choice(self, chunk_tokens, choices, chunk_lang):
         """
         let's see the proportion of tokens that are common between considered
@@ -114,17 +433,39 @@ class Extractor(LoggingMixin):
         for candidate in choices:
             self.logger.debug('\tcandidate:%s' % candidate)
             tokens = self._ref_dictionary.tokens(candidate, chunk_lang)
-            self.logger.debug('\tcandidate tokens:%s' % ','.join(tokens))
-            res = set.intersection(set(tokens), set(chunk_tokens))
-            if len(tokens) != 0:
-                ratio = float(len(res)) / float(len(tokens))
-            else:
-                ratio = 0
-            self.logger.debug('\t\tratio:%f' % ratio)
-            if ratio > 2.0 / 3.0:
+            if self.is_best_choice(chunk_tokens, tokens):
                 output.append(candidate)
         return output
 
+    @gen.coroutine
+    def select_best_choice_async(self, chunk_tokens, choices, chunk_lang):
+        """
+        Same as select_best_choice, tokens of all choices are fetched
+        concurrently.
+        """
+        choices = list(choices)
+        tokens_list = yield [self._ref_dictionary.tokens_async(candidate,
+                                                               chunk_lang)
+                             for candidate in choices]
+        raise gen.Return([candidate for candidate, tokens
+                          in zip(choices, tokens_list)
+                          if self.is_best_choice(chunk_tokens, tokens)])
+
+    def is_best_choice(self, chunk_tokens, tokens):
+        """
+        Checks if more than 2/3 of the tokens of a candidate are in the chunk,
+        tokens are compared case insensitively like dictionary lookups.
+        """
+        self.logger.debug('\tcandidate tokens:%s' % ','.join(tokens))
+        res = set.intersection(set(token.lower() for token in tokens),
+                               set(token.lower() for token in chunk_tokens))
+        if len(tokens) != 0:
+            ratio = float(len(res)) / float(len(tokens))
+        else:
+            ratio = 0
+        self.logger.debug('\t\tratio:%f' % ratio)
+        return ratio > 2.0 / 3.0
+
     def intersection(self, options_lists):
         """
         Get intersection of lists of candidates for entities
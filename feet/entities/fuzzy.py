@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*-
+# fuzzy.py
+# Approximate token matching
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Tools of the trigram index of dictionary tokens.
+
+Each token is indexed under the character trigrams of the token padded with
+two spaces in front and one after, so short tokens have trigrams too and the
+first characters weigh more. A misspelled token shares most of its trigrams
+with the right one: candidates are the tokens found in the postings of its
+trigrams, ranked by the Jaccard similarity of their trigram sets, then
+checked with an edit distance that stops as soon as the bound is exceeded.
+"""
+
+
+def normalize(token):
+    if not isinstance(token, unicode):
+        token = token.decode('utf8', 'replace')
+    return token.lower()
+
+
+def trigrams(token):
+    """
+    Returns the set of trigrams of a token, as utf8 strings.
+    """
+    padded = u'  {} '.format(normalize(token))
+    return set(padded[idx:idx + 3].encode('utf8')
+               for idx in range(len(padded) - 2))
+
+
+def similarity(first, second):
+    """
+    Jaccard similarity of two trigram sets.
+    """
+    if len(first) == 0 and len(second) == 0:
+        return 1.0
+    shared = len(first & second)
+    return float(shared) / (len(first) + len(second) - shared)
+
+
+def edit_distance(first, second, max_distance):
+    """
+    Levenshtein distance of two tokens, max_distance + 1 when it is larger
+    than max_distance.
+    """
+    first, second = normalize(first), normalize(second)
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    previous = range(len(second) + 1)
+    for idx, char in enumerate(first):
+        current = [idx + 1]
+        for jdx, other in enumerate(second):
+            current.append(min(previous[jdx + 1] + 1,
+                               current[jdx] + 1,
+                               previous[jdx] + (char != other)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
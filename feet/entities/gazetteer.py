@@ -0,0 +1,225 @@
+# -*- coding: utf8 -*-
+# gazetteer.py
+# Dictionary matching with an Aho-Corasick automaton
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Gazetteer extraction: the terms of a dictionary language are compiled into
+an Aho-Corasick automaton over normalized text (NFKC, lowercase, collapsed
+whitespace), then each document is scanned in a single pass without any
+sentence split, POS tagging or storage round trip.
+
+Matches must start and end on word boundaries, except for languages written
+without spaces (CHARACTER_LANGUAGES) which are matched character by
+character. Overlapping matches are resolved leftmost-longest.
+
+Compiled gazetteers are kept per dictionary language and compiled again
+when the version counter of the language changes, see feet.entities.cache.
+"""
+
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from feet.utils.logger import LoggingMixin
+from feet.entities.cache import lookup_cache
+
+CHARACTER_LANGUAGES = ('ja', 'zh')
+
+
+def normalize(text):
+    """
+    Normalizes a text, returns the normalized text and the offset in the
+    original text of each normalized character.
+    """
+    if not isinstance(text, unicode):
+        text = text.decode('utf8')
+    output, offsets = [], []
+    for idx, char in enumerate(text):
+        if char.isspace():
+            if len(output) == 0 or output[-1] == u' ':
+                continue
+            output.append(u' ')
+            offsets.append(idx)
+            continue
+        for normalized in unicodedata.normalize('NFKC', char).lower():
+            output.append(normalized)
+            offsets.append(idx)
+    if len(output) > 0 and output[-1] == u' ':
+        output.pop()
+        offsets.pop()
+    return u''.join(output), offsets
+
+
+class Automaton(object):
+    """
+    Aho-Corasick automaton. States are indexes in the goto, fail and
+    output lists, keys must be added before build is called.
+    """
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        # Next state in the fail chain that has an output
+        self._next_output = [0]
+
+    def __len__(self):
+        return sum(1 for output in self._output if output is not None)
+
+    def add(self, key, value):
+        state = 0
+        for char in key:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._next_output.append(0)
+            state = next_state
+        if self._output[state] is None:
+            self._output[state] = (len(key), value)
+
+    def build(self):
+        """
+        Computes the fail links breadth first.
+        """
+        queue = deque(self._goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail != 0 and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                if self._output[fail] is not None:
+                    self._next_output[next_state] = fail
+                else:
+                    self._next_output[next_state] = self._next_output[fail]
+
+    def iter(self, text):
+        """
+        Yields (start, end, value) for every key found in text.
+        """
+        goto, fail = self._goto, self._fail
+        output, next_output = self._output, self._next_output
+        state = 0
+        for idx, char in enumerate(text):
+            while state != 0 and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match = state if output[state] is not None \
+                else next_output[state]
+            while match != 0:
+                length, value = output[match]
+                yield idx + 1 - length, idx + 1, value
+                match = next_output[match]
+
+
+class Gazetteer(LoggingMixin):
+    """
+    Terms of a dictionary language compiled for matching. The automaton is
+    keyed by normalized terms, its values are the stored terms.
+    """
+    def __init__(self, terms, lang):
+        self.lang = lang
+        self._automaton = Automaton()
+        spellings = OrderedDict()
+        for term in terms:
+            key, _ = normalize(term)
+            if key != u'':
+                if isinstance(term, unicode):
+                    term = term.encode('utf8')
+                spellings.setdefault(key, []).append(term)
+        for key, stored in spellings.items():
+            self._automaton.add(key, stored)
+        self._automaton.build()
+
+    def __len__(self):
+        return len(self._automaton)
+
+    @classmethod
+    def compile(klass, dictionary, lang):
+        gazetteer = klass((term for term, _
+                           in dictionary.stored_terms(lang)), lang)
+        gazetteer.logger.info('{} terms of {} compiled'.format(
+            len(gazetteer), dictionary.key))
+        return gazetteer
+
+    def on_boundaries(self, text, start, end):
+        """
+        Checks a match is not inside a word.
+        """
+        if self.lang in CHARACTER_LANGUAGES:
+            return True
+        if start > 0 and text[start].isalnum() and text[start - 1].isalnum():
+            return False
+        if end < len(text) and text[end - 1].isalnum() and \
+                text[end].isalnum():
+            return False
+        return True
+
+    def matches(self, text):
+        """
+        Returns (chunk, terms) of the leftmost-longest matches in text,
+        chunk is taken from the original text and terms are the stored
+        terms normalized like it.
+        """
+        if not isinstance(text, unicode):
+            text = text.decode('utf8')
+        normalized, offsets = normalize(text)
+        found = [(start, end, terms) for start, end, terms
+                 in self._automaton.iter(normalized)
+                 if self.on_boundaries(normalized, start, end)]
+        found.sort(key=lambda match: (match[0], -match[1]))
+        output, last_end = [], 0
+        for start, end, terms in found:
+            if start < last_end:
+                continue
+            chunk = text[offsets[start]:offsets[end - 1] + 1]
+            output.append((chunk.encode('utf8'), list(terms)))
+            last_end = end
+        return output
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled(dictionary, lang):
+    """
+    Gets the gazetteer of a dictionary language, compiled again when the
+    language changed.
+    """
+    namespace = (dictionary.key, lang)
+    version = lookup_cache.version(namespace,
+                                   lambda: dictionary.version(lang))
+    with _compiled_lock:
+        record = _compiled.get(namespace)
+    if record is not None and record[0] == version:
+        return record[1]
+    gazetteer = Gazetteer.compile(dictionary, lang)
+    with _compiled_lock:
+        _compiled[namespace] = (version, gazetteer)
+    return gazetteer
+
+
+def discard(key):
+    """
+    Drops the gazetteers of a dictionary.
+    """
+    with _compiled_lock:
+        for namespace in [namespace for namespace in _compiled
+                          if namespace[0] == key]:
+            del _compiled[namespace]
+
+
+def clear():
+    with _compiled_lock:
+        _compiled.clear()
@@ -6,8 +6,9 @@
 # Copyright (C) 2016 Romary Dupuis
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
-from nltk import word_tokenize, sent_tokenize, ne_chunk, \
-    RegexpParser, pos_tag
+import threading
+from nltk import word_tokenize, sent_tokenize, ne_chunk, RegexpParser
+from nltk.tag.perceptron import PerceptronTagger
 from nltk.tree import Tree
 from collections import defaultdict
 from langdetect import detect_langs
@@ -25,6 +26,21 @@ WORLD_2_NLTK = {
     'japanese': 'japanese'
 }
 
+_tagger = None
+_tagger_lock = threading.Lock()
+
+
+def tagger():
+    """
+    POS tagger of the process. nltk.pos_tag loads the perceptron model on
+    every call, this one is loaded once.
+    """
+    global _tagger
+    with _tagger_lock:
+        if _tagger is None:
+            _tagger = PerceptronTagger()
+        return _tagger
+
 
 class Parser(LoggingMixin):
     """
@@ -130,16 +146,10 @@ class Parser(LoggingMixin):
         Extract entities from text
         """
         entities = []
-        if lang is None:
-            lang = WORLD_2_NLTK[self.detect_language(text)]
-        else:
-            if lang in WORLD_2_NLTK.keys():
-                lang = WORLD_2_NLTK[lang]
-            else:
-                lang = self._lang
+        lang = self.text_language(text, lang)
         if lang == 'japanese':
             return JAParser().extract_entities(text), lang
-        pos_sentences = [pos_tag(self.word_tokenize(sentence, lang=lang))
+        pos_sentences = [tagger().tag(self.word_tokenize(sentence, lang=lang))
                          for sentence in self.sent_tokenize(text, lang=lang)]
 
         if grammar is not None:
@@ -154,3 +164,64 @@ class Parser(LoggingMixin):
                 self.logger.debug(tree)
                 entities = entities + self._select_entities(tree)
         return entities, lang
+
+    @timeit
+    def extract_entities_many(self, texts, grammar=None, lang=None):
+        """
+        Extract entities from many texts. Sentences of all texts are tagged
+        by a single tagger and chunked by a single parser. Returns the
+        entities and the language of each text.
+        """
+        langs = [self.text_language(text, lang) for text in texts]
+        entities = [[] for _ in texts]
+        sentences, owners, ja_parser = [], [], None
+        for idx, (text, text_lang) in enumerate(zip(texts, langs)):
+            if text_lang == 'japanese':
+                if ja_parser is None:
+                    ja_parser = JAParser()
+                entities[idx] = ja_parser.extract_entities(text)
+                continue
+            for sentence in self.sent_tokenize(text, lang=text_lang):
+                sentences.append(self.word_tokenize(sentence, lang=text_lang))
+                owners.append(idx)
+        if len(sentences) > 0:
+            if grammar is not None:
+                parse = RegexpParser(grammar).parse
+            else:
+                def parse(pos_sentence):
+                    return ne_chunk(pos_sentence, binary=False)
+            pos_sentences = tagger().tag_sents(sentences)
+            for idx, pos_sentence in zip(owners, pos_sentences):
+                tree = parse(pos_sentence)
+                self.logger.debug(tree)
+                entities[idx] += self._select_entities(tree)
+        return zip(entities, langs)
+
+    def warm_up(self):
+        """
+        Loads the models of the NLP tools, so the first text of a process
+        is not slower than the next ones. Returns the names of the loaded
+        models, the others are loaded again on first use.
+        """
+        models = [('punkt', lambda: list(self.sent_tokenize(u'Feet.', 'en'))),
+                  ('perceptron tagger', tagger),
+                  ('mecab', lambda: JAParser().mecab)]
+        loaded = []
+        for name, load in models:
+            try:
+                load()
+                loaded.append(name)
+            except Exception:
+                self.logger.warning('%s not loaded' % name)
+                self.logger.debug(traceback.format_exc())
+        return loaded
+
+    def text_language(self, text, lang=None):
+        """
+        NLTK name of the language of a text, detected when lang is None.
+        """
+        if lang is None:
+            return WORLD_2_NLTK[self.detect_language(text)]
+        if lang in WORLD_2_NLTK.keys():
+            return WORLD_2_NLTK[lang]
+        return self._lang
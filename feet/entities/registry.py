@@ -7,11 +7,18 @@
 # Copyright (C) 2016 Romary Dupuis
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
+from datetime import timedelta
+from tornado import gen
 from feet.utils.logger import LoggingMixin
-from feet.utils.decorators import memoized
+from feet.utils.decorators import memoized, timeit, timeout
+from feet.utils.timez import Timer
 from feet.entities.dictionary import Dictionary
+from feet.entities.extractor import Extractor
+from feet.entities.cache import lookup_cache
+from feet.entities import bloom, gazetteer
 from feet.config import settings
-from feet.storage import Storage, StorageMixin
+from feet.storage import StorageMixin, get_storage, metrics
+from feet.storage.asynchronous import AsyncStorage, run_in_executor
 
 
 class Registry(StorageMixin, LoggingMixin):
@@ -34,9 +41,26 @@ class Registry(StorageMixin, LoggingMixin):
         """
         if key_prefix is None:
             return False
-        storage = Storage(redis_host, redis_port, redis_db)
+        storage = get_storage(redis_host, redis_port, redis_db)
         return list(storage.smembers(klass.registry_list_key(key_prefix)))
 
+    @classmethod
+    @gen.coroutine
+    def list_async(klass,
+                   key_prefix=settings.database.prefix,
+                   redis_host=settings.database.host,
+                   redis_port=settings.database.port,
+                   redis_db=0):
+        """
+        Gets the list of registries under a prefix without blocking.
+        """
+        if key_prefix is None:
+            raise gen.Return(False)
+        storage = AsyncStorage(redis_host, redis_port, redis_db)
+        registries = yield storage.smembers(
+            klass.registry_list_key(key_prefix))
+        raise gen.Return(list(registries))
+
     @classmethod
     def flush(klass,
               key_prefix=settings.database.prefix,
@@ -48,10 +72,11 @@ class Registry(StorageMixin, LoggingMixin):
         """
         if key_prefix is None:
             return False
-        storage = Storage(redis_host, redis_port, redis_db)
-        keys = storage.keys('{}:*'.format(key_prefix))
-        for key in keys:
-            storage.delete(key)
+        storage = get_storage(redis_host, redis_port, redis_db)
+        storage.delete_pattern('{}:*'.format(key_prefix))
+        lookup_cache.clear()
+        gazetteer.clear()
+        bloom.clear()
         return True
 
     @classmethod
@@ -67,11 +92,31 @@ class Registry(StorageMixin, LoggingMixin):
         """
         if key_prefix is None:
             return None
-        storage = Storage(redis_host, redis_port, redis_db)
+        storage = get_storage(redis_host, redis_port, redis_db)
         storage.sadd(klass.registry_list_key(key_prefix), name)
         return Registry(name, dict_class, key_prefix,
                         redis_host, redis_port, redis_db)
 
+    @classmethod
+    @gen.coroutine
+    def find_or_create_async(klass,
+                             name,
+                             dict_class=Dictionary,
+                             key_prefix=settings.database.prefix,
+                             redis_host=settings.database.host,
+                             redis_port=settings.database.port,
+                             redis_db=0):
+        """
+        Finds a registry if it already exists otherwise creates it, without
+        blocking.
+        """
+        if key_prefix is None:
+            raise gen.Return(None)
+        storage = AsyncStorage(redis_host, redis_port, redis_db)
+        yield storage.sadd(klass.registry_list_key(key_prefix), name)
+        raise gen.Return(Registry(name, dict_class, key_prefix,
+                                  redis_host, redis_port, redis_db))
+
     def __init__(self,
                  name,
                  dict_class=Dictionary,
@@ -102,6 +147,14 @@ class Registry(StorageMixin, LoggingMixin):
         registry = self.storage.smembers(self.dict_key)
         return list(registry)
 
+    @gen.coroutine
+    def dictionaries_async(self):
+        """
+        Gets list of dictionaries of the registry without blocking.
+        """
+        registry = yield self.async_storage.smembers(self.dict_key)
+        raise gen.Return(list(registry))
+
     def get_dict(self, name):
         """
         Adds or gets a dictionary under a specific registry.
@@ -111,6 +164,114 @@ class Registry(StorageMixin, LoggingMixin):
         return self._dict_class(name, self.key, self._redis_host,
                                 self._redis_port, self._redis_db)
 
+    @gen.coroutine
+    def get_dict_async(self, name):
+        """
+        Adds or gets a dictionary under a specific registry without blocking.
+        """
+        yield self.async_storage.sadd(self.dict_key, name)
+        raise gen.Return(self._dict_class(name, self.key, self._redis_host,
+                                          self._redis_port, self._redis_db))
+
+    def extract(self, text, lang=None, names=None, grammar=None, mode=None,
+                fuzzy=False):
+        """
+        Extracts the entities of several dictionaries of the registry, all
+        of them when names is None, from a text in a single pass: the text
+        is tokenized, tagged and chunked once, then exact matches of the
+        chunks in every dictionary are read in one pipeline. Returns the
+        output of each dictionary, as Extractor.extract would, and a timer
+        with the storage commands issued attached as commands.
+        """
+        with metrics.collect() as commands:
+            output, timer = self._extract(text, lang, names, grammar, mode,
+                                          fuzzy)
+        timer.commands = commands
+        return output, timer
+
+    @timeit
+    @timeout(settings.timeout)
+    def _extract(self, text, lang, names, grammar, mode, fuzzy):
+        extractors = self.extractors(names, grammar, mode, fuzzy)
+        if len(extractors) == 0:
+            return {}
+        if mode == 'gazetteer':
+            return dict((name, extractor.match(
+                extractor.compiled_gazetteer(lang), text))
+                for name, extractor in extractors)
+        chunks = extractors[0][1].chunks(text, lang)
+        exact_matches = self.exact_matches(
+            [extractor.dictionary for _, extractor in extractors],
+            chunks, lang)
+        return dict((name, extractor.lookup_chunks(chunks, lang, matches))
+                    for (name, extractor), matches
+                    in zip(extractors, exact_matches))
+
+    @gen.coroutine
+    def extract_async(self, text, lang=None, names=None, grammar=None,
+                      mode=None, fuzzy=False):
+        """
+        Same as extract without blocking the IOLoop on storage I/O, the
+        dictionaries are looked up concurrently. timer.commands is None,
+        see Extractor.extract_async.
+        """
+        with Timer() as timer:
+            output = yield gen.with_timeout(
+                timedelta(seconds=settings.timeout),
+                self._extract_async(text, lang, names, grammar, mode, fuzzy))
+        timer.commands = None
+        raise gen.Return((output, timer))
+
+    @gen.coroutine
+    def _extract_async(self, text, lang, names, grammar, mode, fuzzy):
+        if names is None:
+            names = yield self.dictionaries_async()
+        extractors = self.extractors(names, grammar, mode, fuzzy)
+        if len(extractors) == 0:
+            raise gen.Return({})
+        if mode == 'gazetteer':
+            compiled = yield [run_in_executor(extractor.compiled_gazetteer,
+                                              lang)
+                              for _, extractor in extractors]
+            outputs = [extractor.match(matcher, text)
+                       for (_, extractor), matcher
+                       in zip(extractors, compiled)]
+        else:
+            chunks = extractors[0][1].chunks(text, lang)
+            outputs = yield [extractor.lookup_chunks_async(chunks, lang)
+                             for _, extractor in extractors]
+        raise gen.Return(dict((name, output) for (name, _), output
+                              in zip(extractors, outputs)))
+
+    def extractors(self, names=None, grammar=None, mode=None, fuzzy=False):
+        """
+        (name, extractor) pairs of the dictionaries of the registry, sorted
+        by name.
+        """
+        if names is None:
+            names = self.dictionaries()
+        return [(name, Extractor(self._dict_class(name, self.key,
+                                                  self._redis_host,
+                                                  self._redis_port,
+                                                  self._redis_db),
+                                 grammar, mode, fuzzy))
+                for name in sorted(set(names))]
+
+    def exact_matches(self, dictionaries, chunks, lang):
+        """
+        Tells which chunks are terms of each dictionary, with one pipeline
+        for all dictionaries.
+        """
+        if len(chunks) == 0:
+            return [[] for _ in dictionaries]
+        pipe = self.storage.pipeline(transaction=False)
+        for dictionary in dictionaries:
+            for chunk in chunks:
+                dictionary.queue_tokens(pipe, chunk, lang)
+        values = iter(pipe.execute())
+        return [[len(dictionary.parse_tokens(next(values))) > 0
+                 for _ in chunks] for dictionary in dictionaries]
+
     def del_dict(self, name):
         """
         Deletes a dictionary under a specific registry.
@@ -144,9 +305,10 @@ class Registry(StorageMixin, LoggingMixin):
         if self.storage.delete(self.dict_key) == 1:
             self.logger.info("Deleting registry {} entities..."
                              .format(self._name))
-            keys = self.storage.keys('{}:*'.format(self.key))
-            for key in keys:
-                self.storage.delete(key)
+            self.storage.delete_pattern('{}:*'.format(self.key))
+            lookup_cache.clear()
+            gazetteer.clear()
+            bloom.clear()
             self.logger.info("DONE")
             return True
         return False
@@ -0,0 +1,174 @@
+# -*- coding: utf8 -*-
+# snapshot.py
+# Binary snapshots of dictionaries
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Snapshot of the terms of a dictionary language with their tokens, so it can
+be restored without tokenizing anything.
+
+The file is a gzip stream written and read sequentially:
+
+    'FEETSNAP' | version | lang | term* | end
+
+Integers are varints and strings are a varint length followed by bytes.
+A term is its string, the number of its tokens and one reference per token.
+Tokens are stored once, in order of first use: a reference is 0 followed by
+the token for a new token, or 1 + the index of a token already seen. The
+snapshot is a forward list of terms to tokens, not the inverted index: the
+index of the dictionary is rebuilt from the tokens on import. The end is an
+empty term. The file is written under a temporary name and renamed once
+complete, a failed export leaves no snapshot behind.
+"""
+
+import os
+import gzip
+from feet.exceptions import SnapshotError
+
+MAGIC = 'FEETSNAP'
+VERSION = 1
+
+
+def write_varint(handle, value):
+    output = []
+    while value > 0x7f:
+        output.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    output.append(chr(value))
+    handle.write(''.join(output))
+
+
+def read_varint(handle):
+    value, shift = 0, 0
+    while True:
+        byte = handle.read(1)
+        if byte == '':
+            raise SnapshotError('truncated snapshot')
+        value |= (ord(byte) & 0x7f) << shift
+        if ord(byte) < 0x80:
+            return value
+        shift += 7
+
+
+def write_string(handle, value):
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    write_varint(handle, len(value))
+    handle.write(value)
+
+
+def read_string(handle):
+    length = read_varint(handle)
+    value = handle.read(length)
+    if len(value) != length:
+        raise SnapshotError('truncated snapshot')
+    return value
+
+
+class SnapshotWriter(object):
+    """
+    Writes (term, tokens) pairs of one language to a snapshot file.
+    """
+    def __init__(self, file_name, lang):
+        self._file_name = file_name
+        self._temp_name = '{}.tmp'.format(file_name)
+        self._handle = gzip.open(self._temp_name, 'wb')
+        self._tokens = {}
+        self.count = 0
+        self._handle.write(MAGIC)
+        write_varint(self._handle, VERSION)
+        write_string(self._handle, lang)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, term, tokens):
+        write_string(self._handle, term)
+        write_varint(self._handle, len(tokens))
+        for token in tokens:
+            if isinstance(token, unicode):
+                token = token.encode('utf8')
+            index = self._tokens.get(token)
+            if index is None:
+                self._tokens[token] = len(self._tokens)
+                write_varint(self._handle, 0)
+                write_string(self._handle, token)
+            else:
+                write_varint(self._handle, index + 1)
+        self.count += 1
+
+    def close(self):
+        if self._handle is not None:
+            write_varint(self._handle, 0)
+            self._handle.close()
+            self._handle = None
+            os.rename(self._temp_name, self._file_name)
+
+    def abort(self):
+        """
+        Deletes the snapshot being written.
+        """
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+            os.remove(self._temp_name)
+
+
+class SnapshotReader(object):
+    """
+    Reads the (term, tokens) pairs of a snapshot file, the language is
+    available once opened.
+    """
+    def __init__(self, file_name):
+        self._handle = gzip.open(file_name, 'rb')
+        try:
+            self._read_header(file_name)
+        except Exception:
+            self._handle.close()
+            raise
+
+    def _read_header(self, file_name):
+        try:
+            if self._handle.read(len(MAGIC)) != MAGIC:
+                raise SnapshotError('%s is not a snapshot' % file_name)
+        except IOError:
+            raise SnapshotError('%s is not a snapshot' % file_name)
+        version = read_varint(self._handle)
+        if version != VERSION:
+            raise SnapshotError('unsupported snapshot version %d' % version)
+        self.lang = read_string(self._handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        tokens = []
+        while True:
+            term = read_string(self._handle)
+            if term == '':
+                return
+            term_tokens = []
+            for _ in range(read_varint(self._handle)):
+                index = read_varint(self._handle)
+                if index == 0:
+                    tokens.append(read_string(self._handle))
+                    term_tokens.append(tokens[-1])
+                else:
+                    term_tokens.append(tokens[index - 1])
+            yield term, term_tokens
+
+    def close(self):
+        self._handle.close()
@@ -0,0 +1,92 @@
+# -*- coding: utf8 -*-
+# workers.py
+# Process pool tokenizing terms for bulk loads
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Tokenization stage of bulk loads spread over worker processes.
+
+Each worker builds its Parser and loads its models when it starts, so NLTK
+models and the MeCab tagger stay loaded between batches. Results are returned
+in the order batches were submitted, whatever the order workers finish them,
+so a parallel load writes exactly what a serial load writes. At most window
+batches are in flight, a large file is never read into memory ahead of the
+writer. A batch that is not tokenized within the timeout of the pool, for
+instance because its worker died, terminates the pool and raises
+TimeoutError.
+"""
+
+import multiprocessing
+from collections import deque
+from feet.config import settings
+from feet.exceptions import TimeoutError
+from feet.entities.nlp import Parser
+
+_parser = None
+
+
+def _init_worker():
+    global _parser
+    _parser = Parser()
+    _parser.warm_up()
+
+
+def tokenize_batch(terms, lang):
+    """
+    Returns the (term, tokens) pairs of a batch of terms.
+    """
+    parser = _parser if _parser is not None else Parser()
+    return [(term, parser.word_tokenize(term, lang)) for term in terms]
+
+
+class TokenizerPool(object):
+    """
+    Pool of tokenizing processes.
+    """
+    def __init__(self, workers, window=None, timeout=None):
+        self.workers = workers
+        self.window = window or 2 * workers
+        self.timeout = timeout or settings.timeout
+        self._pool = multiprocessing.Pool(workers, initializer=_init_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def tokenize(self, batches, lang):
+        """
+        Yields the (term, tokens) pairs of each batch, in order.
+        """
+        pending = deque()
+        for batch in batches:
+            pending.append(self._pool.apply_async(tokenize_batch,
+                                                  (batch, lang)))
+            if len(pending) >= self.window:
+                yield self._get(pending.popleft())
+        while len(pending) > 0:
+            yield self._get(pending.popleft())
+
+    def _get(self, result):
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self.terminate()
+            raise TimeoutError('batch not tokenized within {}s, its worker '
+                               'may have died'.format(self.timeout))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
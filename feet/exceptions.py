@@ -29,3 +29,18 @@ class TimeoutError(Exception):
     An operation timed out
     """
     pass
+
+
+class SnapshotError(FeetError):
+    """A dictionary snapshot cannot be read"""
+    pass
+
+
+class RebuildError(FeetError):
+    """A rebuilt dictionary generation is not swapped in"""
+    pass
+
+
+class ExtractionError(FeetError):
+    """A worker process failed to extract entities"""
+    pass
@@ -7,10 +7,14 @@
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
 import redis
+import threading
+from fnmatch import fnmatchcase
+from importlib import import_module
 from feet.config import settings
 from feet.utils.decorators import memoized
-from feet.utils.singleton import SingletonMetaClass
 from feet.utils.logger import LoggingMixin
+from feet.storage.metrics import InstrumentedRedis
+from feet.storage.replicas import ReplicaSet, parse_replicas
 
 
 class StoreException(Exception):
@@ -21,22 +25,94 @@ class StoreNotImplemented(StoreException):
     pass
 
 
-class StorageAbstract(object):
+BACKENDS = {
+    'redis': 'feet.storage.Storage',
+    'memory': 'feet.storage.memory.MemoryStorage',
+    'sqlite': 'feet.storage.sqlite.SQLiteStorage',
+}
+
+
+def get_storage(redis_host=settings.database.host,
+                redis_port=settings.database.port,
+                redis_db=0,
+                backend=None):
+    """
+    Instantiates the storage backend selected in the configuration.
+    """
+    return storage_class(backend)(redis_host, redis_port, redis_db)
+
+
+def storage_class(backend=None):
+    """
+    Class of a storage backend, the one of the configuration by default.
+    """
+    if backend is None:
+        backend = settings.database.backend
+    if backend not in BACKENDS:
+        raise StoreNotImplemented("unknown storage backend %s" % backend)
+    module_name, class_name = BACKENDS[backend].rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)
+
+
+def detach(backend=None):
+    """
+    Gives a forked process its own connections: those inherited from the
+    parent are dropped and new ones are opened on first use.
+    """
+    storage_class(backend).detach_all()
+
+
+# Maximum number of keys sent in a single UNLINK command
+UNLINK_SIZE = 100
+
+
+class StorageAbstract(LoggingMixin):
+    # Whether the backend runs server-side Lua scripts
+    scripting = False
+
+    @classmethod
+    def detach_all(klass):
+        """
+        Drops the connections inherited from a parent process, see detach.
+        """
+        pass
+
     def exists(self, key):
         raise StoreNotImplemented("exists not implemented")
 
     def keys(self, pattern):
         raise StoreNotImplemented("keys not implemented")
 
+    def scan_iter(self, pattern, count=None):
+        raise StoreNotImplemented("scan_iter not implemented")
+
     def get(self, key):
         raise StoreNotImplemented("get not implemented")
 
+    def mget(self, *keys):
+        raise StoreNotImplemented("mget not implemented")
+
     def delete(self, key):
         raise StoreNotImplemented("delete not implemented")
 
+    def unlink(self, *keys):
+        raise StoreNotImplemented("unlink not implemented")
+
+    def set(self, key, value):
+        raise StoreNotImplemented("set not implemented")
+
+    def setnx(self, key, value):
+        raise StoreNotImplemented("setnx not implemented")
+
+    def setbits(self, key, offsets):
+        raise StoreNotImplemented("setbits not implemented")
+
     def incr(self, key):
         raise StoreNotImplemented("incr not implemented")
 
+    def incrby(self, key, amount):
+        raise StoreNotImplemented("incrby not implemented")
+
     def decr(self, key):
         raise StoreNotImplemented("decr not implemented")
 
@@ -58,12 +134,170 @@ class StorageAbstract(object):
     def rpush(self, key, value):
         raise StoreNotImplemented("rpush not implemented")
 
+    def zadd(self, key, *args):
+        raise StoreNotImplemented("zadd not implemented")
+
+    def zrem(self, key, *values):
+        raise StoreNotImplemented("zrem not implemented")
+
+    def zcard(self, key):
+        raise StoreNotImplemented("zcard not implemented")
+
+    def zrange(self, key, start, end):
+        raise StoreNotImplemented("zrange not implemented")
+
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        raise StoreNotImplemented("zrangebylex not implemented")
+
+    def hset(self, key, field, value):
+        raise StoreNotImplemented("hset not implemented")
+
+    def hget(self, key, field):
+        raise StoreNotImplemented("hget not implemented")
+
+    def hmget(self, key, fields):
+        raise StoreNotImplemented("hmget not implemented")
+
+    def hgetall(self, key):
+        raise StoreNotImplemented("hgetall not implemented")
+
+    def hdel(self, key, field):
+        raise StoreNotImplemented("hdel not implemented")
+
+    def hexists(self, key, field):
+        raise StoreNotImplemented("hexists not implemented")
+
+    def memory_usage(self, keys):
+        raise StoreNotImplemented("memory_usage not implemented")
+
+    def pipeline(self, transaction=True):
+        raise StoreNotImplemented("pipeline not implemented")
+
+    def register_script(self, script):
+        raise StoreNotImplemented("register_script not implemented")
+
     def transaction(self, func, *watchs, **params):
         raise StoreNotImplemented("transaction not implemented")
 
-
-class Storage(LoggingMixin):
-    __metaclass__ = SingletonMetaClass
+    def delete_pattern(self, pattern, count=None, progress=None, keep=None):
+        """
+        Deletes all keys matching a pattern, but those matching the pattern
+        keep. Keys are scanned incrementally with a cursor and unlinked by
+        batches, so the server is never blocked. progress is called with
+        the number of keys deleted so far after each batch. Returns the
+        number of keys deleted.
+        """
+        if count is None:
+            count = settings.database.scan_count
+        deleted, batch = 0, []
+        for key in self.scan_iter(pattern, count):
+            if keep is not None and fnmatchcase(key, keep):
+                continue
+            batch.append(key)
+            if len(batch) >= count:
+                deleted += self.unlink(*batch)
+                batch = []
+                self.logger.info('{} keys deleted matching {}'
+                                 .format(deleted, pattern))
+                if progress is not None:
+                    progress(deleted)
+        if len(batch) > 0:
+            deleted += self.unlink(*batch)
+            if progress is not None:
+                progress(deleted)
+        return deleted
+
+
+class Storage(StorageAbstract, LoggingMixin):
+    """
+    Redis storage. Instances are cheap: all instances that target the same
+    (host, port, db) endpoint share one bounded connection pool. Read-only
+    commands are routed to the replicas of the database configuration when
+    they are within the staleness tolerance, see feet.storage.replicas.
+    """
+    scripting = True
+    _pools = {}
+    _pools_lock = threading.Lock()
+    _replica_sets = {}
+    _detached = []
+
+    @classmethod
+    def connection_pool(klass, redis_host, redis_port, redis_db):
+        """
+        Gets the connection pool of an endpoint, creates it if needed.
+        """
+        endpoint = (redis_host, int(redis_port), int(redis_db))
+        config = settings.database
+        with klass._pools_lock:
+            if endpoint not in klass._pools:
+                klass._pools[endpoint] = redis.BlockingConnectionPool(
+                    host=endpoint[0],
+                    port=endpoint[1],
+                    db=endpoint[2],
+                    max_connections=config.pool_size,
+                    timeout=config.pool_timeout,
+                    socket_timeout=config.socket_timeout,
+                    socket_connect_timeout=config.socket_connect_timeout,
+                    socket_keepalive=config.socket_keepalive)
+            return klass._pools[endpoint]
+
+    @classmethod
+    def client(klass, redis_host, redis_port, redis_db):
+        if settings.database.metrics:
+            client = InstrumentedRedis
+        else:
+            client = redis.StrictRedis
+        return client(connection_pool=klass.connection_pool(
+            redis_host, redis_port, redis_db))
+
+    @classmethod
+    def replica_set(klass, redis_host, redis_port, redis_db):
+        """
+        Gets the replicas of an endpoint, None without replicas. They are
+        those of the endpoint in settings.database.replicas, or else those
+        of its host and port.
+        """
+        endpoint = (redis_host, int(redis_port), int(redis_db))
+        replicas = parse_replicas(settings.database.replicas)
+        endpoints = replicas.get(endpoint,
+                                 replicas.get(endpoint[:2] + (None,), []))
+        if len(endpoints) == 0:
+            return None
+        with klass._pools_lock:
+            replica_set = klass._replica_sets.get(endpoint)
+        if replica_set is None:
+            replica_set = ReplicaSet(
+                klass.client(*endpoint),
+                [klass.client(host, port, endpoint[2])
+                 for host, port in endpoints],
+                settings.database.max_staleness)
+            with klass._pools_lock:
+                replica_set = klass._replica_sets.setdefault(endpoint,
+                                                             replica_set)
+        return replica_set
+
+    @classmethod
+    def disconnect_all(klass):
+        """
+        Closes all connections of all pools.
+        """
+        with klass._pools_lock:
+            for pool in klass._pools.values():
+                pool.disconnect()
+            klass._pools = {}
+            klass._replica_sets = {}
+
+    @classmethod
+    def detach_all(klass):
+        """
+        Forgets all pools of a forked process without closing them: their
+        sockets are shared with the parent, and closing or collecting them
+        would shut the connections of the parent down.
+        """
+        klass._detached = klass._detached + klass._pools.values()
+        klass._pools = {}
+        klass._pools_lock = threading.Lock()
+        klass._replica_sets = {}
 
     def __init__(self,
                  redis_host=settings.database.host,
@@ -75,26 +309,93 @@ class Storage(LoggingMixin):
 
     @memoized
     def redis_server(self):
-        self.logger.info('Initialize storage service')
-        return redis.StrictRedis(host=self._redis_host,
-                                 port=self._redis_port,
-                                 db=self._redis_db)
+        return self.client(self._redis_host, self._redis_port,
+                           self._redis_db)
+
+    @memoized
+    def replicas(self):
+        return self.replica_set(self._redis_host, self._redis_port,
+                                self._redis_db)
+
+    def read(self, command, *args, **kwargs):
+        """
+        Runs a read-only command on the next replica, or on the primary
+        when no replica is fresh enough or the replica is unreachable.
+        """
+        replica = None
+        if self.replicas is not None:
+            replica = self.replicas.client()
+        if replica is not None:
+            try:
+                return getattr(replica, command)(*args, **kwargs)
+            except redis.ConnectionError as e:
+                self.logger.warning('Replica read failed: {}'.format(e))
+                self.replicas.failed(replica)
+        return getattr(self.redis_server, command)(*args, **kwargs)
 
     def exists(self, key):
-        return self.redis_server.exists(key)
+        return self.read('exists', key)
 
     def keys(self, pattern):
-        return self.redis_server.keys(pattern)
+        return self.read('keys', pattern)
+
+    def scan_iter(self, pattern, count=None):
+        # Always on the primary: the scan is lazy, so a replica failing
+        # midway would not fall back, and a stale replica misses new keys
+        # that callers such as delete_pattern are about to unlink
+        return self.redis_server.scan_iter(match=pattern, count=count)
 
     def get(self, key):
-        return self.redis_server.get(key)
+        return self.read('get', key)
+
+    def mget(self, *keys):
+        return self.read('mget', keys)
 
     def delete(self, key):
         return self.redis_server.delete(key)
 
+    def unlink(self, *keys):
+        """
+        Unlinks keys in one pipeline of UNLINK commands, memory is reclaimed
+        in the background by Redis. Falls back on DEL before Redis 4.
+        """
+        command = 'UNLINK'
+        while True:
+            pipe = self.redis_server.pipeline(transaction=False)
+            for idx in range(0, len(keys), UNLINK_SIZE):
+                pipe.execute_command(command, *keys[idx:idx + UNLINK_SIZE])
+            try:
+                return sum(pipe.execute())
+            except redis.ResponseError as e:
+                if command == 'DEL' or 'unknown command' not in str(e):
+                    raise
+                command = 'DEL'
+
+    def set(self, key, value):
+        return self.redis_server.set(key, value)
+
+    def setnx(self, key, value):
+        return self.redis_server.setnx(key, value)
+
+    def setbits(self, key, offsets):
+        """
+        Sets bits of a string to 1 in one BITFIELD command, returns the
+        number of bits that were 0.
+        """
+        if len(offsets) == 0:
+            return 0
+        args = []
+        for offset in offsets:
+            args += ['SET', 'u1', offset, 1]
+        previous = self.redis_server.execute_command('BITFIELD', key, *args)
+        return len(previous) - sum(previous)
+
     def incr(self, key):
         return self.redis_server.incr(key)
 
+    def incrby(self, key, amount):
+        return self.redis_server.incr(key, amount)
+
     def decr(self, key):
         return self.redis_server.decr(key)
 
@@ -102,13 +403,13 @@ class Storage(LoggingMixin):
         return self.redis_server.sadd(key, value)
 
     def smembers(self, key):
-        return self.redis_server.smembers(key)
+        return self.read('smembers', key)
 
     def srem(self, key, value):
         return self.redis_server.srem(key, value)
 
     def lrange(self, key, start, end):
-        return self.redis_server.lrange(key, start, end)
+        return self.read('lrange', key, start, end)
 
     def lrem(self, key, count, value):
         return self.redis_server.lrem(key, count, value)
@@ -116,16 +417,70 @@ class Storage(LoggingMixin):
     def rpush(self, key, value):
         return self.redis_server.rpush(key, value)
 
+    def zadd(self, key, *args):
+        return self.redis_server.zadd(key, *args)
+
+    def zrem(self, key, *values):
+        return self.redis_server.zrem(key, *values)
+
+    def zcard(self, key):
+        return self.read('zcard', key)
+
+    def zrange(self, key, start, end):
+        return self.read('zrange', key, start, end)
+
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        return self.read('zrangebylex', key, min, max, start, num)
+
+    def hset(self, key, field, value):
+        return self.redis_server.hset(key, field, value)
+
+    def hget(self, key, field):
+        return self.read('hget', key, field)
+
+    def hmget(self, key, fields):
+        return self.read('hmget', key, fields)
+
+    def hgetall(self, key):
+        return self.read('hgetall', key)
+
+    def hdel(self, key, field):
+        return self.redis_server.hdel(key, field)
+
+    def hexists(self, key, field):
+        return self.read('hexists', key, field)
+
+    def memory_usage(self, keys):
+        """
+        Sums the memory used by keys in one pipeline of MEMORY USAGE
+        commands, requires Redis 4.
+        """
+        pipe = self.redis_server.pipeline(transaction=False)
+        for key in keys:
+            pipe.execute_command('MEMORY', 'USAGE', key)
+        return sum(size or 0 for size in pipe.execute())
+
+    def pipeline(self, transaction=True):
+        return self.redis_server.pipeline(transaction=transaction)
+
+    def register_script(self, script):
+        """
+        Registers a Lua script. The returned callable runs it with EVALSHA
+        and loads it first if the server does not know it yet.
+        """
+        return self.redis_server.register_script(script)
+
     def transaction(self, func, *watchs, **params):
         return self.redis_server.transaction(func, *watchs, **params)
 
 
 class StorageMixin(object):
     """
-    Mix in that provides storage capacity and singleton for storage
+    Mix in that provides storage capacity. Connections are pooled per
+    endpoint by Storage.
     """
-    _redis_host = settings.database.host,
-    _redis_port = settings.database.port,
+    _redis_host = settings.database.host
+    _redis_port = settings.database.port
     _redis_db = 0
 
     @memoized
@@ -133,4 +488,15 @@ class StorageMixin(object):
         """
         Instantiates and returns a storage instance
         """
-        return Storage(self._redis_host, self._redis_port, self._redis_db)
+        return get_storage(self._redis_host, self._redis_port,
+                           self._redis_db)
+
+    @memoized
+    def async_storage(self):
+        """
+        Instantiates and returns a non-blocking storage instance for
+        coroutines
+        """
+        from feet.storage.asynchronous import AsyncStorage
+        return AsyncStorage(self._redis_host, self._redis_port,
+                            self._redis_db)
@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+# Asynchronous storage for the Tornado web server
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Non-blocking storage with the same method surface as Storage. Commands run
+on a shared thread pool, backed by the pooled connections of the storage,
+and return futures that coroutines can yield on the IOLoop.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado.concurrent import Future, chain_future, run_on_executor
+from feet.config import settings
+from feet.utils.logger import LoggingMixin
+from feet.storage import get_storage
+
+executor = ThreadPoolExecutor(settings.database.async_workers)
+
+
+def run_in_executor(func, *args, **kwargs):
+    """
+    Runs any blocking call on the storage thread pool and returns a future,
+    resolved on the IOLoop like those of run_on_executor. A thread pool
+    future yielded in a list would be resolved by the pool thread, on an
+    IOLoop that is not running.
+    """
+    future = Future()
+    chain_future(executor.submit(func, *args, **kwargs), future)
+    return future
+
+
+class AsyncStorage(LoggingMixin):
+    executor = executor
+
+    def __init__(self,
+                 redis_host=settings.database.host,
+                 redis_port=settings.database.port,
+                 redis_db=0):
+        self.storage = get_storage(redis_host, redis_port, redis_db)
+
+    @run_on_executor
+    def exists(self, key):
+        return self.storage.exists(key)
+
+    @run_on_executor
+    def keys(self, pattern):
+        return self.storage.keys(pattern)
+
+    @run_on_executor
+    def get(self, key):
+        return self.storage.get(key)
+
+    @run_on_executor
+    def mget(self, *keys):
+        return self.storage.mget(*keys)
+
+    @run_on_executor
+    def delete(self, key):
+        return self.storage.delete(key)
+
+    @run_on_executor
+    def unlink(self, *keys):
+        return self.storage.unlink(*keys)
+
+    @run_on_executor
+    def incr(self, key):
+        return self.storage.incr(key)
+
+    @run_on_executor
+    def decr(self, key):
+        return self.storage.decr(key)
+
+    @run_on_executor
+    def sadd(self, key, value):
+        return self.storage.sadd(key, value)
+
+    @run_on_executor
+    def smembers(self, key):
+        return self.storage.smembers(key)
+
+    @run_on_executor
+    def srem(self, key, value):
+        return self.storage.srem(key, value)
+
+    @run_on_executor
+    def lrange(self, key, start, end):
+        return self.storage.lrange(key, start, end)
+
+    @run_on_executor
+    def lrem(self, key, count, value):
+        return self.storage.lrem(key, count, value)
+
+    @run_on_executor
+    def rpush(self, key, value):
+        return self.storage.rpush(key, value)
+
+    @run_on_executor
+    def zcard(self, key):
+        return self.storage.zcard(key)
+
+    @run_on_executor
+    def zrange(self, key, start, end):
+        return self.storage.zrange(key, start, end)
+
+    @run_on_executor
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        return self.storage.zrangebylex(key, min, max, start, num)
+
+    @run_on_executor
+    def hget(self, key, field):
+        return self.storage.hget(key, field)
+
+    @run_on_executor
+    def hmget(self, key, fields):
+        return self.storage.hmget(key, fields)
+
+    def pipeline(self, transaction=True):
+        """
+        Pipelines are filled synchronously, see execute.
+        """
+        return self.storage.pipeline(transaction)
+
+    @run_on_executor
+    def execute(self, pipe):
+        """
+        Executes a pipeline in a single round trip.
+        """
+        return pipe.execute()
+
+    @run_on_executor
+    def transaction(self, func, *watchs, **params):
+        return self.storage.transaction(func, *watchs, **params)
+
+    @run_on_executor
+    def delete_pattern(self, pattern, count=None, progress=None, keep=None):
+        return self.storage.delete_pattern(pattern, count, progress, keep)
@@ -0,0 +1,456 @@
+# -*- coding: utf8 -*-
+# In-process memory storage
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Pure Python storage backend built on dicts, sets and lists. It mimics the
+subset of Redis commands used by feet, so single-node batch jobs and tests
+can run without any network round trip.
+"""
+
+import re
+import sys
+import fnmatch
+import threading
+from bisect import bisect_left, bisect_right
+from feet.config import settings
+from feet.utils.logger import LoggingMixin
+from feet.storage import StorageAbstract, StoreException, \
+    StoreNotImplemented
+
+COMMANDS = ('exists', 'keys', 'get', 'mget', 'set', 'setnx', 'setbits',
+            'delete', 'unlink', 'incr', 'incrby', 'decr', 'sadd', 'smembers',
+            'srem', 'lrange', 'lrem', 'rpush', 'zadd', 'zrem', 'zcard',
+            'zrange', 'zrangebylex', 'hset', 'hget', 'hmget', 'hgetall',
+            'hdel', 'hexists')
+
+
+def encode(value):
+    """
+    Stores values as byte strings like Redis does.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return str(value)
+
+
+def set_bits(value, offsets):
+    """
+    Sets bits of a string like SETBIT, returns the new string and the number
+    of bits that were 0.
+    """
+    data = bytearray(value or '')
+    changed = 0
+    for offset in offsets:
+        byte, mask = offset // 8, 0x80 >> (offset % 8)
+        if byte >= len(data):
+            data.extend('\x00' * (byte + 1 - len(data)))
+        if not data[byte] & mask:
+            data[byte] |= mask
+            changed += 1
+    return str(data), changed
+
+
+def lex_members(args):
+    """
+    Members of ZADD score/member pairs, only lexicographic sorted sets,
+    where all scores are 0, are supported.
+    """
+    if len(args) % 2 != 0:
+        raise StoreException('ZADD requires score/member pairs')
+    if any(float(score) != 0 for score in args[::2]):
+        raise StoreNotImplemented('only sorted sets with scores of 0 '
+                                  'are supported')
+    return [encode(member) for member in args[1::2]]
+
+
+def parse_lex(bound):
+    """
+    Parses a ZRANGEBYLEX bound into (value, inclusive), value is None for
+    the - and + infinite bounds.
+    """
+    bound = encode(bound)
+    if bound in ('-', '+'):
+        return None, True
+    if bound[:1] not in ('[', '('):
+        raise StoreException('invalid lexicographic bound %s' % bound)
+    return bound[1:], bound[0] == '['
+
+
+class LexSortedSet(object):
+    """
+    Members of a sorted set with equal scores, kept in lexicographic order.
+    """
+    def __init__(self):
+        self.members = []
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def add(self, member):
+        idx = bisect_left(self.members, member)
+        if idx < len(self.members) and self.members[idx] == member:
+            return 0
+        self.members.insert(idx, member)
+        return 1
+
+    def remove(self, member):
+        idx = bisect_left(self.members, member)
+        if idx < len(self.members) and self.members[idx] == member:
+            del self.members[idx]
+            return 1
+        return 0
+
+    def range_by_lex(self, min, max):
+        value, inclusive = parse_lex(min)
+        if value is None:
+            start = 0
+        elif inclusive:
+            start = bisect_left(self.members, value)
+        else:
+            start = bisect_right(self.members, value)
+        value, inclusive = parse_lex(max)
+        if value is None:
+            end = len(self.members)
+        elif inclusive:
+            end = bisect_right(self.members, value)
+        else:
+            end = bisect_left(self.members, value)
+        return self.members[start:end]
+
+
+class LocalPipeline(object):
+    """
+    Pipeline for local storages with the semantics of redis-py: commands
+    run immediately while watching keys and are buffered otherwise. Buffered
+    commands are executed under the storage lock.
+    """
+    def __init__(self, storage, transaction=True):
+        self._storage = storage
+        self._transaction = transaction
+        self._commands = []
+        self._watching = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getattr__(self, name):
+        if name not in COMMANDS:
+            raise AttributeError(name)
+        command = getattr(self._storage, name)
+
+        def run_or_queue(*args, **kwargs):
+            if self._watching:
+                return command(*args, **kwargs)
+            self._commands.append((command, args, kwargs))
+            return self
+        return run_or_queue
+
+    def watch(self, *keys):
+        self._watching = True
+
+    def unwatch(self):
+        self._watching = False
+
+    def multi(self):
+        self._watching = False
+
+    def reset(self):
+        self._commands = []
+        self._watching = False
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        with self._storage.lock:
+            return [command(*args, **kwargs)
+                    for command, args, kwargs in commands]
+
+
+class MemoryStorage(StorageAbstract, LoggingMixin):
+    """
+    Memory storage. All instances that target the same (host, port, db)
+    endpoint share the same data, so the backend can replace Redis without
+    changing Dictionary, Registry or Extractor.
+    """
+    _databases = {}
+    _databases_lock = threading.Lock()
+
+    @classmethod
+    def database(klass, redis_host, redis_port, redis_db):
+        """
+        Gets the data and the lock of an endpoint, creates them if needed.
+        """
+        endpoint = (redis_host, int(redis_port), int(redis_db))
+        with klass._databases_lock:
+            if endpoint not in klass._databases:
+                klass._databases[endpoint] = ({}, threading.RLock())
+            return klass._databases[endpoint]
+
+    def __init__(self,
+                 redis_host=settings.database.host,
+                 redis_port=settings.database.port,
+                 redis_db=0):
+        self._data, self.lock = self.database(redis_host, redis_port,
+                                              redis_db)
+
+    def _value(self, key, kind):
+        value = self._data.get(encode(key))
+        if value is not None and not isinstance(value, kind):
+            raise StoreException('WRONGTYPE Operation against a key holding '
+                                 'the wrong kind of value')
+        return value
+
+    def exists(self, key):
+        with self.lock:
+            return int(encode(key) in self._data)
+
+    def keys(self, pattern):
+        regex = re.compile(fnmatch.translate(encode(pattern)))
+        with self.lock:
+            return [key for key in self._data if regex.match(key)]
+
+    def scan_iter(self, pattern, count=None):
+        for key in self.keys(pattern):
+            yield key
+
+    def get(self, key):
+        with self.lock:
+            return self._value(key, str)
+
+    def mget(self, *keys):
+        """
+        Gets several strings, None for missing keys and other types.
+        """
+        with self.lock:
+            values = [self._data.get(encode(key)) for key in keys]
+            return [value if isinstance(value, str) else None
+                    for value in values]
+
+    def delete(self, *keys):
+        with self.lock:
+            return len([self._data.pop(encode(key)) for key in keys
+                        if encode(key) in self._data])
+
+    def unlink(self, *keys):
+        return self.delete(*keys)
+
+    def set(self, key, value):
+        with self.lock:
+            self._data[encode(key)] = encode(value)
+            return True
+
+    def setnx(self, key, value):
+        with self.lock:
+            if encode(key) in self._data:
+                return False
+            self._data[encode(key)] = encode(value)
+            return True
+
+    def setbits(self, key, offsets):
+        with self.lock:
+            data, changed = set_bits(self._value(key, str), offsets)
+            self._data[encode(key)] = data
+            return changed
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def incrby(self, key, amount):
+        with self.lock:
+            value = int(self._value(key, str) or 0) + amount
+            self._data[encode(key)] = str(value)
+            return value
+
+    def decr(self, key):
+        with self.lock:
+            value = int(self._value(key, str) or 0) - 1
+            self._data[encode(key)] = str(value)
+            return value
+
+    def sadd(self, key, *values):
+        with self.lock:
+            members = self._value(key, set)
+            if members is None:
+                members = self._data[encode(key)] = set()
+            count = len(members)
+            members.update(encode(value) for value in values)
+            return len(members) - count
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self._value(key, set) or [])
+
+    def srem(self, key, *values):
+        with self.lock:
+            members = self._value(key, set)
+            if members is None:
+                return 0
+            count = len(members)
+            members.difference_update(encode(value) for value in values)
+            if len(members) == 0:
+                del self._data[encode(key)]
+            return count - len(members)
+
+    def lrange(self, key, start, end):
+        with self.lock:
+            return self.lrange_items(self._value(key, list) or [], start, end)
+
+    @staticmethod
+    def lrange_items(items, start, end):
+        """
+        Slices items with the inclusive, possibly negative, indexes of
+        LRANGE and ZRANGE.
+        """
+        if start < 0:
+            start = max(start + len(items), 0)
+        if end < 0:
+            end += len(items)
+        return items[start:end + 1]
+
+    def lrem(self, key, count, value):
+        with self.lock:
+            items = self._value(key, list)
+            if items is None:
+                return 0
+            value = encode(value)
+            indexes = [idx for idx, item in enumerate(items) if item == value]
+            if count < 0:
+                indexes = indexes[::-1][:-count]
+            elif count > 0:
+                indexes = indexes[:count]
+            for idx in sorted(indexes, reverse=True):
+                del items[idx]
+            if len(items) == 0:
+                del self._data[encode(key)]
+            return len(indexes)
+
+    def rpush(self, key, *values):
+        with self.lock:
+            items = self._value(key, list)
+            if items is None:
+                items = self._data[encode(key)] = []
+            items.extend(encode(value) for value in values)
+            return len(items)
+
+    def zadd(self, key, *args):
+        members = lex_members(args)
+        with self.lock:
+            items = self._value(key, LexSortedSet)
+            if items is None:
+                items = self._data[encode(key)] = LexSortedSet()
+            return sum(items.add(member) for member in members)
+
+    def zrem(self, key, *values):
+        with self.lock:
+            items = self._value(key, LexSortedSet)
+            if items is None:
+                return 0
+            count = sum(items.remove(encode(value)) for value in values)
+            if len(items) == 0:
+                del self._data[encode(key)]
+            return count
+
+    def zcard(self, key):
+        with self.lock:
+            return len(self._value(key, LexSortedSet) or [])
+
+    def zrange(self, key, start, end):
+        with self.lock:
+            items = self._value(key, LexSortedSet)
+            return self.lrange_items(items.members if items else [],
+                                     start, end)
+
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        if (start is None) != (num is None):
+            raise StoreException('start and num must both be specified')
+        with self.lock:
+            items = self._value(key, LexSortedSet)
+            if items is None:
+                return []
+            members = items.range_by_lex(min, max)
+        if start is None:
+            return members
+        if num < 0:
+            return members[start:]
+        return members[start:start + num]
+
+    def hset(self, key, field, value):
+        with self.lock:
+            fields = self._value(key, dict)
+            if fields is None:
+                fields = self._data[encode(key)] = {}
+            created = encode(field) not in fields
+            fields[encode(field)] = encode(value)
+            return int(created)
+
+    def hget(self, key, field):
+        with self.lock:
+            return (self._value(key, dict) or {}).get(encode(field))
+
+    def hmget(self, key, fields):
+        with self.lock:
+            values = self._value(key, dict) or {}
+            return [values.get(encode(field)) for field in fields]
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self._value(key, dict) or {})
+
+    def hdel(self, key, field):
+        with self.lock:
+            fields = self._value(key, dict)
+            if fields is None or fields.pop(encode(field), None) is None:
+                return 0
+            if len(fields) == 0:
+                del self._data[encode(key)]
+            return 1
+
+    def hexists(self, key, field):
+        with self.lock:
+            return encode(field) in (self._value(key, dict) or {})
+
+    def memory_usage(self, keys):
+        """
+        Approximates the memory used by keys with sys.getsizeof.
+        """
+        total = 0
+        with self.lock:
+            for key in keys:
+                value = self._data.get(encode(key))
+                if value is None:
+                    continue
+                total += sys.getsizeof(key) + sys.getsizeof(value)
+                if isinstance(value, dict):
+                    value = value.keys() + value.values()
+                if not isinstance(value, str):
+                    total += sum(sys.getsizeof(item) for item in value)
+        return total
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self, transaction)
+
+    def transaction(self, func, *watchs, **params):
+        """
+        Runs func under the storage lock, so watched keys cannot change and
+        the transaction never has to be retried.
+        """
+        value_from_callable = params.get('value_from_callable', False)
+        with self.lock:
+            pipe = self.pipeline(True)
+            pipe.watch(*watchs)
+            func_value = func(pipe)
+            exec_value = pipe.execute()
+        return func_value if value_from_callable else exec_value
@@ -0,0 +1,211 @@
+# -*- coding: utf8 -*-
+# Storage command metrics
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Counts Redis commands by caller: number of calls, round trips, bytes
+returned and a latency histogram. Commands are recorded in the process
+wide registry and in the collectors opened on the current thread, e.g.
+
+    >>> with collect() as commands:
+    ...     dictionary.candidates('york', 'en')
+    >>> commands.snapshot()
+
+The caller is the outermost method decorated with traced.
+"""
+
+import time
+import threading
+from functools import wraps
+from bisect import bisect_left
+from redis.client import StrictRedis, StrictPipeline
+
+# Upper bounds of the latency buckets in seconds, the last bucket is open
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0)
+
+_local = threading.local()
+
+
+def response_size(response):
+    """
+    Approximates the number of bytes of a response payload.
+    """
+    if response is None:
+        return 0
+    if isinstance(response, (str, unicode)):
+        return len(response)
+    if isinstance(response, (list, tuple, set, frozenset)):
+        return sum(response_size(item) for item in response)
+    if isinstance(response, dict):
+        return sum(response_size(key) + response_size(value)
+                   for key, value in response.items())
+    return len(str(response))
+
+
+class CommandStats(object):
+    """
+    Counters of one command issued by one caller.
+    """
+    __slots__ = ('calls', 'round_trips', 'bytes', 'seconds', 'histogram')
+
+    def __init__(self):
+        self.calls, self.round_trips, self.bytes = 0, 0, 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, size, elapsed=None):
+        self.calls += 1
+        self.bytes += size
+        if elapsed is not None:
+            self.round_trips += 1
+            self.seconds += elapsed
+            self.histogram[bisect_left(BUCKETS, elapsed)] += 1
+
+    def as_dict(self):
+        return {'calls': self.calls,
+                'round_trips': self.round_trips,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'histogram': list(self.histogram)}
+
+
+class CommandMetrics(object):
+    """
+    Command stats keyed by caller and command name.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, caller, command, size, elapsed=None):
+        """
+        Records a command, elapsed is None for commands sent in a pipeline
+        since the round trip is recorded as PIPELINE.
+        """
+        with self._lock:
+            stats = self._stats.get((caller, command))
+            if stats is None:
+                stats = self._stats[(caller, command)] = CommandStats()
+            stats.add(size, elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self):
+        """
+        Returns {caller: {command: stats}}, commands issued out of any
+        traced method have None as caller.
+        """
+        with self._lock:
+            items = [(key, stats.as_dict())
+                     for key, stats in self._stats.items()]
+        output = {}
+        for (caller, command), stats in items:
+            output.setdefault(caller, {})[command] = stats
+        return output
+
+    def round_trips(self):
+        with self._lock:
+            return sum(stats.round_trips for stats in self._stats.values())
+
+    def calls(self, command=None):
+        with self._lock:
+            return sum(stats.calls for (_, name), stats
+                       in self._stats.items()
+                       if command is None or name == command)
+
+
+registry = CommandMetrics()
+
+
+def _state():
+    if not hasattr(_local, 'callers'):
+        _local.callers, _local.collectors = [], []
+    return _local
+
+
+def record(command, response, elapsed=None):
+    """
+    Records a command in the registry and in the collectors of the thread.
+    """
+    state = _state()
+    caller = state.callers[0] if len(state.callers) > 0 else None
+    size = response_size(response)
+    registry.record(caller, command, size, elapsed)
+    for collector in state.collectors:
+        collector.record(caller, command, size, elapsed)
+
+
+class collect(object):
+    """
+    Context manager that collects the commands issued by the current
+    thread.
+    """
+    def __enter__(self):
+        self.metrics = CommandMetrics()
+        _state().collectors.append(self.metrics)
+        return self.metrics
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state().collectors.remove(self.metrics)
+
+
+def traced(func):
+    """
+    Decorates a method so the commands it issues are recorded under
+    ClassName.method.
+    """
+    @wraps(func)
+    def traced_wrapper(self, *args, **kwargs):
+        callers = _state().callers
+        callers.append('{}.{}'.format(type(self).__name__, func.__name__))
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            callers.pop()
+
+    return traced_wrapper
+
+
+class InstrumentedPipeline(StrictPipeline):
+    def immediate_execute_command(self, *args, **options):
+        started = time.time()
+        response = super(InstrumentedPipeline, self)\
+            .immediate_execute_command(*args, **options)
+        record(args[0], response, time.time() - started)
+        return response
+
+    def execute(self, raise_on_error=True):
+        commands = [args[0] for args, _ in self.command_stack]
+        if len(commands) == 0:
+            return super(InstrumentedPipeline, self).execute(raise_on_error)
+        started = time.time()
+        responses = super(InstrumentedPipeline, self).execute(raise_on_error)
+        record('PIPELINE', None, time.time() - started)
+        for command, response in zip(commands, responses):
+            record(command, response)
+        return responses
+
+
+class InstrumentedRedis(StrictRedis):
+    """
+    Redis client that records every command, see record.
+    """
+    def execute_command(self, *args, **options):
+        started = time.time()
+        response = super(InstrumentedRedis, self)\
+            .execute_command(*args, **options)
+        record(args[0], response, time.time() - started)
+        return response
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool,
+                                    self.response_callbacks,
+                                    transaction,
+                                    shard_hint)
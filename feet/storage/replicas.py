@@ -0,0 +1,159 @@
+# -*- coding: utf8 -*-
+# Read replicas routing
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Round-robin routing of read-only commands to Redis replicas.
+
+The staleness of a replica is measured with replication offsets: the
+offset of the primary is sampled at each check, a replica that acknowledged
+the offset sampled at time T has every write made before T, so it is at
+most now - T behind. Replicas behind by more than max_staleness, or whose
+link to the primary is down, are skipped and reads go to the primary.
+"""
+
+import time
+import threading
+from collections import deque
+import redis
+from feet.exceptions import ConfigurationError
+from feet.utils.logger import LoggingMixin
+
+
+def parse_endpoints(endpoints):
+    """
+    Parses 'host:port,host:port' or a list of 'host:port' into a list of
+    (host, port) tuples.
+    """
+    if endpoints is None:
+        return []
+    if isinstance(endpoints, basestring):
+        endpoints = endpoints.split(',')
+    output = []
+    for endpoint in endpoints:
+        endpoint = endpoint.strip()
+        if endpoint == '':
+            continue
+        host, _, port = endpoint.rpartition(':')
+        output.append((host, int(port)))
+    return output
+
+
+def parse_replicas(replicas):
+    """
+    Parses the replicas of each primary endpoint, given as
+    'host:port=host:port,host:port;host:port=host:port' or as a dict
+    mapping 'host:port' to its replicas, into a dict mapping (host, port,
+    db) to a list of (host, port) tuples. db is None unless the primary is
+    given as 'host:port/db', its replicas then serve all its databases.
+    """
+    if replicas is None:
+        return {}
+    if isinstance(replicas, basestring):
+        items = [item.split('=', 1) for item in replicas.split(';')
+                 if item.strip() != '']
+        if any(len(item) != 2 for item in items):
+            raise ConfigurationError('replicas must be listed as '
+                                     'primary=replica,replica;...: '
+                                     '{}'.format(replicas))
+        replicas = dict(items)
+    output = {}
+    for primary, endpoints in replicas.items():
+        endpoint, _, db = primary.strip().partition('/')
+        host, _, port = endpoint.rpartition(':')
+        output[(host, int(port), int(db) if db else None)] = \
+            parse_endpoints(endpoints)
+    return output
+
+
+class ReplicaSet(LoggingMixin):
+    """
+    Replicas of one primary endpoint, checked at most every max_staleness / 2
+    seconds when a read is routed.
+    """
+    def __init__(self, primary, replicas, max_staleness):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_staleness = max_staleness
+        self.check_interval = max_staleness / 2.0
+        self._lock = threading.Lock()
+        self._offsets = deque()
+        self._eligible = []
+        self._checked = None
+        self._next = 0
+
+    def info(self, client):
+        return client.info('replication')
+
+    def check(self, now=None):
+        """
+        Samples the offset of the primary and keeps the replicas within the
+        staleness tolerance.
+        """
+        if now is None:
+            now = time.time()
+        try:
+            offset = self.info(self.primary).get('master_repl_offset', 0)
+        except redis.RedisError as e:
+            self.logger.warning('Primary replication info failed: {}'
+                                .format(e))
+            return []
+        self._offsets.append((now, offset))
+        while len(self._offsets) > 1 and \
+                now - self._offsets[1][0] > self.max_staleness:
+            self._offsets.popleft()
+        eligible = []
+        for replica in self.replicas:
+            staleness = self.staleness(replica, now)
+            if staleness is not None and staleness <= self.max_staleness:
+                eligible.append(replica)
+        return eligible
+
+    def staleness(self, replica, now):
+        """
+        Returns how far behind a replica is in seconds, None if unknown.
+        """
+        try:
+            info = self.info(replica)
+        except redis.RedisError as e:
+            self.logger.warning('Replica replication info failed: {}'
+                                .format(e))
+            return None
+        if info.get('master_link_status') != 'up':
+            return None
+        offset = info.get('slave_repl_offset', -1)
+        caught_up = [sampled for sampled, primary_offset in self._offsets
+                     if primary_offset <= offset]
+        if len(caught_up) == 0:
+            return None
+        return now - max(caught_up)
+
+    def client(self):
+        """
+        Returns the next replica in the rotation, None to read from the
+        primary.
+        """
+        if self.max_staleness <= 0 or len(self.replicas) == 0:
+            return None
+        now = time.time()
+        with self._lock:
+            if self._checked is None or \
+                    now - self._checked >= self.check_interval:
+                self._checked = now
+                self._eligible = self.check(now)
+            if len(self._eligible) == 0:
+                return None
+            self._next = (self._next + 1) % len(self._eligible)
+            return self._eligible[self._next]
+
+    def failed(self, replica):
+        """
+        Skips a replica until the next check.
+        """
+        with self._lock:
+            if replica in self._eligible:
+                self._eligible.remove(replica)
@@ -0,0 +1,394 @@
+# -*- coding: utf8 -*-
+# Embedded SQLite storage
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+"""
+Persistent storage in a single SQLite file for single-node deployments.
+The file is opened in WAL mode and read through a memory map, so any number
+of worker processes can read it concurrently from the shared page cache
+while one process writes. Nothing is loaded at startup.
+"""
+
+import sqlite3
+import threading
+from feet.config import settings
+from feet.utils.logger import LoggingMixin
+from feet.storage import StorageAbstract, StoreException
+from feet.storage.memory import LocalPipeline, encode, lex_members, \
+    parse_lex, set_bits
+
+TABLES = ('strings', 'sets', 'lists', 'zsets', 'hashes')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (
+    db INTEGER, key BLOB, value BLOB,
+    PRIMARY KEY (db, key)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sets (
+    db INTEGER, key BLOB, member BLOB,
+    PRIMARY KEY (db, key, member)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lists (
+    db INTEGER, key BLOB, idx INTEGER, value BLOB,
+    PRIMARY KEY (db, key, idx)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS zsets (
+    db INTEGER, key BLOB, member BLOB,
+    PRIMARY KEY (db, key, member)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (
+    db INTEGER, key BLOB, field BLOB, value BLOB,
+    PRIMARY KEY (db, key, field)) WITHOUT ROWID;
+"""
+
+ALL_KEYS = ' UNION '.join('SELECT key FROM {} WHERE db = ?'.format(table)
+                          for table in TABLES)
+
+
+class WriteLock(object):
+    """
+    Re-entrant write transaction on the connection of the current thread,
+    it plays the role of the storage lock for LocalPipeline.
+    """
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __enter__(self):
+        state = self._storage.state
+        if state.depth == 0:
+            state.connection.execute('BEGIN IMMEDIATE')
+        state.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        state = self._storage.state
+        state.depth -= 1
+        if state.depth == 0:
+            if exc_type is None:
+                state.connection.execute('COMMIT')
+            else:
+                state.connection.execute('ROLLBACK')
+
+
+class SQLiteStorage(StorageAbstract, LoggingMixin):
+    """
+    SQLite storage. The db number of the endpoint partitions the file, host
+    and port are ignored. Every thread gets its own connection.
+    """
+    _states = {}
+    _states_lock = threading.Lock()
+    _detached = []
+
+    @classmethod
+    def detach_all(klass):
+        """
+        Forgets the connections of a forked process without closing them,
+        closing them would release the file locks of the parent.
+        """
+        klass._detached = klass._detached + klass._states.values()
+        klass._states = {}
+        klass._states_lock = threading.Lock()
+
+    def __init__(self,
+                 redis_host=settings.database.host,
+                 redis_port=settings.database.port,
+                 redis_db=0,
+                 path=None):
+        self._path = path or settings.database.sqlite_path
+        self._db = int(redis_db)
+        with self._states_lock:
+            if self._path not in self._states:
+                self._states[self._path] = threading.local()
+            self._local = self._states[self._path]
+        self.lock = WriteLock(self)
+
+    @property
+    def state(self):
+        """
+        Connection of the current thread and depth of its write lock.
+        """
+        if not hasattr(self._local, 'connection'):
+            connection = sqlite3.connect(
+                self._path,
+                timeout=settings.database.pool_timeout,
+                isolation_level=None,
+                check_same_thread=False)
+            connection.text_factory = str
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA mmap_size={:d}'.format(
+                settings.database.mmap_size))
+            connection.executescript(SCHEMA)
+            self._local.connection, self._local.depth = connection, 0
+        return self._local
+
+    def _query(self, query, *params):
+        return self.state.connection.execute(query, params)
+
+    def _one(self, query, *params):
+        row = self._query(query, *params).fetchone()
+        return row[0] if row is not None else None
+
+    def exists(self, key):
+        key = encode(key)
+        return int(any(
+            self._one('SELECT 1 FROM {} WHERE db = ? AND key = ? LIMIT 1'
+                      .format(table), self._db, key) is not None
+            for table in TABLES))
+
+    def keys(self, pattern):
+        return [row[0] for row in self._query(
+            'SELECT key FROM ({}) WHERE key GLOB ?'.format(ALL_KEYS),
+            *([self._db] * len(TABLES) + [encode(pattern)]))]
+
+    def scan_iter(self, pattern, count=None):
+        """
+        Iterates over keys by pages of count keys.
+        """
+        if count is None:
+            count = settings.database.scan_count
+        last = ''
+        while True:
+            page = [row[0] for row in self._query(
+                'SELECT key FROM ({}) WHERE key > ? AND key GLOB ? '
+                'ORDER BY key LIMIT ?'.format(ALL_KEYS),
+                *([self._db] * len(TABLES) + [last, encode(pattern), count]))]
+            for key in page:
+                yield key
+            if len(page) < count:
+                return
+            last = page[-1]
+
+    def get(self, key):
+        value = self._one('SELECT value FROM strings WHERE db = ? AND key = ?',
+                          self._db, encode(key))
+        if value is None and self.exists(key):
+            raise StoreException('WRONGTYPE %s does not hold a string' % key)
+        return value
+
+    def mget(self, *keys):
+        return [self._one('SELECT value FROM strings WHERE db = ? AND key = ?',
+                          self._db, encode(key)) for key in keys]
+
+    def set(self, key, value):
+        self._query('INSERT OR REPLACE INTO strings VALUES (?, ?, ?)',
+                    self._db, encode(key), encode(value))
+        return True
+
+    def setnx(self, key, value):
+        return self._query('INSERT OR IGNORE INTO strings VALUES (?, ?, ?)',
+                           self._db, encode(key),
+                           encode(value)).rowcount == 1
+
+    def setbits(self, key, offsets):
+        with self.lock:
+            data, changed = set_bits(self.get(key), offsets)
+            self.set(key, data)
+            return changed
+
+    def delete(self, *keys):
+        deleted = set()
+        with self.lock:
+            for key in keys:
+                key = encode(key)
+                for table in TABLES:
+                    if self._query('DELETE FROM {} WHERE db = ? AND key = ?'
+                                   .format(table),
+                                   self._db, key).rowcount > 0:
+                        deleted.add(key)
+        return len(deleted)
+
+    def unlink(self, *keys):
+        return self.delete(*keys)
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def incrby(self, key, amount):
+        with self.lock:
+            value = int(self.get(key) or 0) + amount
+            self.set(key, value)
+            return value
+
+    def decr(self, key):
+        return self.incrby(key, -1)
+
+    def sadd(self, key, *values):
+        with self.lock:
+            return sum(self._query('INSERT OR IGNORE INTO sets '
+                                   'VALUES (?, ?, ?)', self._db, encode(key),
+                                   encode(value)).rowcount
+                       for value in values)
+
+    def smembers(self, key):
+        return set(row[0] for row in self._query(
+            'SELECT member FROM sets WHERE db = ? AND key = ?',
+            self._db, encode(key)))
+
+    def srem(self, key, *values):
+        with self.lock:
+            return sum(self._query('DELETE FROM sets WHERE db = ? AND '
+                                   'key = ? AND member = ?', self._db,
+                                   encode(key), encode(value)).rowcount
+                       for value in values)
+
+    def lrange(self, key, start, end):
+        key = encode(key)
+        if start < 0 or end < 0:
+            length = self._one('SELECT COUNT(*) FROM lists '
+                               'WHERE db = ? AND key = ?', self._db, key)
+            if start < 0:
+                start = max(start + length, 0)
+            if end < 0:
+                end += length
+        if end < start:
+            return []
+        return [row[0] for row in self._query(
+            'SELECT value FROM lists WHERE db = ? AND key = ? '
+            'ORDER BY idx LIMIT ? OFFSET ?',
+            self._db, key, end - start + 1, start)]
+
+    def lrem(self, key, count, value):
+        order = 'DESC' if count < 0 else 'ASC'
+        limit = abs(count) if count != 0 else -1
+        with self.lock:
+            indexes = [row[0] for row in self._query(
+                'SELECT idx FROM lists WHERE db = ? AND key = ? AND '
+                'value = ? ORDER BY idx {} LIMIT ?'.format(order),
+                self._db, encode(key), encode(value), limit)]
+            for idx in indexes:
+                self._query('DELETE FROM lists WHERE db = ? AND key = ? AND '
+                            'idx = ?', self._db, encode(key), idx)
+            return len(indexes)
+
+    def rpush(self, key, *values):
+        key = encode(key)
+        with self.lock:
+            idx = self._one('SELECT MAX(idx) FROM lists '
+                            'WHERE db = ? AND key = ?', self._db, key)
+            idx = -1 if idx is None else idx
+            for offset, value in enumerate(values):
+                self._query('INSERT INTO lists VALUES (?, ?, ?, ?)',
+                            self._db, key, idx + offset + 1, encode(value))
+            return self._one('SELECT COUNT(*) FROM lists '
+                             'WHERE db = ? AND key = ?', self._db, key)
+
+    def zadd(self, key, *args):
+        members = lex_members(args)
+        with self.lock:
+            return sum(self._query('INSERT OR IGNORE INTO zsets '
+                                   'VALUES (?, ?, ?)', self._db, encode(key),
+                                   member).rowcount
+                       for member in members)
+
+    def zrem(self, key, *values):
+        with self.lock:
+            return sum(self._query('DELETE FROM zsets WHERE db = ? AND '
+                                   'key = ? AND member = ?', self._db,
+                                   encode(key), encode(value)).rowcount
+                       for value in values)
+
+    def zcard(self, key):
+        return self._one('SELECT COUNT(*) FROM zsets WHERE db = ? AND '
+                         'key = ?', self._db, encode(key))
+
+    def zrange(self, key, start, end):
+        key = encode(key)
+        if start < 0 or end < 0:
+            length = self.zcard(key)
+            if start < 0:
+                start = max(start + length, 0)
+            if end < 0:
+                end += length
+        if end < start:
+            return []
+        return [row[0] for row in self._query(
+            'SELECT member FROM zsets WHERE db = ? AND key = ? '
+            'ORDER BY member LIMIT ? OFFSET ?',
+            self._db, key, end - start + 1, start)]
+
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        if (start is None) != (num is None):
+            raise StoreException('start and num must both be specified')
+        query = 'SELECT member FROM zsets WHERE db = ? AND key = ?'
+        params = [self._db, encode(key)]
+        for bound, operators in ((min, ('>=', '>')), (max, ('<=', '<'))):
+            value, inclusive = parse_lex(bound)
+            if value is not None:
+                query += ' AND member {} ?'.format(
+                    operators[0] if inclusive else operators[1])
+                params.append(value)
+        query += ' ORDER BY member LIMIT ? OFFSET ?'
+        if start is None:
+            params += [-1, 0]
+        else:
+            params += [num, start]
+        return [row[0] for row in self._query(query, *params)]
+
+    def hset(self, key, field, value):
+        with self.lock:
+            created = not self.hexists(key, field)
+            self._query('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)',
+                        self._db, encode(key), encode(field), encode(value))
+            return int(created)
+
+    def hget(self, key, field):
+        return self._one('SELECT value FROM hashes WHERE db = ? AND key = ? '
+                         'AND field = ?', self._db, encode(key),
+                         encode(field))
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self._query('SELECT field, value FROM hashes WHERE db = ? '
+                                'AND key = ?', self._db, encode(key)))
+
+    def hdel(self, key, field):
+        return self._query('DELETE FROM hashes WHERE db = ? AND key = ? AND '
+                           'field = ?', self._db, encode(key),
+                           encode(field)).rowcount
+
+    def hexists(self, key, field):
+        return self.hget(key, field) is not None
+
+    def memory_usage(self, keys):
+        """
+        Approximates the size of keys with the length of their data.
+        """
+        total = 0
+        for key in keys:
+            key = encode(key)
+            total += self._one('SELECT COALESCE(SUM(LENGTH(key) + '
+                               'LENGTH(value)), 0) FROM strings WHERE db = ? '
+                               'AND key = ?', self._db, key)
+            total += self._one('SELECT COALESCE(SUM(LENGTH(key) + '
+                               'LENGTH(member)), 0) FROM sets WHERE db = ? '
+                               'AND key = ?', self._db, key)
+            total += self._one('SELECT COALESCE(SUM(LENGTH(key) + '
+                               'LENGTH(value) + 8), 0) FROM lists WHERE '
+                               'db = ? AND key = ?', self._db, key)
+            total += self._one('SELECT COALESCE(SUM(LENGTH(key) + '
+                               'LENGTH(member)), 0) FROM zsets WHERE db = ? '
+                               'AND key = ?', self._db, key)
+            total += self._one('SELECT COALESCE(SUM(LENGTH(key) + '
+                               'LENGTH(field) + LENGTH(value)), 0) FROM '
+                               'hashes WHERE db = ? AND key = ?',
+                               self._db, key)
+        return total
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self, transaction)
+
+    def transaction(self, func, *watchs, **params):
+        """
+        Runs func in a write transaction, so watched keys cannot change and
+        the transaction never has to be retried.
+        """
+        value_from_callable = params.get('value_from_callable', False)
+        with self.lock:
+            pipe = self.pipeline(True)
+            pipe.watch(*watchs)
+            func_value = func(pipe)
+            exec_value = pipe.execute()
+        return func_value if value_from_callable else exec_value
@@ -20,6 +20,7 @@ import tornado.httpclient
 
 from feet.www.urls import make_app
 from feet.config import settings
+from feet.entities import executor
 
 tornado_settings = {
     "static_path": os.path.join(os.path.dirname(__file__), "static"),
@@ -30,6 +31,10 @@ tornado_settings = {
 
 
 def run(host, port, debug):
+    if settings.extraction.workers > 0:
+        pool = executor.start()
+        logging.info('Feet server extracting with %d processes' % (
+            pool.workers))
     app = make_app()
     app.listen(port)
     logging.info('Feet server listening on port %d' % (port))
@@ -37,6 +42,8 @@ def run(host, port, debug):
         tornado.ioloop.IOLoop.instance().start()
     except KeyboardInterrupt:
         logging.info('Feet server interrupted')
+    finally:
+        executor.stop()
 
 
 if __name__ == "__main__":
@@ -6,11 +6,18 @@
 # Copyright (C) 2016 Romary Dupuis
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
+import math
 import traceback
+from datetime import timedelta
+from tornado import gen
 from tornado.web import RequestHandler, MissingArgumentError
 from tornado.escape import json_decode, json_encode
-from feet.entities.extractor import Extractor
+from feet.config import settings
+from feet.entities import executor
+from feet.entities.extractor import Extractor, MODES
 from feet.entities.registry import Registry
+from feet.exceptions import RebuildError
+from feet.storage.asynchronous import run_in_executor
 from feet.utils.logger import LoggingMixin
 
 
@@ -18,10 +25,11 @@ class RegistriesHandler(LoggingMixin, RequestHandler):
     """
     Handler to get the list of registries in the system
     """
+    @gen.coroutine
     def get(self, database, prefix):
         try:
-            registries = Registry.list(key_prefix=prefix,
-                                       redis_db=int(database))
+            registries = yield Registry.list_async(key_prefix=prefix,
+                                                   redis_db=int(database))
             self.write(json_encode({'registries': registries}))
         except MissingArgumentError:
             raise
@@ -35,39 +43,45 @@ class RegistryHandler(LoggingMixin, RequestHandler):
     Handler for the management of a registry resource
     Allows to get, add and delete registries
     """
+    @gen.coroutine
     def get(self, database, prefix, registry):
         try:
-            if registry not in Registry.list(key_prefix=prefix,
-                                             redis_db=int(database)):
-                return self.send_error(400)
-            reg = Registry.find_or_create(registry,
-                                          key_prefix=prefix,
-                                          redis_db=int(database))
-            self.write(json_encode({'entities': reg.dictionaries()}))
+            registries = yield Registry.list_async(key_prefix=prefix,
+                                                   redis_db=int(database))
+            if registry not in registries:
+                self.send_error(400)
+                return
+            reg = yield Registry.find_or_create_async(registry,
+                                                      key_prefix=prefix,
+                                                      redis_db=int(database))
+            dictionaries = yield reg.dictionaries_async()
+            self.write(json_encode({'entities': dictionaries}))
         except MissingArgumentError:
             raise
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def post(self, database, prefix, registry):
         try:
             # TODO: Check size and format of registry name
-            Registry.find_or_create(registry,
-                                    key_prefix=prefix,
-                                    redis_db=int(database))
+            yield Registry.find_or_create_async(registry,
+                                                key_prefix=prefix,
+                                                redis_db=int(database))
         except MissingArgumentError:
             raise
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def delete(self, database, prefix, registry):
         try:
-            reg = Registry.find_or_create(registry,
-                                          key_prefix=prefix,
-                                          redis_db=int(database))
-            reg.delete()
+            reg = yield Registry.find_or_create_async(registry,
+                                                      key_prefix=prefix,
+                                                      redis_db=int(database))
+            yield run_in_executor(reg.delete)
         except MissingArgumentError:
             raise
         except Exception:
@@ -81,44 +95,53 @@ class EntityHandler(LoggingMixin, RequestHandler):
     Provides information about the entity: list of languages supported
     Allows to get, add and delete languages
     """
+    @gen.coroutine
     def get(self, database, prefix, registry, dictionary):
         try:
-            reg = Registry.find_or_create(registry,
-                                          key_prefix=prefix,
-                                          redis_db=int(database))
-            if dictionary not in reg.dictionaries():
-                return self.send_error(400)
-            entity = reg.get_dict(dictionary)
-            self.write(json_encode(
-                {'languages': entity.languages()}))
+            reg = yield Registry.find_or_create_async(registry,
+                                                      key_prefix=prefix,
+                                                      redis_db=int(database))
+            dictionaries = yield reg.dictionaries_async()
+            if dictionary not in dictionaries:
+                self.send_error(400)
+                return
+            entity = yield reg.get_dict_async(dictionary)
+            languages = yield entity.languages_async()
+            self.write(json_encode({'languages': languages}))
         except MissingArgumentError:
             raise
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def post(self, database, prefix, registry, dictionary):
         try:
             # TODO: Check size and format of entity name
-            reg = Registry.find_or_create(registry,
-                                          key_prefix=prefix,
-                                          redis_db=int(database))
-            reg.get_dict(dictionary)
+            reg = yield Registry.find_or_create_async(registry,
+                                                      key_prefix=prefix,
+                                                      redis_db=int(database))
+            yield reg.get_dict_async(dictionary)
         except MissingArgumentError:
             raise
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def delete(self, database, prefix, registry, dictionary):
         try:
-            reg = Registry.find_or_create(registry,
-                                          key_prefix=prefix,
-                                          redis_db=int(database))
-            if dictionary not in reg.dictionaries():
-                return self.send_error(400)
-            if not reg.del_dict(dictionary):
-                return self.send_error(500)
+            reg = yield Registry.find_or_create_async(registry,
+                                                      key_prefix=prefix,
+                                                      redis_db=int(database))
+            dictionaries = yield reg.dictionaries_async()
+            if dictionary not in dictionaries:
+                self.send_error(400)
+                return
+            deleted = yield run_in_executor(reg.del_dict, dictionary)
+            if not deleted:
+                self.send_error(500)
+                return
         except MissingArgumentError:
             raise
         except Exception:
@@ -130,67 +153,97 @@ class LanguageHandler(LoggingMixin, RequestHandler):
     """
     Handler for the language dictionary of an entity
     """
+    def write_error(self, status_code, **kwargs):
+        if 'retry_after' in kwargs:
+            self.set_header('Retry-After', kwargs['retry_after'])
+        super(LanguageHandler, self).write_error(status_code, **kwargs)
+
+    def send_rebuilding(self):
+        """
+        Refuses a write to a language being rebuilt with a 503, the client
+        can retry once the rebuild lease expired.
+        """
+        self.logger.warning(traceback.format_exc())
+        self.send_error(503, retry_after=int(math.ceil(
+            settings.database.rebuild_lease)))
+
+    @gen.coroutine
     def entity(self, database, prefix, registry, dictionary):
-        reg = Registry.find_or_create(registry,
-                                      key_prefix=prefix,
-                                      redis_db=int(database))
-        if dictionary not in reg.dictionaries():
-            return None
-        entity_dictionary = reg.get_dict(dictionary)
-        return entity_dictionary
+        reg = yield Registry.find_or_create_async(registry,
+                                                  key_prefix=prefix,
+                                                  redis_db=int(database))
+        dictionaries = yield reg.dictionaries_async()
+        if dictionary not in dictionaries:
+            raise gen.Return(None)
+        entity_dictionary = yield reg.get_dict_async(dictionary)
+        raise gen.Return(entity_dictionary)
 
+    @gen.coroutine
     def get(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
-            self.write(json_encode(
-                {'count': entity_dictionary.cardinality(language)})
-            )
+                self.send_error(400)
+                return
+            count = yield entity_dictionary.cardinality_async(language)
+            self.write(json_encode({'count': count}))
         except MissingArgumentError:
             raise
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def post(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
-            entity_dictionary.add_language(language)
+                self.send_error(400)
+                return
+            yield run_in_executor(entity_dictionary.add_language, language)
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def put(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
+                self.send_error(400)
+                return
             data = json_decode(self.request.body)
             if 'new_name' in data:
-                entity_dictionary.change_language(language, data['new_name'])
+                yield run_in_executor(entity_dictionary.change_language,
+                                      language, data['new_name'])
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def delete(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
-            entity_dictionary.delete_language(language)
+                self.send_error(400)
+                return
+            yield run_in_executor(entity_dictionary.delete_language, language)
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
@@ -200,34 +253,46 @@ class TermsHandler(LanguageHandler):
     """
     Handler for listing terms for a language of an entity
     """
+    @gen.coroutine
     def get(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
-            page = int(self.get_argument('page', 0))
+                self.send_error(400)
+                return
             count = int(self.get_argument('count', 10))
-            self.write(json_encode(
-                {'terms': entity_dictionary.terms(language, page, count)})
-            )
+            cursor = self.get_argument('cursor', None)
+            if cursor is not None:
+                terms, cursor = yield entity_dictionary.terms_page_async(
+                    language, cursor, count)
+                self.write(json_encode({'terms': terms, 'cursor': cursor}))
+                return
+            page = int(self.get_argument('page', 0))
+            terms = yield entity_dictionary.terms_async(language, page, count)
+            self.write(json_encode({'terms': terms}))
         except MissingArgumentError:
             raise
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def post(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
+                self.send_error(400)
+                return
             data = json_decode(self.request.body)
             if 'terms' in data:
-                entity_dictionary.load_list(data['terms'], language)
+                yield run_in_executor(entity_dictionary.load_list,
+                                      data['terms'], language)
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
@@ -235,25 +300,34 @@ class TermsHandler(LanguageHandler):
     def put(self, database, prefix, registry, dictionary, language):
         return self.post(database, prefix, registry, dictionary, language)
 
+    @gen.coroutine
     def delete(self, database, prefix, registry, dictionary, language):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
+                self.send_error(400)
+                return
             if self.request.body is not None:
                 data = json_decode(self.request.body)
                 if 'terms' in data:
-                    for term in data['terms']:
-                        if not entity_dictionary.delete_term(term, language):
-                            self.send_error(500)
+                    statuses = yield run_in_executor(
+                        entity_dictionary.delete_terms, data['terms'],
+                        language)
+                    if not all(statuses):
+                        self.set_status(500)
+                    self.write(json_encode({'deleted': dict(
+                        zip(data['terms'], statuses))}))
                 else:
-                    return self.send_error(500)
+                    self.send_error(500)
+                    return
             else:
                 # delete all terms
                 pass
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
@@ -272,29 +346,39 @@ class TermHandler(LanguageHandler):
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def post(self, database, prefix, registry, dictionary, language, term):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
-            entity_dictionary.load_list([term], language)
+                self.send_error(400)
+                return
+            yield run_in_executor(entity_dictionary.add_term, term, language)
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
+    @gen.coroutine
     def delete(self, database, prefix, registry, dictionary, language, term):
         try:
-            entity_dictionary = self.entity(database, prefix, registry,
-                                            dictionary)
+            entity_dictionary = yield self.entity(database, prefix, registry,
+                                                  dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
-            if not entity_dictionary.delete_term(term, language):
+                self.send_error(400)
+                return
+            deleted = yield run_in_executor(entity_dictionary.delete_term,
+                                            term, language)
+            if not deleted:
                 self.send_error(500)
         except MissingArgumentError:
             raise
+        except RebuildError:
+            self.send_rebuilding()
         except Exception:
             self.logger.error(traceback.format_exc())
             self.send_error(500)
@@ -306,21 +390,30 @@ class ExtractHandler(LoggingMixin, RequestHandler):
     Extracts from a text a list of terms that are part of a dictionary
     Input parameters in POST request:
         Mandatory parameters: text, entity_name
-        Optional parameter: lang (default is 'en'), database (0), prefix (feet)
+        Optional parameter: lang (default is 'en'), database (0), prefix (feet),
+        grammar, mode (grammar or gazetteer)
     """
+    @gen.coroutine
     def post(self, database, prefix, registry, dictionary, language):
         try:
             data = json_decode(self.request.body)
             reg = Registry(registry, key_prefix=prefix, redis_db=int(database))
-            entity_dictionary = reg.get_dict(dictionary)
+            entity_dictionary = yield reg.get_dict_async(dictionary)
             if entity_dictionary is None:
-                return self.send_error(400)
+                self.send_error(400)
+                return
             if 'text' not in data:
-                return self.send_error(500)
-            res = self.extract_entities(entity_dictionary,
-                                        language,
-                                        data['text'],
-                                        data.get('grammar', None))
+                self.send_error(500)
+                return
+            if data.get('mode', 'grammar') not in MODES:
+                self.send_error(400)
+                return
+            res = yield self.extract_entities(entity_dictionary,
+                                              language,
+                                              data['text'],
+                                              data.get('grammar', None),
+                                              data.get('mode', None),
+                                              data.get('fuzzy', False))
             self.write(json_encode({'result': res}))
         except MissingArgumentError:
             raise
@@ -328,12 +421,35 @@ class ExtractHandler(LoggingMixin, RequestHandler):
             self.logger.error(traceback.format_exc())
             self.send_error(500)
 
-    def extract_entities(self, entity_dictionary, language, text, grammar):
-        engine = Extractor(entity_dictionary, grammar)
-        res = engine.extract(text, language)
+    @gen.coroutine
+    def extract_entities(self, entity_dictionary, language, text, grammar,
+                         mode=None, fuzzy=False):
+        pool = executor.shared()
+        if pool is not None:
+            # NLP runs in a worker process, see feet.entities.executor
+            outputs = yield gen.with_timeout(
+                timedelta(seconds=settings.timeout),
+                pool.submit(entity_dictionary, [text], language, grammar,
+                            mode, fuzzy))
+            output = outputs[0]
+        else:
+            engine = Extractor(entity_dictionary, grammar, mode, fuzzy)
+            output = (yield engine.extract_async(text, language))[0]
         entities = []
-        for element in res[0]:
+        for element in output:
             if element['entity_found'] == 1:
                 entities = list(set(entities).union(
                     element['entity_candidates']))
-        return entities
+        raise gen.Return(entities)
+
+
+class ExtractionHandler(LoggingMixin, RequestHandler):
+    """
+    Handler for the counters of the pool of extracting processes
+    """
+    def get(self):
+        pool = executor.shared()
+        if pool is None:
+            self.write(json_encode({'workers': 0}))
+        else:
+            self.write(json_encode(pool.stats()))
@@ -8,13 +8,16 @@
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
 import os
+import math
 import csv
 import unittest
 import inspect
 import json
 from tornado.testing import AsyncHTTPTestCase
+from feet.config import settings
 from feet.www.urls import make_app
 from feet.utils.logger import LoggingMixin
+from feet.entities import executor
 from feet.entities.registry import Registry
 
 PATH = os.path.dirname(os.path.abspath(__file__))
@@ -316,9 +319,9 @@ class EntityExtractTestCase(GenericTestCase):
             '?page=0&count=5')
         self.assertEqual(response.code, 200)
         json_response = json.loads(response.body)
-        self.assertItemsEqual([u'Afghanistan', u'Åland Islands',
-                               u'Albania', u'Algeria', u'American Samoa'],
-                              json_response['terms'])
+        self.assertEqual([u'Afghanistan', u'Albania', u'Algeria',
+                          u'American Samoa', u'Andorra'],
+                         json_response['terms'])
 
         response = self.fetch(
             '/database/0/prefix/terms_api_test/registries/' +
@@ -327,10 +330,29 @@ class EntityExtractTestCase(GenericTestCase):
             '?page=1&count=5')
         self.assertEqual(response.code, 200)
         json_response = json.loads(response.body)
-        self.assertItemsEqual([u'Andorra', u'Angola',
-                               u'Anguilla', u'Antarctica',
-                               u'Antigua and Barbuda'],
-                              json_response['terms'])
+        self.assertEqual([u'Angola', u'Anguilla', u'Antarctica',
+                          u'Antigua and Barbuda', u'Argentina'],
+                         json_response['terms'])
+
+        response = self.fetch(
+            '/database/0/prefix/terms_api_test/registries/' +
+            '{}/entities/country/lang/en/terms/'
+            .format(inspect.stack()[0][3]) +
+            '?cursor=&count=2')
+        self.assertEqual(response.code, 200)
+        json_response = json.loads(response.body)
+        self.assertEqual([u'Afghanistan', u'Albania'], json_response['terms'])
+        self.assertEqual(u'Albania', json_response['cursor'])
+
+        response = self.fetch(
+            '/database/0/prefix/terms_api_test/registries/' +
+            '{}/entities/country/lang/en/terms/'
+            .format(inspect.stack()[0][3]) +
+            '?cursor=Albania&count=2')
+        self.assertEqual(response.code, 200)
+        json_response = json.loads(response.body)
+        self.assertEqual([u'Algeria', u'American Samoa'],
+                         json_response['terms'])
 
         # extract entities from text
         response = self.fetch(
@@ -400,6 +422,132 @@ class EntityExtractTestCase(GenericTestCase):
         self.assertEqual(response.code, 200)
         self.assertIn('flight tickets', json.loads(response.body)['result'])
 
+    def test_delete_terms(self):
+        """
+        Test delete terms in bulk
+        """
+        url = '/database/0/prefix/terms_api_test/registries/' + \
+            '{}/entities/test/'.format(inspect.stack()[0][3])
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 200)
+        url += 'lang/en/'
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 200)
+        response = self.fetch(url + 'terms/', method='POST',
+                              body=json.dumps({'terms': ['Paris', 'Tokyo',
+                                                         'Lyon']}))
+        self.assertEqual(response.code, 200)
+        response = self.fetch(url + 'terms/', method='DELETE',
+                              body=json.dumps({'terms': ['Paris', 'Lyon']}),
+                              allow_nonstandard_methods=True)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)['deleted'],
+                         {'Paris': True, 'Lyon': True})
+        response = self.fetch(url + 'terms/', method='DELETE',
+                              body=json.dumps({'terms': ['Tokyo', 'Paris']}),
+                              allow_nonstandard_methods=True)
+        self.assertEqual(response.code, 500)
+        self.assertEqual(json.loads(response.body)['deleted'],
+                         {'Tokyo': True, 'Paris': False})
+        response = self.fetch(url + 'terms/')
+        self.assertEqual(json.loads(response.body)['terms'], [])
+
+    def test_writes_during_rebuild(self):
+        """
+        Test writes to a language being rebuilt are answered with a 503
+        """
+        name = inspect.stack()[0][3]
+        url = '/database/0/prefix/terms_api_test/registries/' + \
+            '{}/entities/test/'.format(name)
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 200)
+        url += 'lang/en/'
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 200)
+        response = self.fetch(url + 'terms/', method='POST',
+                              body=json.dumps({'terms': ['Paris']}))
+        self.assertEqual(response.code, 200)
+        entity_dictionary = Registry.find_or_create(
+            name, key_prefix='terms_api_test').get_dict('test')
+        if entity_dictionary.schema == 1:
+            return
+        entity_dictionary.stage('en')
+        response = self.fetch(url + 'terms/', method='POST',
+                              body=json.dumps({'terms': ['Tokyo']}))
+        self.assertEqual(response.code, 503)
+        self.assertEqual(response.headers['Retry-After'],
+                         str(int(math.ceil(settings.database.rebuild_lease))))
+        response = self.fetch(url + 'terms/Paris/', method='DELETE')
+        self.assertEqual(response.code, 503)
+        self.assertIn('Retry-After', response.headers)
+        entity_dictionary.release('en')
+        response = self.fetch(url + 'terms/Paris/', method='DELETE')
+        self.assertEqual(response.code, 200)
+
+    def test_extract_with_gazetteer(self):
+        """
+        Test extract terms in gazetteer mode
+        """
+        url = '/database/0/prefix/terms_api_test/registries/' + \
+            '{}/entities/tourism/'.format(inspect.stack()[0][3])
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 200)
+        url += 'lang/en/'
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 200)
+        response = self.fetch(url + 'terms/', method='POST',
+                              body=json.dumps({'terms': ['flight tickets',
+                                                         'Japan']}))
+        self.assertEqual(response.code, 200)
+        response = self.fetch(url + 'extract/', method='POST',
+                              body=json.dumps({
+                                  'text': 'I want to buy Flight Tickets '
+                                          'for Japan',
+                                  'mode': 'gazetteer'}))
+        self.assertEqual(response.code, 200)
+        self.assertItemsEqual(['flight tickets', 'Japan'],
+                              json.loads(response.body)['result'])
+        response = self.fetch(url + 'extract/', method='POST',
+                              body=json.dumps({'text': 'Japan',
+                                               'mode': 'regex'}))
+        self.assertEqual(response.code, 400)
+
+
+class ExtractionAPITest(GenericTestCase):
+    def setUp(self):
+        super(ExtractionAPITest, self).setUp()
+        executor.start(1)
+
+    def tearDown(self):
+        executor.stop()
+        Registry.flush('extraction_api_test')
+        super(ExtractionAPITest, self).tearDown()
+
+    def test_extract_in_workers(self):
+        """
+        Test extract terms in the pool of extracting processes
+        """
+        registry = Registry.find_or_create('test_extract_in_workers',
+                                           key_prefix='extraction_api_test')
+        registry.get_dict('tourism').add_terms(['flight tickets', 'Japan'],
+                                               'en')
+        url = '/database/0/prefix/extraction_api_test/registries/' + \
+            'test_extract_in_workers/entities/tourism/lang/en/extract/'
+        response = self.fetch(url, method='POST',
+                              body=json.dumps({
+                                  'text': 'I want to buy Flight Tickets '
+                                          'for Japan',
+                                  'mode': 'gazetteer'}))
+        self.assertEqual(response.code, 200)
+        self.assertItemsEqual(['flight tickets', 'Japan'],
+                              json.loads(response.body)['result'])
+        response = self.fetch('/extraction/')
+        self.assertEqual(response.code, 200)
+        stats = json.loads(response.body)
+        self.assertEqual(stats['workers'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['pending'], 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -15,6 +15,7 @@ from feet.www.handlers.entities import (RegistriesHandler,
                                         RegistryHandler, EntityHandler,
                                         LanguageHandler,
                                         ExtractHandler,
+                                        ExtractionHandler,
                                         TermsHandler, TermHandler)
 
 RESOURCE_DATABASE = 'database'
@@ -24,34 +25,37 @@ RESOURCE_ENTITY = 'entities'
 RESOURCE_LANGUAGE = 'lang'
 RESOURCE_TERM = 'terms'
 RESOURCE_EXTRACT = 'extract'
+RESOURCE_EXTRACTION = 'extraction'
 
 
 def handlers():
     return [
         url(r'^/$', MainHandler),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/$'
+        url(r'^/{}/$'.format(RESOURCE_EXTRACTION), ExtractionHandler,
+            name='extraction'),
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY),
             RegistriesHandler, name='registries'),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/(\w+)/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY),
             RegistryHandler, name='registry'),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY,
                     RESOURCE_ENTITY),
             EntityHandler, name='entity'),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY,
                     RESOURCE_ENTITY, RESOURCE_LANGUAGE),
             LanguageHandler, name='language'),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/$'
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY,
                     RESOURCE_ENTITY, RESOURCE_LANGUAGE, RESOURCE_TERM),
             TermsHandler, name='terms'),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY,
                     RESOURCE_ENTITY, RESOURCE_LANGUAGE, RESOURCE_TERM),
             TermHandler, name='term'),
-        url(r'^/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/$'
+        url(r'^/{}/(\d+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/(\w+)/{}/$'
             .format(RESOURCE_DATABASE, RESOURCE_PREFIX, RESOURCE_REGISTRY,
                     RESOURCE_ENTITY, RESOURCE_LANGUAGE, RESOURCE_EXTRACT),
             ExtractHandler, name='extract_entity')
@@ -0,0 +1,55 @@
+# -*- coding: utf8 -*-
+# test_bloom.py
+# Test the feet.entities.bloom module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import unittest
+from feet.entities.bloom import BloomFilter
+from feet.storage.memory import set_bits
+
+
+class BloomFilterTests(unittest.TestCase):
+    def test_sizing(self):
+        """
+        Test filters are sized for a capacity and a false positive rate
+        """
+        bloom_filter = BloomFilter.for_capacity(1000, 0.01)
+        self.assertEqual(bloom_filter.bits, 9586)
+        self.assertEqual(bloom_filter.hashes, 7)
+        self.assertEqual(len(bloom_filter.dumps()), 1199)
+
+    def test_membership(self):
+        """
+        Test added items are always found and few others are
+        """
+        bloom_filter = BloomFilter.for_capacity(1000, 0.01)
+        for idx in range(1000):
+            bloom_filter.add('token%d' % idx)
+        self.assertTrue(all('token%d' % idx in bloom_filter
+                            for idx in range(1000)))
+        false_positives = sum('other%d' % idx in bloom_filter
+                              for idx in range(10000))
+        self.assertLess(false_positives, 200)
+        self.assertIn(u'token1', bloom_filter)
+
+    def test_storage_layout(self):
+        """
+        Test filters read the bits set in the storage like SETBIT
+        """
+        bloom_filter = BloomFilter.for_capacity(100, 0.01)
+        data, changed = set_bits('', bloom_filter.positions('paris'))
+        self.assertEqual(changed, 7)
+        loaded = BloomFilter.loads(bloom_filter.params(), data)
+        self.assertIn('paris', loaded)
+        self.assertNotIn('tokyo', loaded)
+        bloom_filter.add('paris')
+        self.assertEqual(bloom_filter.dumps().rstrip('\x00'),
+                         data.rstrip('\x00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
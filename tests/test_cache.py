@@ -0,0 +1,181 @@
+# -*- coding: utf8 -*-
+# test_cache.py
+# Test the feet.entities.cache module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import inspect
+import unittest
+from feet.entities.cache import LookupCache, lookup_cache
+from feet.entities.dictionary import Dictionary
+from feet.entities.registry import Registry
+
+
+class LookupCacheTests(unittest.TestCase):
+    def test_lookup_hits(self):
+        """
+        Test values are fetched once while the version is unchanged
+        """
+        cache = LookupCache(max_bytes=10000, ttl=60, version_interval=60,
+                            enabled=True)
+        fetched = []
+
+        def fetch():
+            fetched.append(1)
+            return set(['a'])
+
+        for _ in range(3):
+            self.assertEqual(cache.lookup('ns', 'key', lambda: 1, fetch),
+                             set(['a']))
+        self.assertEqual(len(fetched), 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_version_change(self):
+        """
+        Test entries are dropped when the version of the namespace changes
+        """
+        cache = LookupCache(max_bytes=10000, ttl=60, version_interval=60,
+                            enabled=True)
+        versions = [1]
+        cache.lookup('ns', 'key', lambda: versions[0], lambda: 'old')
+        versions[0] = 2
+        # The version is only re-read after version_interval or invalidate
+        self.assertEqual(
+            cache.lookup('ns', 'key', lambda: versions[0], lambda: 'new'),
+            'old')
+        cache.invalidate('ns')
+        self.assertEqual(
+            cache.lookup('ns', 'key', lambda: versions[0], lambda: 'new'),
+            'new')
+
+    def test_ttl(self):
+        """
+        Test expired entries are fetched again
+        """
+        cache = LookupCache(max_bytes=10000, ttl=0, version_interval=60,
+                            enabled=True)
+        cache.lookup('ns', 'key', lambda: 1, lambda: 'old')
+        self.assertEqual(cache.lookup('ns', 'key', lambda: 1, lambda: 'new'),
+                         'new')
+
+    def test_memory_budget(self):
+        """
+        Test least recently used entries are evicted over the budget
+        """
+        cache = LookupCache(max_bytes=2000, ttl=60, version_interval=60,
+                            enabled=True)
+        for idx in range(50):
+            cache.lookup('ns', idx, lambda: 1, lambda: 'x' * 100)
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 2000)
+        self.assertGreater(stats['evictions'], 0)
+        self.assertEqual(cache.lookup('ns', 49, lambda: 1, lambda: 'new'),
+                         'x' * 100)
+        self.assertEqual(cache.lookup('ns', 0, lambda: 1, lambda: 'new'),
+                         'new')
+
+    def test_disabled(self):
+        """
+        Test a disabled cache always fetches
+        """
+        cache = LookupCache(enabled=False)
+        cache.lookup('ns', 'key', lambda: 1, lambda: 'old')
+        self.assertEqual(cache.lookup('ns', 'key', lambda: 1, lambda: 'new'),
+                         'new')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+class CachedDictionaryTests(unittest.TestCase):
+    def setUp(self):
+        self._enabled = lookup_cache.enabled
+        lookup_cache.enabled = True
+        lookup_cache.clear()
+
+    def tearDown(self):
+        Registry.flush('CachedDictionaryTests')
+        lookup_cache.enabled = self._enabled
+
+    def test_cached_lookups(self):
+        """
+        Test repeated lookups are served from the cache
+        """
+        dictionary = Dictionary(inspect.stack()[0][3],
+                                key_prefix='CachedDictionaryTests')
+        dictionary.load_list(['New York', 'York'], 'en')
+        self.assertEqual(dictionary.candidates('york', 'en'),
+                         set(['new york', 'york']))
+        self.assertEqual(dictionary.candidates('york', 'en'),
+                         set(['new york', 'york']))
+        self.assertTrue(dictionary.exact_match('new york', 'en'))
+        self.assertGreater(lookup_cache.stats()['hits'], 0)
+
+    def test_cached_many_lookups(self):
+        """
+        Test lookups of many keys share the cache of single lookups
+        """
+        dictionary = Dictionary(inspect.stack()[0][3],
+                                key_prefix='CachedDictionaryTests')
+        dictionary.load_list(['New York', 'York'], 'en')
+        self.assertEqual(dictionary.candidates('york', 'en'),
+                         set(['new york', 'york']))
+        hits = lookup_cache.stats()['hits']
+        self.assertEqual(dictionary.candidates_many(['York', 'new', 'Paris'],
+                                                    'en'),
+                         [set(['new york', 'york']), set(['new york']),
+                          set()])
+        self.assertEqual(lookup_cache.stats()['hits'], hits + 1)
+        self.assertEqual(dictionary.candidates('paris', 'en'), set())
+        self.assertEqual(lookup_cache.stats()['hits'], hits + 2)
+        self.assertEqual(dictionary.tokens_many(['new york', 'Paris'], 'en'),
+                         [dictionary.tokens('New York', 'en'), []])
+
+    def test_invalidation_on_write(self):
+        """
+        Test added and deleted terms are visible through the cache
+        """
+        dictionary = Dictionary(inspect.stack()[0][3],
+                                key_prefix='CachedDictionaryTests')
+        dictionary.load_list(['York'], 'en')
+        self.assertEqual(dictionary.candidates('york', 'en'), set(['york']))
+        self.assertFalse(dictionary.exact_match('new york', 'en'))
+        dictionary.add_term('New York', 'en')
+        self.assertEqual(dictionary.candidates('york', 'en'),
+                         set(['new york', 'york']))
+        self.assertTrue(dictionary.exact_match('new york', 'en'))
+        dictionary.delete_term('York', 'en')
+        self.assertEqual(dictionary.candidates('york', 'en'),
+                         set(['new york']))
+        dictionary.delete_language('en')
+        self.assertEqual(dictionary.candidates('york', 'en'), set())
+
+    def test_invalidation_by_version(self):
+        """
+        Test writes from another process are seen once the version changes
+        """
+        dictionary = Dictionary(inspect.stack()[0][3],
+                                key_prefix='CachedDictionaryTests',
+                                schema=1)
+        dictionary.load_list(['York'], 'en')
+        version_interval = lookup_cache.version_interval
+        lookup_cache.version_interval = 0
+        try:
+            self.assertEqual(dictionary.candidates('york', 'en'),
+                             set(['york']))
+            # Simulates a writer that does not share this process cache
+            dictionary.storage.sadd(dictionary.token_key('en', 'york'),
+                                    'new york')
+            self.assertEqual(dictionary.candidates('york', 'en'),
+                             set(['york']))
+            dictionary.storage.incr(dictionary.version_key('en'))
+            self.assertEqual(dictionary.candidates('york', 'en'),
+                             set(['new york', 'york']))
+        finally:
+            lookup_cache.version_interval = version_interval
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,16 +8,35 @@
 # Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
 
 import os
+import time
+import shutil
 import inspect
+import tempfile
 import unittest
-from feet.entities.dictionary import Dictionary, CSVDictionary
+from feet.entities import snapshot
+from feet.config import settings
+from feet.entities.bloom import BloomFilter
+from feet.entities.cache import lookup_cache
+from feet.entities.dictionary import Dictionary, CSVDictionary, \
+    LATEST_SCHEMA
 from feet.entities.registry import Registry
+from feet.entities.workers import TokenizerPool
+from feet.exceptions import RebuildError, SnapshotError, TimeoutError
+from feet.storage.metrics import collect
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 EVENTS_FILE = os.path.join(PATH, 'test_data/events_ja.txt')
 COUNTRIES_FILE = os.path.join(PATH, 'test_data/countries_en.csv')
 
 
+class Crash(object):
+    """
+    Language that kills the process looking it up
+    """
+    def __hash__(self):
+        os._exit(1)
+
+
 class DictionaryTests(unittest.TestCase):
     def setUp(self):
         pass
@@ -33,9 +52,14 @@ class DictionaryTests(unittest.TestCase):
             inspect.stack()[0][3],
             key_prefix='DictionaryTests')
         self.assertEqual(countries_db.load_list(['test', 'test2'], 'en'), 2)
+        version = countries_db.version('en')
         self.assertTrue(countries_db.delete())
         self.assertEqual(countries_db.languages(), [])
         self.assertEqual(countries_db.cardinality('en'), 0)
+        # Created again, the dictionary never reuses a version
+        self.assertGreater(countries_db.version('en'), version)
+        self.assertEqual(countries_db.load_list(['test'], 'en'), 1)
+        self.assertGreater(countries_db.version('en')[0], version[0] + 1)
 
     def test_initialize_from_csv_file(self):
         """
@@ -82,6 +106,30 @@ class DictionaryTests(unittest.TestCase):
         self.assertItemsEqual(cities_db.candidates('new', 'en'),
                               ['new york', 'new orleans'])
 
+    def test_bulk_loading_terms(self):
+        """
+        Test bulk loading writes the same keys as adding terms one by one
+        """
+        bulk_db = Dictionary(
+            inspect.stack()[0][3],
+            key_prefix='DictionaryTests')
+        single_db = Dictionary(
+            inspect.stack()[0][3] + '_single',
+            key_prefix='DictionaryTests')
+        terms = ['New York', 'Paris', 'new york', 'Tokyo', ' Paris ']
+        self.assertEqual(bulk_db.load_list(terms, 'en', batch_size=2), 3)
+        for term in terms:
+            single_db.add_term(term, 'en')
+        self.assertEqual(bulk_db.cardinality('en'), 3)
+        self.assertEqual(bulk_db.terms('en'), single_db.terms('en'))
+        for term in ['New York', 'Paris', 'Tokyo']:
+            self.assertItemsEqual(bulk_db.tokens(term, 'en'),
+                                  single_db.tokens(term, 'en'))
+        self.assertItemsEqual(bulk_db.candidates('new', 'en'),
+                              ['new york'])
+        self.assertEqual(bulk_db.load_list(['Tokyo', 'Kyoto'], 'en'), 1)
+        self.assertEqual(bulk_db.cardinality('en'), 4)
+
     def test_retrieving_terms(self):
         """
         Test retrieving list of all entities in a dictionary
@@ -128,6 +176,374 @@ class DictionaryTests(unittest.TestCase):
         self.assertItemsEqual(cities_db.terms('en'), ['Tokyo'])
         self.assertEqual(cities_db.exact_match('Paris', 'en'), 0)
 
+    def test_deleting_partially_indexed_term(self):
+        """
+        Test deleting a term cleans all its tokens even if one is missing
+        """
+        cities_db = Dictionary(
+            inspect.stack()[0][3],
+            key_prefix='DictionaryTests')
+        self.assertTrue(cities_db.add_term('New York', 'en'))
+        cities_db.storage.delete(cities_db.token_key('en', 'new'))
+        self.assertTrue(cities_db.delete_term('New York', 'en'))
+        self.assertEqual(cities_db.cardinality('en'), 0)
+        self.assertItemsEqual(cities_db.candidates('york', 'en'), [])
+        self.assertFalse(cities_db.delete_term('New York', 'en'))
+        self.assertFalse(cities_db.delete_term('New York', 'fr'))
+
+    def test_bulk_deleting_terms(self):
+        """
+        Test deleting terms by batches returns the status of each term
+        """
+        countries_db = CSVDictionary(
+            inspect.stack()[0][3],
+            key_prefix='DictionaryTests')
+        self.assertEqual(countries_db.load_file(COUNTRIES_FILE, 'en'), 249)
+        countries_db.parser.word_tokenize = None
+        terms = ['New Zealand', 'Atlantis', u'Åland Islands', 'new zealand',
+                 'Japan', 'France']
+        self.assertEqual(countries_db.delete_terms(terms, 'en',
+                                                   batch_size=4),
+                         [True, False, True, False, True, True])
+        self.assertEqual(countries_db.cardinality('en'), 245)
+        self.assertNotIn('Japan', countries_db.terms('en', count=249))
+        self.assertItemsEqual(countries_db.candidates('new', 'en'),
+                              ['new caledonia', 'papua new guinea'])
+        self.assertEqual(countries_db.candidates('islands', 'en') &
+                         set(['åland islands']), set())
+        self.assertFalse(countries_db.exact_match('France', 'en'))
+        self.assertEqual(countries_db.delete_terms(['Japan'], 'fr'), [False])
+
+    def test_parallel_loading(self):
+        """
+        Test tokenizing in worker processes loads the same dictionary
+        """
+        name = inspect.stack()[0][3]
+        serial_db = CSVDictionary(name, key_prefix='DictionaryTests')
+        parallel_db = CSVDictionary(name + '_parallel',
+                                    key_prefix='DictionaryTests')
+        self.assertEqual(serial_db.load_file(COUNTRIES_FILE, 'en',
+                                             batch_size=20), 249)
+        self.assertEqual(parallel_db.load_file(COUNTRIES_FILE, 'en',
+                                               batch_size=20, workers=3),
+                         249)
+        self.assertEqual(parallel_db.terms('en', 0, 249),
+                         serial_db.terms('en', 0, 249))
+        self.assertEqual(list(parallel_db.stored_terms('en')),
+                         list(serial_db.stored_terms('en')))
+        self.assertEqual(parallel_db.load_list(['Japan', 'Atlantis'], 'en',
+                                               workers=2), 1)
+
+    def test_lost_tokenizer(self):
+        """
+        Test a batch whose worker died stops the load
+        """
+        pool = TokenizerPool(1, timeout=1)
+        self.assertRaises(TimeoutError, list,
+                          pool.tokenize([['Japan']], Crash()))
+
+    def test_resuming_load(self):
+        """
+        Test a load that stopped continues from its checkpoint
+        """
+        countries_db = CSVDictionary(inspect.stack()[0][3],
+                                     key_prefix='DictionaryTests')
+
+        def interrupt(total, offset):
+            if total >= 100:
+                raise KeyboardInterrupt()
+
+        self.assertRaises(KeyboardInterrupt, countries_db.load_file,
+                          COUNTRIES_FILE, 'en', batch_size=50,
+                          progress=interrupt)
+        self.assertEqual(countries_db.cardinality('en'), 100)
+        offset = countries_db.checkpoint(COUNTRIES_FILE, 'en')
+        self.assertGreater(offset, 0)
+        self.assertEqual(countries_db.checkpoint(EVENTS_FILE, 'en'), 0)
+        resumed = list(countries_db.read_file(COUNTRIES_FILE, offset))
+        self.assertEqual(len(resumed), 149)
+        self.assertEqual(resumed[-1][1], os.path.getsize(COUNTRIES_FILE))
+        progress = []
+        self.assertEqual(countries_db.load_file(
+            COUNTRIES_FILE, 'en', batch_size=50, resume=True,
+            progress=lambda total, offset: progress.append(total)), 149)
+        self.assertEqual(progress, [50, 100, 149])
+        self.assertEqual(countries_db.cardinality('en'), 249)
+        self.assertEqual(countries_db.checkpoint(COUNTRIES_FILE, 'en'), 0)
+        self.assertEqual(list(countries_db.parse_file(COUNTRIES_FILE))[:2],
+                         ['Afghanistan', 'Åland Islands'])
+
+    def test_sync_terms(self):
+        """
+        Test only changed terms are written when syncing a dictionary
+        """
+        countries_db = CSVDictionary(inspect.stack()[0][3],
+                                     key_prefix='DictionaryTests')
+        self.assertEqual(countries_db.load_file(COUNTRIES_FILE, 'en'), 249)
+        terms = list(countries_db.parse_file(COUNTRIES_FILE))
+        terms.remove('Japan')
+        terms.remove('France')
+        terms += ['Atlantis', 'atlantis', 'united kingdom']
+        self.assertEqual(countries_db.sync_terms(terms, 'en', batch_size=50),
+                         (1, 2))
+        self.assertEqual(countries_db.cardinality('en'), 248)
+        self.assertFalse(countries_db.exact_match('Japan', 'en'))
+        self.assertTrue(countries_db.exact_match('Atlantis', 'en'))
+        self.assertTrue(countries_db.exact_match('United Kingdom', 'en'))
+        self.assertEqual(countries_db.sync_terms(terms, 'en'), (0, 0))
+        self.assertEqual(countries_db.sync_file(COUNTRIES_FILE, 'en'),
+                         (2, 1))
+        self.assertEqual(countries_db.cardinality('en'), 249)
+
+    def test_rebuild_file(self):
+        """
+        Test a language is rebuilt in a new generation and swapped in
+        """
+        name = inspect.stack()[0][3]
+        countries_db = CSVDictionary(name, key_prefix='DictionaryTests')
+        countries_db.load_list(['Atlantis', 'Japan'], 'en')
+        if countries_db.schema == 1:
+            self.assertRaises(RebuildError, countries_db.rebuild_file,
+                              COUNTRIES_FILE, 'en')
+            return
+        live_keys = '{}:l:en:*'.format(countries_db.key)
+        self.assertEqual(countries_db.rebuild_file(COUNTRIES_FILE, 'en'), 249)
+        self.assertEqual(countries_db.generation('en'), 1)
+        self.assertEqual(countries_db.cardinality('en'), 249)
+        self.assertFalse(countries_db.exact_match('Atlantis', 'en'))
+        self.assertTrue(countries_db.exact_match('Japan', 'en'))
+        reader = Dictionary(name, key_prefix='DictionaryTests')
+        self.assertEqual(reader.languages(), ['en'])
+        self.assertTrue(reader.exact_match('France', 'en'))
+        # Readers may still use the replaced generation
+        self.assertGreater(len(countries_db.storage.keys(live_keys)), 0)
+        self.assertEqual(countries_db.collect_garbage(), 0)
+        version_interval = settings.cache.version_interval
+        settings.cache.version_interval = 0
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertGreater(countries_db.collect_garbage(wait=True), 0)
+            self.assertEqual(countries_db.storage.keys(live_keys), [])
+            file_name = os.path.join(directory, 'countries.csv')
+            with open(file_name, 'w') as handle:
+                handle.write('name\nJapan\nFrance\n')
+            self.assertRaises(RebuildError, countries_db.rebuild_file,
+                              file_name, 'en')
+            self.assertEqual(countries_db.generation('en'), 1)
+            self.assertEqual(countries_db.cardinality('en'), 249)
+            self.assertEqual(countries_db.storage.keys(
+                '{}@2*'.format(countries_db.key)), [])
+            self.assertEqual(countries_db.rebuild_file(file_name, 'en',
+                                                       min_ratio=0), 2)
+            self.assertEqual(countries_db.generation('en'), 3)
+            self.assertEqual(countries_db.cardinality('en'), 2)
+        finally:
+            settings.cache.version_interval = version_interval
+            shutil.rmtree(directory)
+        self.assertTrue(countries_db.add_term('Atlantis', 'en'))
+        self.assertEqual(countries_db.cardinality('en'), 3)
+        self.assertEqual(sorted(countries_db.terms('en')),
+                         ['Atlantis', 'France', 'Japan'])
+        countries_db.delete()
+        self.assertEqual(countries_db.storage.keys(
+            '{}*'.format(countries_db.key)),
+            [countries_db.version_key('en')])
+
+    def test_writes_during_rebuild(self):
+        """
+        Test writes are refused while a language is rebuilt and go to the
+        new generation once it is swapped in
+        """
+        countries_db = CSVDictionary(inspect.stack()[0][3],
+                                     key_prefix='DictionaryTests')
+        countries_db.load_list(['Atlantis', 'Japan'], 'en')
+        if countries_db.schema == 1:
+            return
+        generation = countries_db.stage('en')
+        self.assertRaises(RebuildError, countries_db.add_term, 'France',
+                          'en')
+        self.assertRaises(RebuildError, countries_db.delete_term, 'Japan',
+                          'en')
+        countries_db.staged(generation).load_list(['Japan', 'France'], 'en')
+        countries_db.swap('en', generation, min_ratio=0)
+        # A writer whose cached generation is the replaced one
+        lookup_cache.set_version((countries_db.key, 'en'), (0, 0),
+                                 time.time())
+        self.assertTrue(countries_db.add_term('Italy', 'en'))
+        self.assertTrue(countries_db.delete_term('Japan', 'en'))
+        self.assertEqual(countries_db.generation('en'), generation)
+        self.assertEqual(sorted(countries_db.terms('en')),
+                         ['France', 'Italy'])
+        rebuild_lease = settings.database.rebuild_lease
+        settings.database.rebuild_lease = 0
+        try:
+            countries_db.stage('en')
+            self.assertTrue(countries_db.add_term('Spain', 'en'))
+        finally:
+            settings.database.rebuild_lease = rebuild_lease
+        countries_db.stage('en')
+        countries_db.release('en')
+        self.assertTrue(countries_db.add_term('Greece', 'en'))
+
+    def test_delete_language_during_rebuild(self):
+        """
+        Test deleting a language drops its staged generations and lease
+        """
+        countries_db = CSVDictionary(inspect.stack()[0][3],
+                                     key_prefix='DictionaryTests')
+        countries_db.load_list(['Atlantis', 'Japan'], 'en')
+        if countries_db.schema == 1:
+            return
+        generation = countries_db.stage('en')
+        countries_db.staged(generation).load_list(['Japan', 'France'], 'en')
+        self.assertTrue(countries_db.delete_language('en'))
+        for pattern in ('{}:l:*', '{}@*:l:*', '{}@*:version:*'):
+            self.assertEqual(countries_db.storage.keys(
+                pattern.format(countries_db.key)), [])
+        self.assertEqual(countries_db.staged(generation).languages(), [])
+        self.assertRaises(RebuildError, countries_db.swap, 'en', generation)
+        self.assertEqual(countries_db.generation('en'), 0)
+        self.assertTrue(countries_db.add_term('Japan', 'en'))
+        self.assertEqual(countries_db.terms('en'), ['Japan'])
+
+    def test_fuzzy_tokens(self):
+        """
+        Test misspelled tokens are found in the trigram index
+        """
+        countries_db = CSVDictionary(inspect.stack()[0][3],
+                                     key_prefix='DictionaryTests')
+        index = settings.fuzzy.index
+        settings.fuzzy.index = True
+        try:
+            countries_db.load_file(COUNTRIES_FILE, 'en')
+        finally:
+            settings.fuzzy.index = index
+        self.assertEqual(countries_db.fuzzy_tokens('Stetes', 'en'),
+                         ['states'])
+        self.assertEqual(countries_db.fuzzy_tokens('Japon', 'en'), ['japan'])
+        self.assertEqual(countries_db.fuzzy_tokens('Japon', 'en',
+                                                   max_distance=0), [])
+        self.assertEqual(countries_db.fuzzy_tokens('Xyzzy', 'en'), [])
+        self.assertTrue(countries_db.delete_term('Japan', 'en'))
+        self.assertEqual(countries_db.fuzzy_tokens('Japon', 'en'), [])
+        self.assertGreater(countries_db.build_trigram_index('en'), 0)
+        self.assertEqual(countries_db.fuzzy_tokens('Germny', 'en'),
+                         ['germany'])
+        unindexed_db = CSVDictionary(inspect.stack()[0][3] + '_unindexed',
+                                     key_prefix='DictionaryTests')
+        unindexed_db.load_file(COUNTRIES_FILE, 'en')
+        self.assertEqual(unindexed_db.fuzzy_tokens('Germny', 'en'), [])
+        unindexed_db.compact('en', trigrams=True)
+        self.assertEqual(unindexed_db.fuzzy_tokens('Germny', 'en'),
+                         ['germany'])
+
+    def test_bloom_filter(self):
+        """
+        Test tokens missing from the Bloom filter are not looked up
+        """
+        countries_db = CSVDictionary(inspect.stack()[0][3],
+                                     key_prefix='DictionaryTests')
+        enabled, capacity = settings.bloom.enabled, settings.bloom.capacity
+        settings.bloom.enabled, settings.bloom.capacity = True, 10
+        try:
+            countries_db.load_file(COUNTRIES_FILE, 'en', batch_size=100)
+            bloom_filter = countries_db.bloom_filter('en')
+            self.assertIn('japan', bloom_filter)
+            self.assertIn('states', bloom_filter)
+            self.assertEqual(bloom_filter.bits,
+                             BloomFilter.for_capacity(
+                                 2 * 323, settings.bloom.error_rate).bits)
+            with collect() as commands:
+                self.assertEqual(countries_db.candidates('yesterday', 'en'),
+                                 set())
+            self.assertEqual(commands.calls('SMEMBERS'), 0)
+            self.assertItemsEqual(countries_db.candidates('new', 'en'),
+                                  ['new caledonia', 'new zealand',
+                                   'papua new guinea'])
+            self.assertTrue(countries_db.add_term('Atlantis', 'en'))
+            self.assertEqual(countries_db.candidates('atlantis', 'en'),
+                             set(['atlantis']))
+            self.assertEqual(countries_db.delete_terms(['Japan', 'Atlantis'],
+                                                       'en'), [True, True])
+            self.assertIn('japan', countries_db.bloom_filter('en'))
+            self.assertEqual(countries_db.build_bloom_filter('en'), 322)
+            self.assertNotIn('japan', countries_db.bloom_filter('en'))
+            # A writer holding the parameters of the replaced filter
+            writer = CSVDictionary(inspect.stack()[0][3],
+                                   key_prefix='DictionaryTests')
+            self.assertTrue(writer.add_term('Atlantis', 'en'))
+            settings.bloom.capacity = 1000
+            countries_db.build_bloom_filter('en')
+            self.assertTrue(writer.add_term('Japan', 'en'))
+            bloom_filter = countries_db.bloom_filter('en')
+            self.assertEqual(bloom_filter.bits, BloomFilter.for_capacity(
+                1000, settings.bloom.error_rate).bits)
+            self.assertIn('japan', bloom_filter)
+        finally:
+            settings.bloom.enabled = enabled
+            settings.bloom.capacity = capacity
+
+    def test_empty_bloom_filter(self):
+        """
+        Test a language gets an empty Bloom filter only while it has no
+        terms
+        """
+        cities_db = Dictionary(inspect.stack()[0][3],
+                               key_prefix='DictionaryTests')
+        cities_db.load_list(['Paris'], 'fr')
+        enabled = settings.bloom.enabled
+        settings.bloom.enabled = True
+        try:
+            with collect() as commands:
+                self.assertTrue(cities_db.add_term('Tokyo', 'en'))
+            self.assertEqual(commands.calls('HGET'), 0)
+            bloom_filter = cities_db.bloom_filter('en')
+            self.assertEqual(bloom_filter.bits, BloomFilter.for_capacity(
+                settings.bloom.capacity, settings.bloom.error_rate).bits)
+            self.assertIn('tokyo', bloom_filter)
+            self.assertTrue(cities_db.add_term('Lyon', 'fr'))
+            self.assertIsNone(cities_db.bloom_filter('fr'))
+            self.assertEqual(cities_db.compact('fr'), 2)
+            self.assertIn('lyon', cities_db.bloom_filter('fr'))
+        finally:
+            settings.bloom.enabled = enabled
+
+    def test_bloom_filter_during_writes(self):
+        """
+        Test a Bloom filter built while terms are added keeps their bits
+        """
+        name = inspect.stack()[0][3]
+        cities_db = Dictionary(name, key_prefix='DictionaryTests')
+        writer = Dictionary(name, key_prefix='DictionaryTests')
+        if not cities_db.storage.scripting:
+            # Local storages hold their lock for the whole build
+            return
+        enabled = settings.bloom.enabled
+        settings.bloom.enabled = True
+        try:
+            cities_db.load_list(['Paris', 'Tokyo'], 'en')
+            read_bloom_filter = cities_db._read_bloom_filter
+            added = []
+
+            def read_during_writes(lang, batch_size=None):
+                result = read_bloom_filter(lang, batch_size)
+                added.append('City {}'.format(len(added)))
+                writer.add_term(added[-1], 'en')
+                return result
+
+            cities_db._read_bloom_filter = read_during_writes
+            # The last attempt merges the bits of City 2
+            self.assertEqual(cities_db.build_bloom_filter('en'), 5)
+            self.assertEqual(len(added), 3)
+            bloom_filter = cities_db.bloom_filter('en')
+            self.assertIn('city', bloom_filter)
+            for term in ['paris', 'tokyo', '0', '1', '2']:
+                self.assertIn(term, bloom_filter)
+            self.assertEqual(cities_db.candidates('city', 'en'),
+                             set(['city 0', 'city 1', 'city 2']))
+        finally:
+            settings.bloom.enabled = enabled
+
     def test_paging_terms(self):
         """
         Test retrieving list of all entities in a dictionary
@@ -138,13 +554,231 @@ class DictionaryTests(unittest.TestCase):
         self.assertEqual(countries_db.load_file(COUNTRIES_FILE, 'en'), 249)
         self.assertTrue('en' in countries_db.languages())
         self.assertEqual(countries_db.cardinality('en'), 249)
-        self.assertItemsEqual(countries_db.terms('en', 0, 5),
-                              ['Afghanistan', 'Åland Islands',
-                               'Albania', 'Algeria', 'American Samoa'])
-        self.assertItemsEqual(countries_db.terms('en', 1, 5),
-                              ['Andorra', 'Angola',
-                               'Anguilla', 'Antarctica',
-                               'Antigua and Barbuda'])
+        if countries_db.schema < 3:
+            self.assertItemsEqual(countries_db.terms('en', 0, 5),
+                                  ['Afghanistan', 'Åland Islands',
+                                   'Albania', 'Algeria', 'American Samoa'])
+            self.assertItemsEqual(countries_db.terms('en', 1, 5),
+                                  ['Andorra', 'Angola',
+                                   'Anguilla', 'Antarctica',
+                                   'Antigua and Barbuda'])
+        else:
+            self.assertEqual(countries_db.terms('en', 0, 5),
+                             ['Afghanistan', 'Albania', 'Algeria',
+                              'American Samoa', 'Andorra'])
+            self.assertEqual(countries_db.terms('en', 1, 5),
+                             ['Angola', 'Anguilla', 'Antarctica',
+                              'Antigua and Barbuda', 'Argentina'])
+
+    def test_cursor_paging_terms(self):
+        """
+        Test walking all terms of a dictionary with a cursor
+        """
+        countries_db = CSVDictionary(
+            inspect.stack()[0][3],
+            key_prefix='DictionaryTests')
+        self.assertEqual(countries_db.load_file(COUNTRIES_FILE, 'en'), 249)
+        terms, cursor = countries_db.terms_page('en', count=5)
+        self.assertEqual(len(terms), 5)
+        while cursor is not None:
+            page, cursor = countries_db.terms_page('en', cursor, 50)
+            terms.extend(page)
+        self.assertEqual(len(terms), 249)
+        self.assertItemsEqual(terms, countries_db.terms('en', 0, 249))
+        if countries_db.schema >= 2:
+            self.assertEqual(countries_db.terms_page('fr'), ([], None))
+
+    def test_migrating_from_schema_v1(self):
+        """
+        Test a schema v1 dictionary is converted to the latest schema
+        """
+        name = inspect.stack()[0][3]
+        legacy_db = CSVDictionary(name, key_prefix='DictionaryTests',
+                                  schema=1)
+        self.assertEqual(legacy_db.load_file(COUNTRIES_FILE, 'en'), 249)
+        self.assertEqual(legacy_db.load_list(['New York', 'Lyon'], 'fr'), 2)
+        countries_db = CSVDictionary(name, key_prefix='DictionaryTests')
+        self.assertEqual(countries_db.schema, 1)
+        keys_before, _ = countries_db.memory_usage()
+        version_interval = settings.cache.version_interval
+        settings.cache.version_interval = 0
+        try:
+            self.assertEqual(countries_db.migrate(batch_size=100,
+                                                  wait=True), 251)
+        finally:
+            settings.cache.version_interval = version_interval
+        self.assertEqual(countries_db.schema, LATEST_SCHEMA)
+        self.assertLess(countries_db.memory_usage()[0], keys_before)
+        self.assertEqual(countries_db.storage.keys(
+            '{}:lang:*'.format(countries_db.key)), [])
+        self.assertItemsEqual(countries_db.languages(), ['en', 'fr'])
+        self.assertEqual(countries_db.cardinality('en'), 249)
+        self.assertItemsEqual(countries_db.terms('fr'), ['New York', 'Lyon'])
+        self.assertItemsEqual(countries_db.candidates('new', 'en'),
+                              ['new caledonia', 'new zealand',
+                               'papua new guinea'])
+        self.assertItemsEqual(countries_db.tokens('united states', 'en'),
+                              ['United', 'States'])
+        self.assertTrue(countries_db.exact_match('Japan', 'en'))
+        self.assertTrue(countries_db.add_term('New York', 'en'))
+        self.assertTrue(countries_db.delete_term('New Zealand', 'en'))
+        self.assertItemsEqual(countries_db.candidates('new', 'en'),
+                              ['new caledonia', 'new york',
+                               'papua new guinea'])
+        self.assertEqual(countries_db.migrate(), 0)
+
+    def test_migrating_from_schema_v2(self):
+        """
+        Test the terms list of a schema v2 dictionary is moved to the
+        lexicographic index
+        """
+        name = inspect.stack()[0][3]
+        legacy_db = CSVDictionary(name, key_prefix='DictionaryTests',
+                                  schema=2)
+        self.assertEqual(legacy_db.load_file(COUNTRIES_FILE, 'en'), 249)
+        countries_db = CSVDictionary(name, key_prefix='DictionaryTests')
+        self.assertEqual(countries_db.schema, 2)
+        self.assertEqual(countries_db.migrate(batch_size=100), 249)
+        self.assertEqual(countries_db.schema, 3)
+        # The list is kept until running processes use the new schema
+        self.assertEqual(countries_db.storage.exists(
+            '{}:l:en:t'.format(countries_db.key)), 1)
+        self.assertEqual(countries_db.migrate(batch_size=100), 0)
+        self.assertEqual(countries_db.migrate(wait=True), 0)
+        self.assertEqual(countries_db.storage.exists(
+            '{}:l:en:t'.format(countries_db.key)), 0)
+        self.assertEqual(countries_db.cardinality('en'), 249)
+        self.assertEqual(countries_db.terms('en', 0, 2),
+                         ['Afghanistan', 'Albania'])
+        self.assertTrue(countries_db.delete_term('Albania', 'en'))
+        self.assertEqual(countries_db.terms('en', 0, 2),
+                         ['Afghanistan', 'Algeria'])
+        self.assertEqual(countries_db.migrate(), 0)
+
+    def test_snapshot(self):
+        """
+        Test a dictionary is exported and imported without tokenizing
+        """
+        name = inspect.stack()[0][3]
+        countries_db = CSVDictionary(name, key_prefix='DictionaryTests')
+        countries_db.load_file(COUNTRIES_FILE, 'en')
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'countries.snap')
+            self.assertEqual(countries_db.export_snapshot(file_name, 'en',
+                                                          batch_size=100),
+                             249)
+            restored_db = Dictionary(name + '_restored',
+                                     key_prefix='DictionaryTests')
+            restored_db.parser.word_tokenize = None
+            self.assertEqual(restored_db.import_snapshot(file_name,
+                                                         batch_size=100),
+                             249)
+            self.assertRaises(SnapshotError, restored_db.import_snapshot,
+                              COUNTRIES_FILE)
+            handles = []
+
+            def gzip_open(*args):
+                handles.append(open_gzip(*args))
+                return handles[-1]
+            open_gzip, snapshot.gzip.open = snapshot.gzip.open, gzip_open
+            try:
+                self.assertRaises(SnapshotError, snapshot.SnapshotReader,
+                                  COUNTRIES_FILE)
+            finally:
+                snapshot.gzip.open = open_gzip
+            self.assertIsNone(handles[0].fileobj)
+
+            def failing_terms(lang, batch_size=None):
+                yield 'Japan', ['Japan']
+                raise IOError('connection lost')
+            countries_db.stored_terms = failing_terms
+            self.assertRaises(IOError, countries_db.export_snapshot,
+                              os.path.join(directory, 'failed.snap'), 'en')
+            self.assertEqual(os.listdir(directory), ['countries.snap'])
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(restored_db.languages(), ['en'])
+        self.assertEqual(restored_db.cardinality('en'), 249)
+        self.assertEqual(restored_db.terms('en', count=249),
+                         countries_db.terms('en', count=249))
+        self.assertItemsEqual(restored_db.candidates('new', 'en'),
+                              ['new caledonia', 'new zealand',
+                               'papua new guinea'])
+        self.assertItemsEqual(restored_db.tokens('united states', 'en'),
+                              ['United', 'States'])
+
+
+class SchemaV1DictionaryTests(DictionaryTests):
+    """
+    Runs the dictionary tests against the schema v1 key layout
+    """
+    def setUp(self):
+        self._schema = settings.database.schema
+        settings.database.schema = 1
+
+    def tearDown(self):
+        super(SchemaV1DictionaryTests, self).tearDown()
+        settings.database.schema = self._schema
+
+
+class SchemaV2DictionaryTests(DictionaryTests):
+    """
+    Runs the dictionary tests against the schema v2 key layout
+    """
+    def setUp(self):
+        self._schema = settings.database.schema
+        settings.database.schema = 2
+
+    def tearDown(self):
+        super(SchemaV2DictionaryTests, self).tearDown()
+        settings.database.schema = self._schema
+
+
+class MemoryDictionaryTests(DictionaryTests):
+    """
+    Runs the dictionary tests against the in-process memory backend
+    """
+    def setUp(self):
+        self._backend = settings.database.backend
+        settings.database.backend = 'memory'
+
+    def tearDown(self):
+        super(MemoryDictionaryTests, self).tearDown()
+        settings.database.backend = self._backend
+
+
+class MemorySchemaV1DictionaryTests(MemoryDictionaryTests):
+    """
+    Runs the dictionary tests against the memory backend and schema v1
+    """
+    def setUp(self):
+        super(MemorySchemaV1DictionaryTests, self).setUp()
+        self._schema = settings.database.schema
+        settings.database.schema = 1
+
+    def tearDown(self):
+        super(MemorySchemaV1DictionaryTests, self).tearDown()
+        settings.database.schema = self._schema
+
+
+class SQLiteDictionaryTests(DictionaryTests):
+    """
+    Runs the dictionary tests against the embedded SQLite backend
+    """
+    def setUp(self):
+        self._backend = settings.database.backend
+        self._path = settings.database.sqlite_path
+        self.directory = tempfile.mkdtemp()
+        settings.database.backend = 'sqlite'
+        settings.database.sqlite_path = os.path.join(self.directory,
+                                                     'feet.sqlite')
+
+    def tearDown(self):
+        super(SQLiteDictionaryTests, self).tearDown()
+        settings.database.backend = self._backend
+        settings.database.sqlite_path = self._path
+        shutil.rmtree(self.directory)
 
 
 if __name__ == '__main__':
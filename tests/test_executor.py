@@ -0,0 +1,135 @@
+# -*- coding: utf8 -*-
+# test_executor.py
+# Test the feet.entities.executor module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import os
+import time
+import pickle
+import unittest
+import threading
+import inspect
+from feet.entities.executor import ExtractionPool
+from feet.entities.extractor import Extractor
+from feet.entities.dictionary import CSVDictionary, batches
+from feet.entities.registry import Registry
+from feet.exceptions import ExtractionError
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+EVENTS_FILE = os.path.join(PATH, 'test_data/events_ja.txt')
+
+
+class Crash(object):
+    """
+    Language that kills the process comparing it
+    """
+    def __eq__(self, other):
+        os._exit(1)
+
+
+class Slow(object):
+    """
+    Language that takes a while to compare, once
+    """
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __eq__(self, other):
+        time.sleep(self.delay)
+        self.delay = 0
+        return False
+
+
+class ExecutorTests(unittest.TestCase):
+    def tearDown(self):
+        Registry.flush('ExecutorTests')
+
+    def test_pickled_dictionary(self):
+        """
+        Test dictionaries are pickled by name
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           dict_class=CSVDictionary,
+                                           key_prefix='ExecutorTests')
+        countries = registry.get_dict('countries')
+        countries.add_terms(['Japan'], 'en')
+        copy = pickle.loads(pickle.dumps(countries))
+        self.assertIsInstance(copy, CSVDictionary)
+        self.assertEqual(copy.key, countries.key)
+        self.assertEqual(copy.terms('en'), ['Japan'])
+
+    def test_extract(self):
+        """
+        Test workers extract what the process extracts, in order
+        """
+        texts = [u'6月2日より3階「TOMMY HILFIGER」がリニューアルオープン！',
+                 u'明日は雨です',
+                 u'3階Plaza Southがリニューアルオープン！']
+        texts = [text.encode('utf8') for text in texts]
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           key_prefix='ExecutorTests')
+        events = registry.get_dict('events')
+        events.load_file(EVENTS_FILE, 'ja')
+        with ExtractionPool(2, max_tasks_per_child=1) as pool:
+            outputs = list(pool.extract(events, batches(texts, 1), 'ja'))
+            self.assertEqual(pool.stats(),
+                             {'workers': 2, 'submitted': 3, 'completed': 3,
+                              'failed': 0, 'expired': 0, 'lost': 0,
+                              'pending': 0,
+                              'max_pending': pool.stats()['max_pending']})
+        self.assertEqual(outputs,
+                         Extractor(events).extract_many(texts, 'ja')[0])
+
+    def test_failed_extraction(self):
+        """
+        Test errors of workers are raised by futures
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           key_prefix='ExecutorTests')
+        events = registry.get_dict('events')
+        with ExtractionPool(1) as pool:
+            future = pool.submit(events, ['Japan'], 'en', mode='regex')
+            self.assertRaises(ExtractionError, future.result, 30)
+            self.assertEqual(pool.stats()['failed'], 1)
+            self.assertEqual(pool.stats()['pending'], 0)
+
+    def test_lost_tasks(self):
+        """
+        Test tasks that are never called back fail
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           key_prefix='ExecutorTests')
+        events = registry.get_dict('events')
+        with ExtractionPool(1, timeout=1) as pool:
+            future = pool.submit(events, [threading.Lock()], 'en')
+            self.assertRaises(ExtractionError, future.result, 30)
+            future = pool.submit(events, ['Japan'], Crash())
+            self.assertRaises(ExtractionError, future.result, 30)
+            self.assertEqual(pool.stats()['failed'], 2)
+            self.assertEqual(pool.stats()['lost'], 1)
+            self.assertEqual(pool.stats()['pending'], 0)
+
+    def test_expired_tasks(self):
+        """
+        Test tasks queued for too long fail without being lost
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           key_prefix='ExecutorTests')
+        events = registry.get_dict('events')
+        with ExtractionPool(1, timeout=2) as pool:
+            busy = [pool.submit(events, ['Japan'], Slow(1.5))
+                    for _ in range(2)]
+            future = pool.submit(events, ['Japan'], 'en', mode='gazetteer')
+            self.assertRaises(ExtractionError, future.result, 30)
+            for other in busy:
+                other.exception(30)
+            self.assertEqual(pool.stats()['expired'], 1)
+            self.assertEqual(pool.stats()['lost'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,9 +10,11 @@
 import os
 import unittest
 import inspect
+from tornado.ioloop import IOLoop
 from feet.entities.extractor import Extractor
 from feet.entities.dictionary import CSVDictionary
 from feet.entities.registry import Registry
+from feet.storage.metrics import collect
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 EVENTS_FILE = os.path.join(PATH, 'test_data/events_ja.txt')
@@ -46,6 +48,108 @@ class ExtractorTests(unittest.TestCase):
                 terms = list(set(terms).union(element['entity_candidates']))
         self.assertIn('Japan', terms)
 
+    def test_best_choice_case(self):
+        """
+        Test candidate tokens are compared case insensitively
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           dict_class=CSVDictionary,
+                                           key_prefix='ExtractorTests')
+        engine = Extractor(registry.get_dict('countries'))
+        self.assertTrue(engine.is_best_choice(['the', 'United', 'States'],
+                                              ['united', 'states']))
+        self.assertFalse(engine.is_best_choice(['United', 'Kingdom'],
+                                               ['united', 'states']))
+
+    def test_fuzzy_lookup(self):
+        """
+        Test chunks with a misspelled token are looked up again
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           dict_class=CSVDictionary,
+                                           key_prefix='ExtractorTests')
+        countries = registry.get_dict('countries')
+        countries.load_file(COUNTRIES_FILE, 'en')
+        countries.build_trigram_index('en')
+        self.assertEqual(Extractor(countries).lookup('Unitd States', 'en'),
+                         ([], ['States']))
+        engine = Extractor(countries, fuzzy=True)
+        self.assertEqual(engine.lookup('Unitd States', 'en'),
+                         (['united states'], []))
+        self.assertEqual(engine.lookup('Japan', 'en'), (set(['Japan']), []))
+        self.assertEqual(IOLoop.current().run_sync(
+            lambda: engine.lookup_async('Unitd States', 'en')),
+            (['united states'], []))
+        # Misspelled chunks are corrected together
+        chunks = ['Unitd States', 'Japon', 'Germny', 'Japan', 'Xyzzy']
+        with collect() as commands:
+            lookups = engine.lookup_many(chunks[:1], 'en')
+        round_trips = commands.round_trips()
+        with collect() as commands:
+            lookups = engine.lookup_many(chunks, 'en')
+        self.assertEqual(commands.round_trips(), round_trips)
+        for chunk in chunks:
+            entities, not_entity = engine.lookup(chunk, 'en')
+            self.assertEqual(sorted(lookups[chunk][0]), sorted(entities))
+            self.assertEqual(lookups[chunk][1], not_entity)
+        self.assertEqual(sorted(lookups['Germny'][0]), ['germany'])
+
+    def test_lookup_many(self):
+        """
+        Test chunks looked up together are described like single lookups
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           dict_class=CSVDictionary,
+                                           key_prefix='ExtractorTests')
+        countries = registry.get_dict('countries')
+        countries.load_file(COUNTRIES_FILE, 'en')
+        engine = Extractor(countries)
+        chunks = ['Japan', 'United States', 'Korea', 'Unitd States',
+                  'New Guinea', 'Atlantis']
+        # Reads the generation of the language
+        countries.lang_key('en')
+        with collect() as commands:
+            lookups = engine.lookup_many(chunks, 'en')
+        # Exact matches with token sets, names of term ids, tokens of names
+        self.assertEqual(commands.round_trips(), 3)
+        self.assertEqual(sorted(lookups.keys()), sorted(chunks))
+        for chunk in chunks:
+            entities, not_entity = engine.lookup(chunk, 'en')
+            self.assertEqual(sorted(lookups[chunk][0]), sorted(entities))
+            self.assertEqual(lookups[chunk][1], not_entity)
+        self.assertEqual(engine.lookup_many([], 'en'), {})
+        # Round trips do not grow with the number of chunks
+        chunks = chunks * 3 + ['France', 'South Korea', 'Papua New Guinea']
+        with collect() as commands:
+            output = engine.lookup_chunks(chunks, 'en')
+        self.assertEqual(commands.round_trips(), 3)
+        self.assertEqual(output, [entry for entry in [
+            engine.output_entry(idx, chunk, *engine.lookup(chunk, 'en'))
+            for idx, chunk in enumerate(chunks)] if entry is not None])
+
+    def test_extract_many_jp(self):
+        """
+        Test extracting entities from many texts in Japanese at once
+        """
+        texts = [u'6月2日より3階「TOMMY HILFIGER」がリニューアルオープン！',
+                 u'明日は雨です',
+                 u'3階Plaza Southがリニューアルオープン！']
+        texts = [text.encode('utf8') for text in texts]
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           key_prefix='ExtractorTests')
+        events = registry.get_dict('events')
+        events.load_file(EVENTS_FILE, 'ja')
+        engine = Extractor(events)
+        outputs, timer = engine.extract_many(texts, 'ja')
+        self.assertEqual(len(outputs), 3)
+        self.assertEqual(outputs, [engine.extract(text, 'ja')[0]
+                                   for text in texts])
+        self.assertEqual([element['entity_candidates'] for element
+                          in outputs[0]], [['リニューアルオープン']])
+        self.assertEqual(outputs[1], [])
+        self.assertGreater(timer.commands.round_trips(), 0)
+        self.assertEqual(engine.extract_many([], 'ja')[0], [])
+
     def test_extract_document(self):
         """
         Test extracting cities from a Wikipedia article that describes the UN.
@@ -87,6 +191,57 @@ class ExtractorTests(unittest.TestCase):
                 terms = list(set(terms).union(element['entity_candidates']))
         self.assertIn('リニューアルオープン', terms)
 
+    def test_gazetteer_document(self):
+        """
+        Test matching cities in a Wikipedia article without POS tagging
+        """
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           dict_class=CSVDictionary,
+                                           key_prefix='ExtractorTests')
+        cities = registry.get_dict('cities')
+        cities.load_file(CITIES_FILE, 'en')
+        text = open(ENGLISH_TEXT).read()
+        engine = Extractor(cities, mode='gazetteer')
+        results = engine.extract(text, 'en')
+        terms = set()
+        for element in results[0]:
+            self.assertEqual(element['entity_found'], 1)
+            self.assertIn(' '.join(element['chunk'].lower().split()),
+                          [term.lower() for term
+                           in element['entity_candidates']])
+            terms.update(element['entity_candidates'])
+        self.assertIn('Nairobi', terms)
+        self.assertIn('New York City', terms)
+        cities.add_term('United Nations', 'en')
+        results = engine.extract(text, 'en')
+        self.assertIn('United Nations', [element['entity_candidates'][0]
+                                         for element in results[0]])
+        self.assertRaises(ValueError, Extractor, cities, mode='regex')
+        self.assertRaises(ValueError, engine.extract, text)
+        self.assertRaises(ValueError, engine.extract_many, [text])
+        outputs, _ = engine.extract_many([text, 'Nairobi', ''], 'en')
+        self.assertEqual(outputs[0], engine.extract(text, 'en')[0])
+        self.assertEqual([element['entity_candidates'] for element
+                          in outputs[1]], [['Nairobi']])
+        self.assertEqual(outputs[2], [])
+
+    def test_gazetteer_jp_sentence(self):
+        """
+        Test matching entities character by character in Japanese
+        """
+        test_sentence_jp = u'[TOMMY HILFIGER]3階「TOMMY HILFIGER」\
+リニューアルオープン！ 6月2日より3階Plaza South「TOMMY HILFIGER」\
+がリニューアルオープン！ https://t.co/Nf3GTF0OQD #Lazona'
+        registry = Registry.find_or_create(inspect.stack()[0][3],
+                                           key_prefix='ExtractorTests')
+        events = registry.get_dict('events')
+        events.load_file(EVENTS_FILE, 'ja')
+        engine = Extractor(events, mode='gazetteer')
+        results = engine.extract(test_sentence_jp.encode('utf8'), 'ja')
+        chunks = [element['chunk'] for element in results[0]]
+        self.assertEqual(chunks.count('リニューアルオープン'), 2)
+        self.assertNotIn('リニューアル', chunks)
+
 
 if __name__ == '__main__':
     unittest.main()
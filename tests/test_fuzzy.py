@@ -0,0 +1,44 @@
+# -*- coding: utf8 -*-
+# test_fuzzy.py
+# Test the feet.entities.fuzzy module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import unittest
+from feet.entities.fuzzy import trigrams, similarity, edit_distance
+
+
+class FuzzyTests(unittest.TestCase):
+    def test_trigrams(self):
+        """
+        Test tokens are lowercased and padded before splitting
+        """
+        self.assertEqual(trigrams('Ab'), set(['  a', ' ab', 'ab ']))
+        self.assertEqual(trigrams('É'), set(['  é', ' é ']))
+        self.assertEqual(len(trigrams('States')), 7)
+
+    def test_similarity(self):
+        """
+        Test the Jaccard similarity of trigram sets
+        """
+        self.assertEqual(similarity(trigrams('paris'), trigrams('Paris')),
+                         1.0)
+        self.assertEqual(similarity(trigrams('ab'), trigrams('xy')), 0.0)
+        self.assertAlmostEqual(similarity(trigrams('states'),
+                                          trigrams('stetes')), 0.4)
+
+    def test_edit_distance(self):
+        """
+        Test the distance is bounded
+        """
+        self.assertEqual(edit_distance('kitten', 'sitting', 3), 3)
+        self.assertEqual(edit_distance('kitten', 'sitting', 1), 2)
+        self.assertEqual(edit_distance('Japan', 'japan', 1), 0)
+        self.assertEqual(edit_distance('a', 'abcd', 2), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
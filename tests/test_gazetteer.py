@@ -0,0 +1,59 @@
+# -*- coding: utf8 -*-
+# test_gazetteer.py
+# Test the feet.entities.gazetteer module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import unittest
+from feet.entities.gazetteer import Automaton, Gazetteer, normalize
+
+
+class GazetteerTests(unittest.TestCase):
+    def test_normalize(self):
+        """
+        Test texts are lowercased, NFKC normalized and whitespace collapsed
+        """
+        normalized, offsets = normalize(u' New\t\tＹＯＲＫ  ')
+        self.assertEqual(normalized, u'new york')
+        self.assertEqual(offsets, [1, 2, 3, 4, 6, 7, 8, 9])
+
+    def test_automaton(self):
+        """
+        Test every occurrence of every key is found
+        """
+        automaton = Automaton()
+        for key in [u'he', u'she', u'his', u'hers']:
+            automaton.add(key, key)
+        automaton.build()
+        self.assertEqual(len(automaton), 4)
+        self.assertEqual(sorted(automaton.iter(u'ushers')),
+                         [(1, 4, u'she'), (2, 4, u'he'), (2, 6, u'hers')])
+
+    def test_matches(self):
+        """
+        Test matches are leftmost-longest on word boundaries
+        """
+        gazetteer = Gazetteer(['York', 'New York', 'New York City', 'Nice',
+                               'Niceland', u'NICE'], 'en')
+        self.assertEqual(len(gazetteer), 5)
+        self.assertEqual(gazetteer.matches('From new  YORK to Nice, '
+                                           'not to Nicer York.'),
+                         [('new  YORK', ['New York']),
+                          ('Nice', ['Nice', 'NICE']), ('York', ['York'])])
+
+    def test_character_matches(self):
+        """
+        Test languages without spaces are matched inside words
+        """
+        terms = [u'東京', u'東京タワー']
+        text = u'東京タワーと東京駅'.encode('utf8')
+        self.assertEqual(Gazetteer(terms, 'ja').matches(text),
+                         [('東京タワー', ['東京タワー']), ('東京', ['東京'])])
+        self.assertEqual(Gazetteer(terms, 'en').matches(text), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
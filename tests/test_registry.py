@@ -9,8 +9,10 @@
 
 import unittest
 import inspect
+from tornado.ioloop import IOLoop
 from feet.entities.registry import Registry
 from feet.entities.dictionary import Dictionary
+from feet.storage.metrics import collect
 
 
 class RegistryTests(unittest.TestCase):
@@ -131,6 +133,89 @@ class RegistryTests(unittest.TestCase):
         registry.get_dict('cities')
         self.assertFalse(registry.del_dict('events'))
 
+    def registry_with_dictionaries(self, name):
+        registry = Registry.find_or_create(name, key_prefix='RegistryTests')
+        registry.get_dict('cities').load_list(
+            ['Paris', 'New York', 'Tokyo', 'York'], 'en')
+        registry.get_dict('countries').load_list(
+            ['France', 'Japan', 'New Zealand'], 'en')
+        registry.get_dict('people').load_list(['Paris Hilton'], 'en')
+        return registry
+
+    def test_exact_matches(self):
+        """
+        Test exact matches of chunks in several dictionaries are read in
+        one round trip
+        """
+        registry = self.registry_with_dictionaries(inspect.stack()[0][3])
+        dictionaries = [extractor.dictionary for _, extractor
+                        in registry.extractors(['cities', 'countries'])]
+        # schemas and generations are read once and cached
+        [dictionary.lang_key('en') for dictionary in dictionaries]
+        with collect() as commands:
+            matches = registry.exact_matches(
+                dictionaries, ['paris', 'Japan', 'Kyoto'], 'en')
+        self.assertEqual(matches, [[True, False, False],
+                                   [False, True, False]])
+        self.assertEqual(commands.round_trips(), 1)
+        self.assertEqual(registry.exact_matches(dictionaries, [], 'en'),
+                         [[], []])
+
+    def test_lookup_chunks(self):
+        """
+        Test chunks are looked up in every dictionary from the same NLP
+        stage
+        """
+        registry = self.registry_with_dictionaries(inspect.stack()[0][3])
+        chunks = ['Paris', 'Japan']
+        extractors = registry.extractors()
+        self.assertEqual([name for name, _ in extractors],
+                         ['cities', 'countries', 'people'])
+        matches = registry.exact_matches(
+            [extractor.dictionary for _, extractor in extractors],
+            chunks, 'en')
+        found = dict((name, [entry['entity_candidates'] for entry
+                             in extractor.lookup_chunks(chunks, 'en', exact)
+                             if entry['entity_found'] == 1])
+                     for (name, extractor), exact in zip(extractors, matches))
+        self.assertEqual(found, {'cities': [['Paris']],
+                                 'countries': [['Japan']],
+                                 'people': []})
+
+    def test_extract_gazetteer(self):
+        """
+        Test extracting the terms of several dictionaries from a text
+        """
+        registry = self.registry_with_dictionaries(inspect.stack()[0][3])
+        text = 'Flights from Paris to New York and Tokyo in Japan'
+        output, timer = registry.extract(text, 'en', mode='gazetteer')
+        terms = dict((name, [entry['entity_candidates'][0]
+                             for entry in entries])
+                     for name, entries in output.items())
+        self.assertEqual(terms, {'cities': ['Paris', 'New York', 'Tokyo'],
+                                 'countries': ['Japan'],
+                                 'people': []})
+        output, _ = IOLoop.current().run_sync(
+            lambda: registry.extract_async(text, 'en', names=['countries'],
+                                           mode='gazetteer'))
+        self.assertEqual(output.keys(), ['countries'])
+        self.assertEqual(registry.extract(text, 'en', names=[])[0], {})
+
+    def test_extract(self):
+        """
+        Test extracting entities of several dictionaries in a single pass
+        """
+        registry = self.registry_with_dictionaries(inspect.stack()[0][3])
+        text = 'I want to buy flight tickets from Paris to Japan'
+        output, _ = registry.extract(text, 'en', names=['cities',
+                                                        'countries'])
+        found = dict((name, set(candidate for entry in entries
+                                if entry['entity_found'] == 1
+                                for candidate in entry['entity_candidates']))
+                     for name, entries in output.items())
+        self.assertEqual(found, {'cities': set(['Paris']),
+                                 'countries': set(['Japan'])})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,241 @@
+# -*- coding: utf8 -*-
+# test_replicas.py
+# Test the feet.storage.replicas module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import os
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+from distutils.spawn import find_executable
+import redis
+from feet.config import settings
+from feet.storage import Storage
+from feet.exceptions import ConfigurationError
+from feet.storage.replicas import (ReplicaSet, parse_endpoints,
+                                   parse_replicas)
+
+REDIS_SERVER = find_executable('redis-server')
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if condition():
+                return True
+        except redis.RedisError:
+            pass
+        time.sleep(0.05)
+    raise AssertionError('condition not met within {}s'.format(timeout))
+
+
+class StubReplicaSet(ReplicaSet):
+    """
+    Replica set fed with replication infos instead of servers
+    """
+    infos = {}
+
+    def info(self, client):
+        return self.infos[client]
+
+
+class ReplicaSetTests(unittest.TestCase):
+    def test_parse_endpoints(self):
+        """
+        Test replicas are configured as host:port lists
+        """
+        self.assertEqual(parse_endpoints(''), [])
+        self.assertEqual(parse_endpoints('a:1, b:2'), [('a', 1), ('b', 2)])
+        self.assertEqual(parse_endpoints(['a:1']), [('a', 1)])
+
+    def test_parse_replicas(self):
+        """
+        Test replicas are configured per primary endpoint
+        """
+        self.assertEqual(parse_replicas(''), {})
+        self.assertEqual(parse_replicas('a:1=b:1,c:1; a:2/3=b:2'),
+                         {('a', 1, None): [('b', 1), ('c', 1)],
+                          ('a', 2, 3): [('b', 2)]})
+        self.assertEqual(parse_replicas({'a:1': ['b:1']}),
+                         {('a', 1, None): [('b', 1)]})
+        with self.assertRaises(ConfigurationError):
+            parse_replicas('b:1,c:1')
+
+    def test_staleness(self):
+        """
+        Test replicas behind the tolerance are skipped
+        """
+        replica_set = StubReplicaSet('primary', ['fresh', 'late', 'down'],
+                                     max_staleness=1.0)
+        replica_set.infos = {
+            'primary': {'master_repl_offset': 100},
+            'fresh': {'master_link_status': 'up', 'slave_repl_offset': 100},
+            'late': {'master_link_status': 'up', 'slave_repl_offset': 100},
+            'down': {'master_link_status': 'down',
+                     'slave_repl_offset': 100}}
+        self.assertEqual(replica_set.check(now=10.0), ['fresh', 'late'])
+        replica_set.infos['primary'] = {'master_repl_offset': 200}
+        replica_set.infos['fresh'] = {'master_link_status': 'up',
+                                      'slave_repl_offset': 200}
+        self.assertEqual(replica_set.check(now=10.5), ['fresh', 'late'])
+        self.assertEqual(replica_set.staleness('late', 10.5), 0.5)
+        self.assertEqual(replica_set.check(now=11.5), ['fresh'])
+        self.assertEqual(replica_set.staleness('late', 11.5), 1.5)
+
+
+@unittest.skipIf(REDIS_SERVER is None, 'redis-server is not installed')
+class ReplicaRoutingTests(unittest.TestCase):
+    """
+    Runs a primary and two writable replicas as local redis-server processes
+    """
+    @classmethod
+    def start_server(klass, port, *args):
+        process = subprocess.Popen(
+            [REDIS_SERVER, '--port', str(port), '--bind', '127.0.0.1',
+             '--save', '', '--appendonly', 'no', '--dir', klass.directory] +
+            list(args), stdout=open(os.devnull, 'w'))
+        klass.processes.append(process)
+        client = redis.StrictRedis(port=port)
+        wait_for(client.ping)
+        return client
+
+    @classmethod
+    def setUpClass(klass):
+        klass.directory = tempfile.mkdtemp()
+        klass.processes = []
+        klass.primary_port = free_port()
+        klass.primary = klass.start_server(klass.primary_port)
+        klass.replica_ports = [free_port(), free_port()]
+        klass.replicas = [
+            klass.start_server(port, '--replicaof', '127.0.0.1',
+                               str(klass.primary_port),
+                               '--replica-read-only', 'no')
+            for port in klass.replica_ports]
+        for replica in klass.replicas:
+            wait_for(lambda: replica.info('replication')
+                     .get('master_link_status') == 'up')
+
+    @classmethod
+    def tearDownClass(klass):
+        for process in klass.processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(klass.directory)
+
+    def setUp(self):
+        self._replicas = settings.database.replicas
+        self._max_staleness = settings.database.max_staleness
+        settings.database.replicas = self.replicas_setting()
+        settings.database.max_staleness = 1.0
+        Storage.disconnect_all()
+        for idx, replica in enumerate(self.replicas):
+            replica.set('ReplicaRoutingTests:server', 'replica{}'.format(idx))
+
+    def tearDown(self):
+        settings.database.replicas = self._replicas
+        settings.database.max_staleness = self._max_staleness
+        Storage.disconnect_all()
+        self.primary.flushall()
+
+    def replicas_setting(self, primary=None):
+        if primary is None:
+            primary = '127.0.0.1:{}'.format(self.primary_port)
+        return '{}={}'.format(primary, ','.join(
+            '127.0.0.1:{}'.format(port) for port in self.replica_ports))
+
+    def storage(self):
+        return Storage(redis_host='127.0.0.1', redis_port=self.primary_port)
+
+    def test_round_robin_reads(self):
+        """
+        Test reads are spread over the replicas and writes hit the primary
+        """
+        storage = self.storage()
+        servers = [storage.get('ReplicaRoutingTests:server')
+                   for _ in range(4)]
+        self.assertItemsEqual(servers, ['replica0', 'replica1'] * 2)
+        storage.sadd('ReplicaRoutingTests:set', 'a')
+        self.assertEqual(self.primary.smembers('ReplicaRoutingTests:set'),
+                         set(['a']))
+        wait_for(lambda: all(replica.exists('ReplicaRoutingTests:set')
+                             for replica in self.replicas))
+        self.assertEqual(storage.smembers('ReplicaRoutingTests:set'),
+                         set(['a']))
+
+    def test_other_endpoints(self):
+        """
+        Test replicas only serve the endpoint they are configured for
+        """
+        settings.database.replicas = self.replicas_setting(
+            '127.0.0.1:{}/1'.format(self.primary_port))
+        self.assertIsNone(self.storage().get('ReplicaRoutingTests:server'))
+        self.assertIsNone(Storage.replica_set('127.0.0.1', free_port(), 0))
+        self.assertIsNotNone(Storage.replica_set('127.0.0.1',
+                                                 self.primary_port, 1))
+
+    def test_no_tolerance(self):
+        """
+        Test reads stay on the primary without staleness tolerance
+        """
+        settings.database.max_staleness = 0
+        storage = self.storage()
+        self.assertIsNone(storage.get('ReplicaRoutingTests:server'))
+
+    def test_scan_on_primary(self):
+        """
+        Test scans never read replicas, which may miss new keys
+        """
+        storage = self.storage()
+        self.assertEqual(list(storage.scan_iter('ReplicaRoutingTests:*')),
+                         [])
+        self.primary.set('ReplicaRoutingTests:primary', 'primary')
+        self.assertEqual(list(storage.scan_iter('ReplicaRoutingTests:*')),
+                         ['ReplicaRoutingTests:primary'])
+
+    def test_detached_replica(self):
+        """
+        Test a replica that lost its primary is skipped
+        """
+        replica = self.replicas[0]
+        replica.execute_command('REPLICAOF', 'NO', 'ONE')
+        try:
+            storage = self.storage()
+            servers = set(storage.get('ReplicaRoutingTests:server')
+                          for _ in range(4))
+            self.assertEqual(servers, set(['replica1']))
+        finally:
+            replica.execute_command('REPLICAOF', '127.0.0.1',
+                                    str(self.primary_port))
+            wait_for(lambda: replica.info('replication')
+                     .get('master_link_status') == 'up')
+
+    def test_unreachable_replica(self):
+        """
+        Test reads fall back on the primary when replicas are unreachable
+        """
+        settings.database.replicas = '127.0.0.1:{}=127.0.0.1:{}'.format(
+            self.primary_port, free_port())
+        storage = self.storage()
+        self.primary.set('ReplicaRoutingTests:server', 'primary')
+        self.assertEqual(storage.get('ReplicaRoutingTests:server'),
+                         'primary')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,407 @@
+# -*- coding: utf8 -*-
+# test_storage.py
+# Test the feet.storage module
+#
+# Author:   Romary Dupuis <romary.dupuis@altarika.com>
+#
+# Copyright (C) 2016 Romary Dupuis
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl.html
+
+import os
+import shutil
+import tempfile
+import unittest
+from tornado.testing import AsyncTestCase, gen_test
+from feet.config import settings
+from feet.storage import Storage, StoreException, get_storage
+from feet.storage.memory import MemoryStorage
+from feet.storage.sqlite import SQLiteStorage
+from feet.storage.asynchronous import AsyncStorage
+from feet.storage.metrics import collect, response_size
+from feet.entities.dictionary import Dictionary
+from feet.entities.registry import Registry
+
+
+class StorageTests(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        Registry.flush('StorageTests', redis_db=0)
+        Registry.flush('StorageTests', redis_db=1)
+
+    def test_shared_connection_pool(self):
+        """
+        Test storages on the same endpoint share one connection pool
+        """
+        first = Storage(redis_db=0)
+        second = Storage(redis_db=0)
+        self.assertIs(first.redis_server.connection_pool,
+                      second.redis_server.connection_pool)
+        self.assertEqual(first.redis_server.connection_pool.max_connections,
+                         settings.database.pool_size)
+
+    def test_connection_pool_per_database(self):
+        """
+        Test each database gets its own connection pool
+        """
+        first = Storage(redis_db=0)
+        second = Storage(redis_db=1)
+        self.assertIsNot(first.redis_server.connection_pool,
+                         second.redis_server.connection_pool)
+        Registry.find_or_create('test_connection_pool_per_database',
+                                key_prefix='StorageTests', redis_db=1)
+        self.assertEqual(Registry.list('StorageTests', redis_db=0), [])
+        self.assertEqual(Registry.list('StorageTests', redis_db=1),
+                         ['test_connection_pool_per_database'])
+
+    def test_delete_pattern(self):
+        """
+        Test keys matching a pattern are scanned and unlinked by batches
+        """
+        storage = Storage()
+        for idx in range(25):
+            storage.sadd('StorageTests:delete:{}'.format(idx), 'a')
+        storage.sadd('StorageTests:keep', 'a')
+        progress = []
+        self.assertEqual(storage.delete_pattern('StorageTests:delete:*',
+                                                count=10,
+                                                progress=progress.append),
+                         25)
+        self.assertEqual(progress[-1], 25)
+        self.assertEqual(storage.keys('StorageTests:delete:*'), [])
+        self.assertEqual(storage.exists('StorageTests:keep'), 1)
+
+    def test_setbits(self):
+        """
+        Test bits are set in one BITFIELD command
+        """
+        storage = Storage()
+        self.assertEqual(storage.setbits('StorageTests:bits', [1, 9]), 2)
+        self.assertEqual(storage.setbits('StorageTests:bits', []), 0)
+        self.assertEqual(storage.get('StorageTests:bits'), '\x40\x40')
+
+
+class MetricsTests(unittest.TestCase):
+    def tearDown(self):
+        Registry.flush('MetricsTests')
+
+    def test_commands_by_caller(self):
+        """
+        Test commands are recorded under the dictionary method issuing them
+        """
+        dictionary = Dictionary('test_commands_by_caller',
+                                key_prefix='MetricsTests')
+        dictionary.load_list(['New York', 'Paris'], 'en')
+        with collect() as commands:
+            dictionary.candidates('york', 'en')
+        snapshot = commands.snapshot()
+        self.assertEqual(snapshot.keys(), ['Dictionary.candidates'])
+        stats = snapshot['Dictionary.candidates']['SMEMBERS']
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['round_trips'], 1)
+        self.assertEqual(sum(stats['histogram']), 1)
+        self.assertGreater(stats['bytes'], 0)
+        self.assertGreaterEqual(commands.round_trips(), 2)
+
+    def test_pipelined_commands(self):
+        """
+        Test pipelined commands are counted apart from the round trip
+        """
+        dictionary = Dictionary('test_pipelined_commands',
+                                key_prefix='MetricsTests')
+        dictionary.load_list(['New York', 'Paris', 'Tokyo'], 'en')
+        with collect() as commands:
+            dictionary.delete_terms(['Paris', 'Tokyo'], 'en')
+        stats = commands.snapshot()['Dictionary.delete_terms']
+        self.assertEqual(stats['PIPELINE']['round_trips'], 1)
+        self.assertEqual(stats['HGET']['calls'], 2)
+        self.assertEqual(stats['HGET']['round_trips'], 0)
+
+    def test_batch_in_one_script(self):
+        """
+        Test a batch of terms is written by one script, without WATCH
+        """
+        dictionary = Dictionary('test_batch_in_one_script',
+                                key_prefix='MetricsTests')
+        dictionary.load_list(['New York'], 'en')
+        with collect() as commands:
+            dictionary.load_list(['New York', 'Paris', 'Tokyo'], 'en')
+            dictionary.delete_terms(['Paris', 'Tokyo'], 'en')
+        stats = commands.snapshot()
+        for name in ('Dictionary.load_terms', 'Dictionary.delete_terms'):
+            self.assertEqual(stats[name]['EVALSHA']['calls'], 1)
+            self.assertEqual(stats[name]['EVALSHA']['round_trips'], 1)
+        self.assertEqual(commands.calls('WATCH'), 0)
+        self.assertEqual(commands.calls('MULTI'), 0)
+        self.assertEqual(dictionary.terms('en'), ['New York'])
+
+    def test_response_size(self):
+        """
+        Test the size of responses
+        """
+        self.assertEqual(response_size(None), 0)
+        self.assertEqual(response_size('abc'), 3)
+        self.assertEqual(response_size(set(['ab', 'c'])), 3)
+        self.assertEqual(response_size([1, ['ab']]), 3)
+
+
+class MemoryStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.storage = MemoryStorage(redis_db=15)
+
+    def tearDown(self):
+        for key in self.storage.keys('MemoryStorageTests:*'):
+            self.storage.delete(key)
+
+    def test_get_storage(self):
+        """
+        Test the backend is selected by name
+        """
+        self.assertIsInstance(get_storage(backend='memory'), MemoryStorage)
+        self.assertIsInstance(get_storage(backend='redis'), Storage)
+
+    def test_shared_data(self):
+        """
+        Test storages on the same endpoint share their data
+        """
+        self.storage.incr('MemoryStorageTests:counter')
+        self.assertEqual(MemoryStorage(redis_db=15)
+                         .get('MemoryStorageTests:counter'), '1')
+        self.assertIsNone(MemoryStorage(redis_db=14)
+                          .get('MemoryStorageTests:counter'))
+
+    def test_sets(self):
+        """
+        Test set commands
+        """
+        key = 'MemoryStorageTests:set'
+        self.assertEqual(self.storage.sadd(key, 'a'), 1)
+        self.assertEqual(self.storage.sadd(key, 'a'), 0)
+        self.assertEqual(self.storage.sadd(key, u'b'), 1)
+        self.assertEqual(self.storage.smembers(key), set(['a', 'b']))
+        self.assertEqual(self.storage.srem(key, 'a'), 1)
+        self.assertEqual(self.storage.srem(key, 'b'), 1)
+        self.assertEqual(self.storage.exists(key), 0)
+        self.assertEqual(self.storage.smembers(key), set())
+
+    def test_lists(self):
+        """
+        Test list commands
+        """
+        key = 'MemoryStorageTests:list'
+        for value in ['a', 'b', 'a', 'c']:
+            self.storage.rpush(key, value)
+        self.assertEqual(self.storage.lrange(key, 0, -1),
+                         ['a', 'b', 'a', 'c'])
+        self.assertEqual(self.storage.lrange(key, 1, 2), ['b', 'a'])
+        self.assertEqual(self.storage.lrem(key, 0, 'a'), 2)
+        self.assertEqual(self.storage.lrange(key, 0, 10), ['b', 'c'])
+
+    def test_sorted_sets(self):
+        """
+        Test lexicographic sorted set commands
+        """
+        key = 'MemoryStorageTests:zset'
+        self.assertEqual(self.storage.zadd(key, 0, 'b', 0, 'd', 0, 'a'), 3)
+        self.assertEqual(self.storage.zadd(key, 0, 'c', 0, 'a'), 1)
+        self.assertEqual(self.storage.zcard(key), 4)
+        self.assertEqual(self.storage.zrange(key, 1, 2), ['b', 'c'])
+        self.assertEqual(self.storage.zrange(key, 0, -1),
+                         ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.storage.zrangebylex(key, '(a', '+', 0, 2),
+                         ['b', 'c'])
+        self.assertEqual(self.storage.zrangebylex(key, '[b', '[c'),
+                         ['b', 'c'])
+        self.assertEqual(self.storage.zrangebylex(key, '-', '(b'), ['a'])
+        self.assertEqual(self.storage.zrem(key, 'a', 'z'), 1)
+        self.assertEqual(self.storage.zrem(key, 'b', 'c', 'd'), 3)
+        self.assertEqual(self.storage.exists(key), 0)
+        self.assertEqual(self.storage.zrange(key, 0, -1), [])
+
+    def test_setbits(self):
+        """
+        Test bits are set like SETBIT
+        """
+        key = 'MemoryStorageTests:bits'
+        self.assertEqual(self.storage.setbits(key, [1, 9, 9]), 2)
+        self.assertEqual(self.storage.get(key), '\x40\x40')
+        self.assertEqual(self.storage.setbits(key, [0, 1]), 1)
+        self.assertEqual(self.storage.get(key), '\xc0\x40')
+
+    def test_hashes(self):
+        """
+        Test hash and string commands
+        """
+        key = 'MemoryStorageTests:hash'
+        self.assertEqual(self.storage.hset(key, 'a', 1), 1)
+        self.assertEqual(self.storage.hset(key, u'b', 'x'), 1)
+        self.assertEqual(self.storage.hset(key, 'a', 2), 0)
+        self.assertEqual(self.storage.hget(key, 'a'), '2')
+        self.assertTrue(self.storage.hexists(key, 'b'))
+        self.assertEqual(self.storage.hmget(key, ['a', 'c', 'b']),
+                         ['2', None, 'x'])
+        self.assertEqual(self.storage.hgetall(key), {'a': '2', 'b': 'x'})
+        self.assertEqual(self.storage.hgetall('MemoryStorageTests:none'), {})
+        self.storage.set('MemoryStorageTests:string', 'abc')
+        self.assertEqual(self.storage.mget('MemoryStorageTests:string', key,
+                                           'MemoryStorageTests:none'),
+                         ['abc', None, None])
+        self.assertEqual(self.storage.hdel(key, 'a'), 1)
+        self.assertEqual(self.storage.hdel(key, 'b'), 1)
+        self.assertEqual(self.storage.exists(key), 0)
+        counter = 'MemoryStorageTests:counter'
+        self.assertTrue(self.storage.setnx(counter, 1))
+        self.assertFalse(self.storage.setnx(counter, 5))
+        self.assertEqual(self.storage.incrby(counter, 10), 11)
+        self.assertGreater(self.storage.memory_usage([counter]), 0)
+
+    def test_delete_pattern(self):
+        """
+        Test keys matching a pattern are deleted
+        """
+        for idx in range(5):
+            self.storage.rpush('MemoryStorageTests:delete:{}'.format(idx), 'a')
+        self.storage.rpush('MemoryStorageTests:keep', 'a')
+        self.assertEqual(self.storage.delete_pattern(
+            'MemoryStorageTests:delete:*', count=2), 5)
+        self.assertEqual(self.storage.keys('MemoryStorageTests:*'),
+                         ['MemoryStorageTests:keep'])
+
+    def test_wrong_type(self):
+        """
+        Test commands against a key holding the wrong kind of value
+        """
+        self.storage.sadd('MemoryStorageTests:set', 'a')
+        self.assertRaises(StoreException, self.storage.get,
+                          'MemoryStorageTests:set')
+
+    def test_transaction(self):
+        """
+        Test transaction runs watched commands immediately and queued ones
+        on execute
+        """
+        key = 'MemoryStorageTests:transaction'
+
+        def transaction(pipe):
+            if pipe.exists(key) == 0:
+                pipe.multi()
+                pipe.sadd(key, 'a')
+                pipe.incr(key + ':count')
+                return True
+            return False
+
+        self.assertTrue(self.storage.transaction(transaction, key,
+                                                 value_from_callable=True))
+        self.assertEqual(self.storage.transaction(transaction, key), [])
+        self.assertEqual(self.storage.get(key + ':count'), '1')
+        pipe = self.storage.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.smembers(key)
+        self.assertEqual(pipe.execute(), [1, set(['a'])])
+
+
+class SQLiteStorageTests(MemoryStorageTests):
+    """
+    Runs the memory storage tests against a SQLite file
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'feet.sqlite')
+        self.storage = SQLiteStorage(redis_db=15, path=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_storage(self):
+        """
+        Test the backend is selected by name
+        """
+        self.assertIsInstance(get_storage(backend='sqlite'), SQLiteStorage)
+
+    def test_shared_data(self):
+        """
+        Test storages on the same file share their data
+        """
+        self.storage.incr('MemoryStorageTests:counter')
+        self.assertEqual(SQLiteStorage(redis_db=15, path=self.path)
+                         .get('MemoryStorageTests:counter'), '1')
+        self.assertIsNone(SQLiteStorage(redis_db=14, path=self.path)
+                          .get('MemoryStorageTests:counter'))
+
+    def test_rollback(self):
+        """
+        Test a failing transaction leaves the file unchanged
+        """
+        key = 'MemoryStorageTests:rollback'
+
+        def transaction(pipe):
+            pipe.sadd(key, 'a')
+            raise ValueError()
+
+        self.assertRaises(ValueError, self.storage.transaction,
+                          transaction, key)
+        self.assertEqual(self.storage.exists(key), 0)
+
+    def test_scan(self):
+        """
+        Test keys are iterated by pages
+        """
+        for idx in range(5):
+            self.storage.sadd('MemoryStorageTests:{}'.format(idx), 'a')
+        self.assertEqual(list(self.storage.scan_iter('MemoryStorageTests:*',
+                                                     count=2)),
+                         ['MemoryStorageTests:{}'.format(idx)
+                          for idx in range(5)])
+
+
+class AsyncStorageTests(AsyncTestCase):
+    def tearDown(self):
+        Registry.flush('AsyncStorageTests')
+        super(AsyncStorageTests, self).tearDown()
+
+    @gen_test
+    def test_commands(self):
+        """
+        Test storage commands can be yielded from a coroutine
+        """
+        storage = AsyncStorage()
+        added = yield storage.sadd('AsyncStorageTests:set', 'a')
+        self.assertEqual(added, 1)
+        members = yield storage.smembers('AsyncStorageTests:set')
+        self.assertEqual(members, set(['a']))
+        pipe = storage.pipeline(transaction=False)
+        pipe.exists('AsyncStorageTests:set')
+        pipe.get('AsyncStorageTests:missing')
+        results = yield storage.execute(pipe)
+        self.assertEqual(results, [True, None])
+
+    @gen_test
+    def test_dictionary_lookups(self):
+        """
+        Test the coroutine versions of registry and dictionary lookups
+        """
+        registry = yield Registry.find_or_create_async(
+            'test_dictionary_lookups', key_prefix='AsyncStorageTests')
+        cities = yield registry.get_dict_async('cities')
+        cities.load_list(['New York', 'Paris'], 'en')
+        registries = yield Registry.list_async('AsyncStorageTests')
+        self.assertEqual(registries, ['test_dictionary_lookups'])
+        dictionaries = yield registry.dictionaries_async()
+        self.assertEqual(dictionaries, ['cities'])
+        languages = yield cities.languages_async()
+        self.assertEqual(languages, ['en'])
+        cardinality = yield cities.cardinality_async('en')
+        self.assertEqual(cardinality, 2)
+        exact_match = yield cities.exact_match_async('Paris', 'en')
+        self.assertTrue(exact_match)
+        candidates = yield cities.candidates_async('york', 'en')
+        self.assertEqual(candidates, set(['new york']))
+        tokens = yield cities.tokens_async('new york', 'en')
+        self.assertItemsEqual(tokens, ['New', 'York'])
+        terms = yield cities.terms_async('en', 0, 1)
+        self.assertEqual(terms, ['New York'])
+
+
+if __name__ == '__main__':
+    unittest.main()